@@ -0,0 +1,90 @@
+"""
+取得した HTML をローカルディスクに圧縮して保存するアーカイブ
+
+本文は内容のハッシュ値をキーにしたブロブとして保存し、ページの種類と識別子 (開催日 + 場コード + レース番号など) から
+最新のブロブへの参照を置く。
+
+    {root}/objects/ab/abcdef....html.gz
+    {root}/refs/{ページの種類}/{識別子}
+
+環境変数 HTML_ARCHIVE_MODE で動作を切り替える。
+
+- off: 何もしない (デフォルト)
+- record: 取得したページをアーカイブに保存する
+- replay: ネットワークにアクセスせず、アーカイブからページを返す
+"""
+
+import gzip
+import hashlib
+import os
+import tempfile
+from enum import Enum
+from pathlib import Path
+
+from metaboatrace.crawlers.exceptions import ArchivedPageNotFound
+from metaboatrace.crawlers.pages import detect_page_type, generate_page_identifier_str
+
+
+class ArchiveMode(Enum):
+    OFF = "off"
+    RECORD = "record"
+    REPLAY = "replay"
+
+
+def _write_atomically(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        Path(tmp_path).replace(path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+class HtmlArchive:
+    def __init__(self, root: Path, mode: ArchiveMode = ArchiveMode.RECORD) -> None:
+        self.root = root
+        self.mode = mode
+
+    @property
+    def is_recording(self) -> bool:
+        return self.mode == ArchiveMode.RECORD
+
+    @property
+    def is_replaying(self) -> bool:
+        return self.mode == ArchiveMode.REPLAY
+
+    def _ref_path(self, url: str) -> Path:
+        return self.root / "refs" / detect_page_type(url).value / generate_page_identifier_str(url)
+
+    def _object_path(self, digest: str) -> Path:
+        return self.root / "objects" / digest[:2] / f"{digest}.html.gz"
+
+    def store(self, url: str, html: str) -> str:
+        """HTML を保存してブロブのハッシュ値を返す"""
+        data = html.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+
+        object_path = self._object_path(digest)
+        # 同じ内容のページは一度だけ保存する
+        if not object_path.exists():
+            _write_atomically(object_path, gzip.compress(data, mtime=0))
+        _write_atomically(self._ref_path(url), digest.encode("ascii"))
+
+        return digest
+
+    def load(self, url: str) -> str:
+        try:
+            digest = self._ref_path(url).read_text(encoding="ascii").strip()
+            return gzip.decompress(self._object_path(digest).read_bytes()).decode("utf-8")
+        except FileNotFoundError as e:
+            raise ArchivedPageNotFound(url) from e
+
+
+def create_html_archive() -> HtmlArchive:
+    return HtmlArchive(
+        Path(os.environ.get("HTML_ARCHIVE_DIR", "./html_archive")),
+        ArchiveMode(os.environ.get("HTML_ARCHIVE_MODE", ArchiveMode.OFF.value)),
+    )
@@ -0,0 +1,163 @@
+"""
+取得した HTML のキャッシュ
+
+プロセス内のキャッシュ (L1) と、ワーカー間で共有する Redis のキャッシュ (L2) を重ねて使う。
+どの層を使うかは環境変数 HTML_CACHE_TIERS (例: "memory,redis") で切り替えられる。
+"""
+
+import logging
+import os
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Protocol
+from zoneinfo import ZoneInfo
+
+import redis
+from cachetools import TLRUCache
+
+from metaboatrace.crawlers.pages import PageType, detect_page_type, parse_race_holding_date
+from metaboatrace.crawlers.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# 当日分のページは内容が更新されうるので、更新頻度に合わせて短めにする
+PAGE_TYPE_TTLS: dict[PageType, int] = {
+    PageType.TRIFECTA_ODDS: 60,
+    PageType.RACE_BEFORE_INFORMATION: 120,
+    PageType.RACE_ENTRY: 300,
+    PageType.EVENT_HOLDING: 300,
+    # note: 直前情報ページからのフォールバックで結果が出る前のページを取得することがあるので、
+    # 結果ページの定期クロール（締切の20分後）までに期限が切れる長さにしておく
+    PageType.RACE_RESULT: 600,
+    PageType.PRE_INSPECTION_INFORMATION: 600,
+    PageType.MONTHLY_SCHEDULE: 3600,
+    PageType.RACER_PROFILE: 3600,
+    PageType.UNKNOWN: 300,
+}
+
+# 過去の開催日のページは内容が変わらないので長く持つ
+FINALIZED_PAGE_TTL = 86400
+
+jst = ZoneInfo("Asia/Tokyo")
+
+
+def ttl_for(url: str) -> int:
+    race_holding_date = parse_race_holding_date(url)
+    if race_holding_date is not None and race_holding_date < datetime.now(jst).date():
+        return FINALIZED_PAGE_TTL
+    return PAGE_TYPE_TTLS[detect_page_type(url)]
+
+
+class HtmlCacheTier(Protocol):
+    def get(self, url: str) -> tuple[str, float] | None:
+        """キャッシュされた HTML と残りの有効期間 (秒) を返す。なければ None"""
+        ...
+
+    def set(self, url: str, html: str, ttl: float) -> None: ...
+
+
+class InProcessHtmlCache:
+    def __init__(self, maxsize: int = 10000) -> None:
+        # 値には (期限, HTML) を持たせて、ページごとに期限を変える
+        self._cache: TLRUCache[str, tuple[float, str]] = TLRUCache(
+            maxsize=maxsize, ttu=lambda _key, value, _now: value[0]
+        )
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> tuple[str, float] | None:
+        with self._lock:
+            entry = self._cache.get(url)
+        if entry is None:
+            return None
+        expires_at, html = entry
+        return html, expires_at - time.monotonic()
+
+    def set(self, url: str, html: str, ttl: float) -> None:
+        with self._lock:
+            self._cache[url] = (time.monotonic() + ttl, html)
+
+
+class RedisHtmlCache:
+    KEY_PREFIX = "metaboatrace:html:"
+
+    def __init__(self, client: redis.Redis | None = None, retry_interval: float = 60) -> None:
+        self._client = client
+        self._retry_interval = retry_interval
+        self._unavailable_until = 0.0
+
+    @property
+    def client(self) -> redis.Redis:
+        return self._client if self._client is not None else get_redis_client()
+
+    def get(self, url: str) -> tuple[str, float] | None:
+        if self._is_unavailable():
+            return None
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            pipeline.get(self.KEY_PREFIX + url)
+            pipeline.pttl(self.KEY_PREFIX + url)
+            compressed, pttl = pipeline.execute()
+        except redis.RedisError as e:
+            self._mark_unavailable(e)
+            return None
+
+        if compressed is None:
+            return None
+        return zlib.decompress(compressed).decode("utf-8"), max(pttl, 0) / 1000
+
+    def set(self, url: str, html: str, ttl: float) -> None:
+        if self._is_unavailable():
+            return
+        try:
+            self.client.set(
+                self.KEY_PREFIX + url, zlib.compress(html.encode("utf-8")), px=int(ttl * 1000)
+            )
+        except redis.RedisError as e:
+            self._mark_unavailable(e)
+
+    def _is_unavailable(self) -> bool:
+        return time.monotonic() < self._unavailable_until
+
+    def _mark_unavailable(self, e: Exception) -> None:
+        # Redis が落ちていてもクロール自体は続けられるように、しばらくこの層を飛ばす
+        logger.warning(f"Redis HTML cache is unavailable, skipping it for a while: {e}")
+        self._unavailable_until = time.monotonic() + self._retry_interval
+
+
+class TieredHtmlCache:
+    def __init__(self, tiers: list[HtmlCacheTier]) -> None:
+        self._tiers = tiers
+
+    def get(self, url: str) -> str | None:
+        for i, tier in enumerate(self._tiers):
+            entry = tier.get(url)
+            if entry is None:
+                continue
+
+            html, remaining_ttl = entry
+            # 下の層で見つかったものは上の層にも残りの有効期間だけ載せておく
+            if remaining_ttl > 0:
+                for upper_tier in self._tiers[:i]:
+                    upper_tier.set(url, html, remaining_ttl)
+            return html
+        return None
+
+    def set(self, url: str, html: str) -> None:
+        ttl = ttl_for(url)
+        for tier in self._tiers:
+            tier.set(url, html, ttl)
+
+
+def create_html_cache() -> TieredHtmlCache:
+    tiers: list[HtmlCacheTier] = []
+    for name in os.environ.get("HTML_CACHE_TIERS", "memory,redis").split(","):
+        name = name.strip()
+        if name == "memory":
+            tiers.append(InProcessHtmlCache())
+        elif name == "redis":
+            tiers.append(RedisHtmlCache())
+        elif name:
+            raise ValueError(f"Unknown HTML cache tier: {name}")
+    return TieredHtmlCache(tiers)
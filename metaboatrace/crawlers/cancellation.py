@@ -0,0 +1,60 @@
+"""
+中止になったレースの記録
+
+レースが中止になると、その日のそれ以降のレースのタスクは実行しても意味がない。
+タスクをワーカーごとに revoke する代わりに、中止になったレースを generate_race_identifier_str をキーにして Redis に1回だけ記録し、
+レースのタスクはページを取得する前に記録を確認して、中止になっていれば何もせずに終わる。
+"""
+
+import logging
+import time
+from collections.abc import Iterable
+from datetime import date
+
+import redis
+
+from metaboatrace.crawlers.pages import generate_race_identifier_str
+from metaboatrace.crawlers.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "metaboatrace:canceled_race:"
+
+# note: 記録を確認するのは開催日のうちだけなので、日をまたいでも残る長さにしておく
+CANCELLATION_TTL = 2 * 86400
+
+RETRY_INTERVAL = 60
+
+_unavailable_until = 0.0
+
+
+def _key(race_holding_date: date, stadium_tel_code: int, race_number: int) -> str:
+    return KEY_PREFIX + generate_race_identifier_str(
+        race_holding_date, stadium_tel_code, race_number
+    )
+
+
+def record_race_cancellations(
+    race_holding_date: date, stadium_tel_code: int, race_numbers: Iterable[int]
+) -> None:
+    """指定したレースを中止として記録する。1回の往復でまとめて書き込む"""
+    pipeline = get_redis_client().pipeline(transaction=False)
+    for race_number in race_numbers:
+        pipeline.set(_key(race_holding_date, stadium_tel_code, race_number), 1, ex=CANCELLATION_TTL)
+    pipeline.execute()
+
+
+def is_race_canceled(race_holding_date: date, stadium_tel_code: int, race_number: int) -> bool:
+    """中止として記録されていれば True。Redis が使えない場合は False (ページを取得して確かめる)"""
+    global _unavailable_until
+    if time.monotonic() < _unavailable_until:
+        return False
+    try:
+        return bool(
+            get_redis_client().exists(_key(race_holding_date, stadium_tel_code, race_number))
+        )
+    except redis.RedisError as e:
+        # note: Redis が落ちている間にタスクごとにタイムアウトを待たないよう、しばらくは確認を飛ばす
+        logger.warning(f"Failed to check the race cancellation, skipping it for a while: {e}")
+        _unavailable_until = time.monotonic() + RETRY_INTERVAL
+        return False
@@ -1,12 +1,72 @@
+import logging
+import os
+import time
+from typing import Any
+
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import (
+    task_postrun,
+    task_prerun,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_shutdown,
+)
+from kombu import Queue
+
+from metaboatrace.crawlers.redis_client import get_redis_url
+from metaboatrace.orm.database import (
+    ReadSession,
+    Session,
+    get_pool_stats,
+    get_replica_pool_stats,
+    reset_engine,
+)
+from metaboatrace.repositories.buffer import flush_write_behind_buffer
+from metaboatrace.repositories.spool import close_spool_writer
+
+logger = logging.getLogger(__name__)
 
 app = Celery(
     "metaboatrace.crawlers",
-    broker="redis://localhost:6379/0",
+    broker=get_redis_url(),
+    # note: chord でサブタスクの結果をまとめるのに使う。結果が必要なタスクだけ ignore_result=False にする
+    backend=get_redis_url(),
     include=["metaboatrace.crawlers.scheduler"],
 )
 app.conf.timezone = "UTC"
+app.conf.task_ignore_result = True
+app.conf.result_expires = 86400
+
+# note: 締切に間に合わせる必要のあるタスクが、大量にキューに入った一括のクロールの後ろで待たされないようにキューを分ける
+LIVE_QUEUE = "live"
+RESULT_QUEUE = "results"
+BULK_QUEUE = "bulk"
+
+app.conf.task_queues = (Queue(LIVE_QUEUE), Queue(RESULT_QUEUE), Queue(BULK_QUEUE))
+app.conf.task_default_queue = BULK_QUEUE
+app.conf.task_routes = {
+    # 締切の直前に取得する出走表・直前情報・オッズと、それらを予約・キューに入れるタスク
+    "metaboatrace.crawlers.official.website.v1707.race.crawl_race_information_page": {
+        "queue": LIVE_QUEUE
+    },
+    "metaboatrace.crawlers.official.website.v1707.race.crawl_race_before_information_page": {
+        "queue": LIVE_QUEUE
+    },
+    "metaboatrace.crawlers.official.website.v1707.race.crawl_trifecta_odds_page": {
+        "queue": LIVE_QUEUE
+    },
+    "metaboatrace.crawlers.scheduler._race_task_failure_handler": {"queue": LIVE_QUEUE},
+    "metaboatrace.crawlers.scheduler.dispatch_due_race_tasks": {"queue": LIVE_QUEUE},
+    "metaboatrace.crawlers.scheduler.reserve_crawl_task_for_races_today": {"queue": LIVE_QUEUE},
+    # 結果は締切の後に取得するので、多少遅れても構わない
+    "metaboatrace.crawlers.official.website.v1707.race.crawl_race_result_page": {
+        "queue": RESULT_QUEUE
+    },
+    # 上記以外 (1日分の出走表の一括取得、開催日程、レーサーのプロフィールなど) は BULK_QUEUE に入る
+}
+# note: 1つのワーカーで複数のキューを扱う場合は、-Q に指定した順 (live,results,bulk) にキューを見る
+app.conf.broker_transport_options = {"queue_order_strategy": "priority"}
 
 app.conf.beat_schedule = {
     "crawl-events-every-month": {
@@ -25,8 +85,67 @@ app.conf.beat_schedule = {
         "task": "metaboatrace.crawlers.scheduler.reserve_crawl_task_for_races_today",
         "schedule": crontab(hour=23, minute=10),
     },
+    "dispatch-due-race-tasks": {
+        "task": "metaboatrace.crawlers.scheduler.dispatch_due_race_tasks",
+        "schedule": float(os.environ.get("DISPATCH_INTERVAL", "5")),
+        # note: ワーカーが止まっている間に溜まったこのタスクは捨てる。時刻の来た予約は次に実行されたものがまとめてキューに入れる
+        "options": {"expires": float(os.environ.get("DISPATCH_INTERVAL", "5"))},
+    },
     "crawl-incomplete-racers-every-5-minutes": {
         "task": "metaboatrace.crawlers.scheduler.enqueue_incomplete_racer_crawling",
         "schedule": crontab(minute="*/5"),
     },
 }
+
+
+@worker_process_init.connect
+def _reset_database_engine(**kwargs: Any) -> None:
+    # note: 子プロセスは親のコネクションプールを使わず、自分のプールを作る
+    reset_engine()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _flush_deferred_writes(**kwargs: Any) -> None:
+    # note: prefork の子プロセスは os._exit で終了し atexit が呼ばれないので、ここで溜まっている書き込みを反映する
+    flush_write_behind_buffer()
+    close_spool_writer()
+
+
+@task_prerun.connect
+def _open_database_session(**kwargs: Any) -> None:
+    # タスクの外で使われたまま残っているセッションがあれば捨てて、タスクごとに新しいセッションで始める
+    Session.remove()
+    ReadSession.remove()
+
+
+@task_postrun.connect
+def _remove_database_session(**kwargs: Any) -> None:
+    """
+    タスクが終わったら (失敗した場合も) セッションを閉じてコネクションをプールに返す。
+    リポジトリは Session() を閉じずに返すことがあるので、ここで閉じないとワーカーのスレッドが次のタスクまでコネクションを握り続ける
+    """
+    Session.remove()
+    ReadSession.remove()
+
+
+_pool_stats_logged_at = 0.0
+
+
+@task_postrun.connect
+def _log_database_pool_stats(**kwargs: Any) -> None:
+    """DB_POOL_STATS_INTERVAL 秒 (デフォルト 60) ごとに、ワーカープロセスのコネクションプールの状態をログに出す"""
+    global _pool_stats_logged_at
+    now = time.monotonic()
+    if now - _pool_stats_logged_at < float(os.environ.get("DB_POOL_STATS_INTERVAL", "60")):
+        return
+    _pool_stats_logged_at = now
+
+    stats = get_pool_stats()
+    if stats is not None:
+        logger.info("database pool stats (pid=%d): %s", os.getpid(), stats.as_dict())
+    replica_stats = get_replica_pool_stats()
+    if replica_stats is not None:
+        logger.info(
+            "replica database pool stats (pid=%d): %s", os.getpid(), replica_stats.as_dict()
+        )
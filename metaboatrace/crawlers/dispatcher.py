@@ -0,0 +1,180 @@
+"""
+締切に合わせて実行するタスクを、実行する時刻まで Redis に置いておくディスパッチャー
+
+apply_async(eta=...) で予約したタスクはすぐにワーカーに渡され、実行する時刻までワーカーのメモリーに溜まる。
+その間 prefetch の枠を占め、ブローカーの visibility timeout を超えると別のワーカーに配り直される。
+ここでは予約したタスクを Redis のソート済みセット (スコアは実行する時刻) に置いておき、
+beat が DISPATCH_INTERVAL 秒 (デフォルト 5) ごとに実行する scheduler.dispatch_due_race_tasks で、時刻の来たものだけをキューに入れる。
+
+- メンバーはタスク ID なので、同じ ID で予約し直すと実行する時刻が変わり、cancel で取り消せる
+- 予約は Redis に残るので、ワーカーや beat を再起動しても失われない。止まっている間に時刻が来たものは再開したときにキューに入れる
+- 時刻の来たタスクは Lua スクリプトで取り出すので、複数のプロセスから同時に呼んでも同じタスクを2回キューに入れない
+- 取り出したタスクはキューに入れ終わるまで処理中のソート済みセットに置き、入れ終わってから消す。
+  キューに入れる前にプロセスが落ちた場合は、CLAIM_TIMEOUT 秒 (デフォルト 60) 経ってから次の呼び出しで予約に戻す。
+  キューに入れた後、消す前に落ちた場合は同じタスクをもう一度キューに入れるが、タスクは upsert なので結果は変わらない
+"""
+
+import logging
+import time
+from datetime import UTC, datetime
+
+import redis
+from celery import Signature, signature
+from kombu.utils.json import dumps, loads
+from redis.commands.core import Script
+
+from metaboatrace.crawlers.celery import app
+from metaboatrace.crawlers.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+CLAIM_TIMEOUT = 60
+
+# note: 処理中のまま期限の過ぎたものを予約に戻してから、時刻の来たタスクの ID と予約した時刻とシグネチャを取り出して処理中に移す。
+# シグネチャはキューに入れ終わるまで消さない
+_POP_DUE_TASKS = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+for _, task_id in ipairs(expired) do
+    redis.call('ZREM', KEYS[3], task_id)
+    redis.call('ZADD', KEYS[1], 'NX', ARGV[1], task_id)
+end
+local task_ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local result = {}
+for _, task_id in ipairs(task_ids) do
+    local score = redis.call('ZSCORE', KEYS[1], task_id)
+    local payload = redis.call('HGET', KEYS[2], task_id)
+    redis.call('ZREM', KEYS[1], task_id)
+    if payload then
+        redis.call('ZADD', KEYS[3], ARGV[1] + ARGV[3], task_id)
+        table.insert(result, task_id)
+        table.insert(result, score)
+        table.insert(result, payload)
+    end
+end
+return result
+"""
+
+# note: キューに入れ終わったものを処理中から消す。その間に予約し直されていれば、新しいシグネチャは残す
+_ACK_DISPATCHED_TASKS = """
+for _, task_id in ipairs(ARGV) do
+    redis.call('ZREM', KEYS[3], task_id)
+    if not redis.call('ZSCORE', KEYS[1], task_id) then
+        redis.call('HDEL', KEYS[2], task_id)
+    end
+end
+"""
+
+# note: キューに入れられなかったものを予約した時刻のまま戻す。その間に取り消されたもの (処理中に残っていないもの) は戻さない
+_RESTORE_TASKS = """
+for i = 1, #ARGV, 2 do
+    if redis.call('ZREM', KEYS[3], ARGV[i]) == 1 then
+        redis.call('ZADD', KEYS[1], 'NX', ARGV[i + 1], ARGV[i])
+    end
+end
+"""
+
+
+class DelayedTaskDispatcher:
+    SCHEDULE_KEY = "metaboatrace:dispatch:schedule"
+    SIGNATURES_KEY = "metaboatrace:dispatch:signatures"
+    PROCESSING_KEY = "metaboatrace:dispatch:processing"
+
+    def __init__(self, client: redis.Redis | None = None) -> None:
+        self._client = client
+        self._scripts: dict[tuple[int, str], Script] = {}
+
+    @property
+    def client(self) -> redis.Redis:
+        return self._client if self._client is not None else get_redis_client()
+
+    def schedule(self, sig: Signature, eta: datetime) -> None:
+        """
+        シグネチャを eta にキューに入れるように予約する。タスク ID は sig の options に指定しておく。
+        同じタスク ID の予約があれば、シグネチャと時刻を置き換える。
+        タイムゾーンのない eta は、apply_async(eta=...) と同じく UTC として扱う
+        """
+        task_id = sig.options["task_id"]
+        if eta.tzinfo is None:
+            eta = eta.replace(tzinfo=UTC)
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.hset(self.SIGNATURES_KEY, task_id, dumps(dict(sig)))
+        pipeline.zadd(self.SCHEDULE_KEY, {task_id: eta.timestamp()})
+        pipeline.execute()
+
+    def cancel(self, task_id: str) -> bool:
+        """予約を取り消す。予約が残っていなかった (キューに入れた後か、予約していない) 場合は False"""
+        return not self.cancel_many([task_id])
+
+    def cancel_many(self, task_ids: list[str]) -> list[str]:
+        """予約をまとめて取り消し、予約が残っていなかったタスク ID を返す"""
+        if not task_ids:
+            return []
+        pipeline = self.client.pipeline(transaction=True)
+        for task_id in task_ids:
+            pipeline.zrem(self.SCHEDULE_KEY, task_id)
+        pipeline.zrem(self.PROCESSING_KEY, *task_ids)
+        pipeline.hdel(self.SIGNATURES_KEY, *task_ids)
+        *removed, _, _ = pipeline.execute()
+        return [task_id for task_id, count in zip(task_ids, removed, strict=True) if not count]
+
+    def eta_of(self, task_id: str) -> float | None:
+        """予約している時刻 (UNIX 時間) を返す。予約していなければ None"""
+        score: float | None = self.client.zscore(self.SCHEDULE_KEY, task_id)  # type: ignore[assignment]
+        return score
+
+    def pending(self) -> int:
+        count: int = self.client.zcard(self.SCHEDULE_KEY)  # type: ignore[assignment]
+        return count
+
+    def dispatch_due(
+        self,
+        now: float | None = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        claim_timeout: float = CLAIM_TIMEOUT,
+    ) -> int:
+        """時刻の来たタスクをキューに入れ、入れた数を返す"""
+        now = time.time() if now is None else now
+        dispatched = 0
+        while True:
+            result = self._run_script(_POP_DUE_TASKS, now, batch_size, claim_timeout)
+            entries = [
+                (result[i].decode(), float(result[i + 1]), result[i + 2].decode())
+                for i in range(0, len(result), 3)
+            ]
+            dispatched_task_ids: list[str] = []
+            try:
+                for index, (task_id, _, payload) in enumerate(entries):
+                    try:
+                        signature(loads(payload), app=app).apply_async()
+                    except Exception:
+                        # note: キューに入れられなかったものは、予約した時刻のまま戻して次の呼び出しでやり直す
+                        self._restore(entries[index:])
+                        logger.exception("Failed to dispatch %s", task_id)
+                        raise
+                    dispatched_task_ids.append(task_id)
+            finally:
+                if dispatched_task_ids:
+                    self._run_script(_ACK_DISPATCHED_TASKS, *dispatched_task_ids)
+            dispatched += len(dispatched_task_ids)
+            if len(entries) < batch_size:
+                return dispatched
+
+    def _restore(self, entries: list[tuple[str, float, str]]) -> None:
+        self._run_script(
+            _RESTORE_TASKS, *(value for task_id, score, _ in entries for value in (task_id, score))
+        )
+
+    def _run_script(self, source: str, *args: str | float) -> list[bytes]:
+        client = self.client
+        script = self._scripts.get((id(client), source))
+        if script is None:
+            # note: スクリプトの SHA1 の計算はクライアントごとに1回で済ませる
+            script = self._scripts[(id(client), source)] = client.register_script(source)
+        result: list[bytes] = script(
+            keys=[self.SCHEDULE_KEY, self.SIGNATURES_KEY, self.PROCESSING_KEY], args=list(args)
+        )
+        return result
+
+
+dispatcher = DelayedTaskDispatcher()
@@ -4,3 +4,7 @@ class IncompleteDataError(Exception):
 
 class RaceDeadlineChanged(Exception):
     pass
+
+
+class ArchivedPageNotFound(Exception):
+    pass
@@ -0,0 +1,57 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
+
+_session: requests.Session | None = None
+_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    # note: pool_maxsize はホストごとのコネクション数の上限
+    # pool_block=True にしておかないと上限を超えた分は使い捨てのコネクションになってしまう
+    adapter = HTTPAdapter(
+        pool_connections=int(os.environ.get("CRAWLER_HTTP_POOL_CONNECTIONS", "4")),
+        pool_maxsize=int(os.environ.get("CRAWLER_HTTP_POOL_MAXSIZE", "8")),
+        pool_block=True,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT})
+    return session
+
+
+def get_http_session() -> requests.Session:
+    """
+    プロセス内で共有する keep-alive 付きの HTTP セッションを返す。
+    初回呼び出し時に生成し、以降は同じコネクションプールを使い回す。
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def get_timeout() -> tuple[float, float]:
+    """(接続タイムアウト, 読み込みタイムアウト) を秒で返す"""
+    return (
+        float(os.environ.get("CRAWLER_HTTP_CONNECT_TIMEOUT", "10")),
+        float(os.environ.get("CRAWLER_HTTP_READ_TIMEOUT", "30")),
+    )
+
+
+def _reset_after_fork() -> None:
+    # note: Celery の prefork で fork された子プロセスが親のソケットを共有しないように作り直す
+    # 親のセッションは close しない（TLS のコネクションを子から閉じると親側の通信が壊れうる）
+    global _session, _lock
+    _session = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
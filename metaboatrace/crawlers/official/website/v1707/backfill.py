@@ -0,0 +1,285 @@
+"""
+過去の期間のデータを並行にクロールするための asyncio ベースのエンジン
+
+ページの取得はサイト全体のリクエスト予算 (PolitenessBudget) の範囲内で並行に行い、
+取得したページの解析 (scrape_* 関数) と DB への書き込み (save_* 関数) はスレッドプールで行う。
+環境変数 REPOSITORY_BACKEND=async の場合は、DB への書き込みだけを asyncpg の上で動かし、
+書き込みを待つ間もイベントループでページの取得を進める。解析はこの場合もスレッドプールで行い、イベントループを止めない。
+scrape_* 関数は fetch_html_as_io のキャッシュに載った HTML を使うので、同じページを二度取得することはない。
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, TypeVar
+
+from metaboatrace.crawlers.official.website.v1707.race import (
+    save_race_before_information_page,
+    save_race_information_page,
+    save_race_result_page,
+    save_trifecta_odds_page,
+    scrape_race_before_information_page,
+    scrape_race_information_page,
+    scrape_race_result_page,
+    scrape_trifecta_odds_page,
+)
+from metaboatrace.crawlers.official.website.v1707.stadium import (
+    crawl_event_holding_page,
+    save_pre_inspection_information_page,
+    scrape_events_from_monthly_schedule_page,
+    scrape_pre_inspection_information_page,
+)
+from metaboatrace.crawlers.utils import fetch_html_as_io
+from metaboatrace.models.stadium import EventHolding, EventHoldingStatus
+from metaboatrace.orm.async_database import dispose_async_engine, run_with_async_session
+from metaboatrace.repositories import EventRepository, RaceRepository
+from metaboatrace.scrapers.official.website.exceptions import DataNotFound, RaceCanceled
+from metaboatrace.scrapers.official.website.v1707.pages.event_holding_page.location import (
+    create_event_holding_page_url,
+)
+from metaboatrace.scrapers.official.website.v1707.pages.monthly_schedule_page.location import (
+    create_monthly_schedule_page_url,
+)
+from metaboatrace.scrapers.official.website.v1707.pages.pre_inspection_information_page.location import (
+    create_event_entry_page_url,
+)
+from metaboatrace.scrapers.official.website.v1707.pages.race.before_information_page.location import (
+    create_race_before_information_page_url,
+)
+from metaboatrace.scrapers.official.website.v1707.pages.race.entry_page.location import (
+    create_race_entry_page_url,
+)
+from metaboatrace.scrapers.official.website.v1707.pages.race.odds.trifecta_page.location import (
+    create_odds_page_url,
+)
+from metaboatrace.scrapers.official.website.v1707.pages.race.result_page.location import (
+    create_race_result_page_url,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RACE_NUMBERS = range(1, 13)
+
+
+class PolitenessBudget:
+    """
+    公式サイトへのリクエストの予算
+
+    同時に発行するリクエストの数と、リクエストを開始する間隔 (1秒あたりのリクエスト数) の両方を制限する。
+    """
+
+    def __init__(self, requests_per_second: float, max_concurrency: int) -> None:
+        self._interval = 1 / requests_per_second
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+
+    async def __aenter__(self) -> None:
+        await self._semaphore.acquire()
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self._interval
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                self._semaphore.release()
+                raise
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        self._semaphore.release()
+
+
+@dataclass
+class BackfillReport:
+    crawled_races: int = 0
+    canceled_races: int = 0
+    failures: list[str] = field(default_factory=list)
+
+
+def _race_page_urls(event_holding: EventHolding, date: date, race_number: int) -> list[str]:
+    stadium_tel_code = event_holding.stadium_tel_code
+    return [
+        create_race_entry_page_url(date, stadium_tel_code, race_number),
+        create_race_before_information_page_url(date, stadium_tel_code, race_number),
+        create_race_result_page_url(date, stadium_tel_code, race_number),
+        create_odds_page_url(date, stadium_tel_code, race_number),
+    ]
+
+
+class PeriodCrawler:
+    """
+    指定した期間のデータを並行にクロールする
+
+    :param requests_per_second: 公式サイトへのリクエストの上限 (1秒あたり)
+    :param max_concurrency: 同時に発行するリクエストの上限
+    :param max_dates_in_flight: 同時に処理する開催日の数
+    :param db_workers: 解析と DB への書き込みを行うスレッドの数 (REPOSITORY_BACKEND=async の場合は解析だけを行う)
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float = 1.0,
+        max_concurrency: int = 8,
+        max_dates_in_flight: int = 2,
+        db_workers: int = 4,
+    ) -> None:
+        self._requests_per_second = requests_per_second
+        self._max_concurrency = max_concurrency
+        self._max_dates_in_flight = max_dates_in_flight
+        self._db_workers = db_workers
+        self._use_async_repository = os.environ.get("REPOSITORY_BACKEND", "sync") == "async"
+
+    def run(self, start_date: date, end_date: date) -> BackfillReport:
+        return asyncio.run(self.crawl(start_date, end_date))
+
+    async def crawl(self, start_date: date, end_date: date) -> BackfillReport:
+        self._budget = PolitenessBudget(self._requests_per_second, self._max_concurrency)
+        self._dates_in_flight = asyncio.Semaphore(self._max_dates_in_flight)
+        self._report = BackfillReport()
+
+        total_days = (end_date - start_date).days + 1
+        with (
+            ThreadPoolExecutor(self._max_concurrency, thread_name_prefix="fetch") as fetchers,
+            ThreadPoolExecutor(self._db_workers, thread_name_prefix="save") as savers,
+        ):
+            self._fetchers = fetchers
+            self._savers = savers
+            try:
+                await asyncio.gather(
+                    *(
+                        self._crawl_date(start_date + timedelta(days=day_offset))
+                        for day_offset in range(total_days)
+                    )
+                )
+            finally:
+                if self._use_async_repository:
+                    await dispose_async_engine()
+
+        return self._report
+
+    async def _fetch(self, url: str) -> None:
+        async with self._budget:
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    self._fetchers, fetch_html_as_io, url
+                )
+            except Exception as e:
+                # ここではキャッシュに載せるのが目的なのでエラーは握りつぶす
+                # 取得できなかったページは scrape_* 関数の中で改めて取得され、そこでエラーになる
+                logger.warning(f"Failed to prefetch {url}: {e}")
+
+    async def _prefetch(self, urls: list[str]) -> None:
+        await asyncio.gather(*(self._fetch(url) for url in urls))
+
+    async def _scrape(self, func: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._savers, func, *args)
+
+    async def _save(self, func: Callable[..., T], *args: Any) -> T:
+        if self._use_async_repository:
+            return await run_with_async_session(func, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._savers, func, *args)
+
+    async def _crawl_race(self, stadium_tel_code: int, date: date, race_number: int) -> None:
+        # note: 締切が変わっていても過去のレースなので、出走表はそのまま書き込めばよい
+        race_information_page = await self._scrape(
+            scrape_race_information_page, stadium_tel_code, date, race_number
+        )
+        await self._save(save_race_information_page, race_information_page)
+
+        race_before_information_page = await self._scrape(
+            scrape_race_before_information_page, stadium_tel_code, date, race_number
+        )
+        if not race_before_information_page.start_exhibition_records:
+            try:
+                race_result_page = await self._scrape(
+                    scrape_race_result_page, stadium_tel_code, date, race_number
+                )
+                await self._save(save_race_result_page, race_result_page)
+            except RaceCanceled:
+                raise
+            except Exception as e:
+                raise DataNotFound from e
+        await self._save(save_race_before_information_page, race_before_information_page)
+        if race_before_information_page.weather_condition_error is not None:
+            logger.info(
+                f"Partial data missing in race before information page "
+                f"for race {race_number} at {stadium_tel_code} on {date}"
+            )
+
+        race_result_page = await self._scrape(
+            scrape_race_result_page, stadium_tel_code, date, race_number
+        )
+        await self._save(save_race_result_page, race_result_page)
+
+        odds = await self._scrape(scrape_trifecta_odds_page, stadium_tel_code, date, race_number)
+        await self._save(save_trifecta_odds_page, odds)
+
+    async def _crawl_date(self, date: date) -> None:
+        async with self._dates_in_flight:
+            if date.day == 1:
+                await self._prefetch([create_monthly_schedule_page_url(date.year, date.month)])
+                events = await self._scrape(
+                    scrape_events_from_monthly_schedule_page, date.year, date.month
+                )
+                await self._save(EventRepository().create_or_update_many, events)
+
+            await self._prefetch([create_event_holding_page_url(date)])
+            event_holdings = await self._scrape(crawl_event_holding_page, date)
+            await asyncio.gather(
+                *(
+                    self._crawl_event_holding(date, e)
+                    for e in event_holdings
+                    if e.status == EventHoldingStatus.OPEN
+                )
+            )
+
+    async def _crawl_event_holding(self, date: date, event_holding: EventHolding) -> None:
+        stadium_tel_code = event_holding.stadium_tel_code
+
+        if event_holding.progress_day == 1:
+            await self._prefetch([create_event_entry_page_url(stadium_tel_code, date)])
+            try:
+                pre_inspection_information_page = await self._scrape(
+                    scrape_pre_inspection_information_page, stadium_tel_code.value, date
+                )
+                await self._save(
+                    save_pre_inspection_information_page, pre_inspection_information_page
+                )
+            except DataNotFound:
+                logger.warning(
+                    f"The pre inspection information page had not found at {stadium_tel_code.name} on {date}"
+                )
+
+        # note: 全レースのページの取得を先に始めておき、取得できたレースから順に書き込む
+        prefetches = [
+            asyncio.create_task(self._prefetch(_race_page_urls(event_holding, date, race_number)))
+            for race_number in RACE_NUMBERS
+        ]
+        try:
+            for race_number, prefetch in zip(RACE_NUMBERS, prefetches, strict=True):
+                await prefetch
+                try:
+                    await self._crawl_race(stadium_tel_code.value, date, race_number)
+                    self._report.crawled_races += 1
+                except RaceCanceled:
+                    await self._save(
+                        RaceRepository().cancel, stadium_tel_code.value, date, race_number
+                    )
+                    self._report.canceled_races += 1
+                    break
+                except Exception as e:
+                    message = f"Error crawling race {race_number} at {stadium_tel_code.name} on {date}: {e}"
+                    logger.error(message)
+                    self._report.failures.append(message)
+        finally:
+            for prefetch in prefetches:
+                prefetch.cancel()
@@ -1,11 +1,28 @@
-import time
+import logging
+from dataclasses import dataclass, field
 from datetime import date
 
+from celery import chord
+
+from metaboatrace.crawlers.cancellation import is_race_canceled
 from metaboatrace.crawlers.celery import app
 from metaboatrace.crawlers.exceptions import IncompleteDataError, RaceDeadlineChanged
 from metaboatrace.crawlers.utils import fetch_html_as_io
-from metaboatrace.models.race import BoatSetting, RaceEntry
+from metaboatrace.models.boat import BoatPerformance, MotorPerformance
+from metaboatrace.models.race import (
+    BoatSetting,
+    CircumferenceExhibitionRecord,
+    Odds,
+    Payoff,
+    RaceEntry,
+    RaceInformation,
+    RaceRecord,
+    StartExhibitionRecord,
+    WeatherCondition,
+)
+from metaboatrace.models.racer import RacerCondition, RacerPerformance
 from metaboatrace.models.stadium import StadiumTelCode
+from metaboatrace.orm.unit_of_work import unit_of_work
 from metaboatrace.repositories import (
     BoatBettingContributeRateAggregationRepository,
     BoatSettingRepository,
@@ -63,6 +80,8 @@ from metaboatrace.scrapers.official.website.v1707.pages.race.result_page.scrapin
     extract_weather_condition as extract_weather_condition_in_performance,
 )
 
+logger = logging.getLogger(__name__)
+
 
 def _create_boat_setting_from(race_entry: RaceEntry) -> BoatSetting:
     return BoatSetting(
@@ -76,150 +95,298 @@ def _create_boat_setting_from(race_entry: RaceEntry) -> BoatSetting:
     )
 
 
-@app.task
-def crawl_race_information_page(stadium_tel_code: int, date: date, race_number: int) -> None:
+@dataclass
+class RaceInformationPage:
+    race: RaceInformation
+    race_entries: list[RaceEntry]
+    boat_settings: list[BoatSetting]
+    boat_performances: list[BoatPerformance]
+    motor_performances: list[MotorPerformance]
+    racer_performances: list[RacerPerformance]
+    deadline_changed: bool
+
+
+def scrape_race_information_page(
+    stadium_tel_code: int, date: date, race_number: int
+) -> RaceInformationPage:
     url = create_race_entry_page_url(date, StadiumTelCode(stadium_tel_code), race_number)
     html_io = fetch_html_as_io(url)
     race = extract_race_information(html_io)
-    race_repository = RaceRepository()
-    race_repository.create_or_update(race)
 
     html_io.seek(0)
     race_entries = extract_race_entries(html_io)
-    race_entry_repository = RaceEntryRepository()
-    race_entry_repository.create_or_update_many(race_entries)
-
-    html_io.seek(0)
     boat_settings = [_create_boat_setting_from(race_entry) for race_entry in race_entries]
-    boat_setting_repository = BoatSettingRepository()
-    boat_setting_repository.create_or_update_many(boat_settings, ["boat_number", "motor_number"])
 
     html_io.seek(0)
     boat_performances = extract_boat_performances(html_io)
-    boat_betting_contribute_rate_aggregation_repository = (
-        BoatBettingContributeRateAggregationRepository()
-    )
-    boat_betting_contribute_rate_aggregation_repository.create_or_update_many(boat_performances)
 
     html_io.seek(0)
     motor_performances = extract_motor_performances(html_io)
-    motor_betting_contribute_rate_aggregation_repository = (
-        MotorBettingContributeRateAggregationRepository()
-    )
-    motor_betting_contribute_rate_aggregation_repository.create_or_update_many(motor_performances)
 
     html_io.seek(0)
     racer_performances = extract_racer_performances(html_io)
-    racer_winning_rate_aggregation_repository = RacerWinningRateAggregationRepository()
-    racer_winning_rate_aggregation_repository.create_or_update_many(racer_performances)
 
     html_io.seek(0)
-    if is_deadline_changed(html_io):
+    deadline_changed = is_deadline_changed(html_io)
+
+    return RaceInformationPage(
+        race,
+        race_entries,
+        boat_settings,
+        boat_performances,
+        motor_performances,
+        racer_performances,
+        deadline_changed,
+    )
+
+
+def save_race_information_page(page: RaceInformationPage) -> None:
+    # note: 途中で失敗したときに出走表が中途半端に書き込まれないように、1ページ分の書き込みは1トランザクションで済ませる
+    with unit_of_work():
+        race_repository = RaceRepository()
+        race_repository.create_or_update(page.race)
+
+        race_entry_repository = RaceEntryRepository()
+        race_entry_repository.create_or_update_many(page.race_entries)
+
+        boat_setting_repository = BoatSettingRepository()
+        boat_setting_repository.create_or_update_many(
+            page.boat_settings, ["boat_number", "motor_number"]
+        )
+
+        boat_betting_contribute_rate_aggregation_repository = (
+            BoatBettingContributeRateAggregationRepository()
+        )
+        boat_betting_contribute_rate_aggregation_repository.create_or_update_many(
+            page.boat_performances
+        )
+
+        motor_betting_contribute_rate_aggregation_repository = (
+            MotorBettingContributeRateAggregationRepository()
+        )
+        motor_betting_contribute_rate_aggregation_repository.create_or_update_many(
+            page.motor_performances
+        )
+
+        racer_winning_rate_aggregation_repository = RacerWinningRateAggregationRepository()
+        racer_winning_rate_aggregation_repository.create_or_update_many(page.racer_performances)
+
+
+@app.task
+def crawl_race_information_page(stadium_tel_code: int, date: date, race_number: int) -> None:
+    if is_race_canceled(date, stadium_tel_code, race_number):
+        return
+    page = scrape_race_information_page(stadium_tel_code, date, race_number)
+    save_race_information_page(page)
+
+    if page.deadline_changed:
         raise RaceDeadlineChanged
 
 
+@app.task(ignore_result=False)
+def _crawl_race_information_page_for_report(
+    stadium_tel_code: int, date: date, race_number: int
+) -> str | None:
+    """crawl_all_race_information_for_date_and_stadiums の1レース分。失敗した場合は、例外を投げずに内容を返す"""
+    try:
+        crawl_race_information_page(stadium_tel_code, date, race_number)
+    except Exception as e:
+        return f"{StadiumTelCode(stadium_tel_code).name} {race_number}R: {type(e).__name__}: {e}"
+    return None
+
+
+@app.task
+def _report_race_information_crawl(errors: list[str | None], date: date) -> None:
+    failures = [error for error in errors if error is not None]
+    if not failures:
+        logger.info(f"Crawled all {len(errors)} races on {date}")
+        return
+    # TODO: バグトラッキングシステムに通知
+    logger.error(
+        f"Failed to crawl {len(failures)} of {len(errors)} races on {date}:\n" + "\n".join(failures)
+    )
+
+
 @app.task
 def crawl_all_race_information_for_date_and_stadiums(
     date: date, stadium_tel_codes: list[StadiumTelCode]
 ) -> None:
-    for stadium_tel_code in stadium_tel_codes:
-        for race_number in range(1, 13):
-            try:
-                crawl_race_information_page(stadium_tel_code.value, date, race_number)
-                time.sleep(3)
-            except Exception as e:
-                # TODO: バグトラッキングシステムに通知
-                import logging
+    """
+    レースごとのサブタスクに分けて並行に取得し、すべて終わったら失敗したレースをまとめてログに出す。
+    公式サイトへのリクエストの間隔は、fetch_html_as_io が共有のレート制限 (rate_limit.py) で空ける
+    """
+    chord(
+        _crawl_race_information_page_for_report.s(stadium_tel_code.value, date, race_number)
+        for stadium_tel_code in stadium_tel_codes
+        for race_number in range(1, 13)
+    )(_report_race_information_crawl.s(date))
 
-                logger = logging.getLogger(__name__)
-                logger.error(
-                    f"Error crawling race {race_number} at {stadium_tel_code.name} on {date}: {e}"
-                )
 
+@dataclass
+class RaceBeforeInformationPage:
+    start_exhibition_records: list[StartExhibitionRecord]
+    circumference_exhibition_records: list[CircumferenceExhibitionRecord]
+    racer_conditions: list[RacerCondition] = field(default_factory=list)
+    boat_settings: list[BoatSetting] = field(default_factory=list)
+    weather_condition: WeatherCondition | None = None
+    weather_condition_error: ValueError | None = None
 
-@app.task
-def crawl_race_before_information_page(stadium_tel_code: int, date: date, race_number: int) -> None:
+
+def scrape_race_before_information_page(
+    stadium_tel_code: int, date: date, race_number: int
+) -> RaceBeforeInformationPage:
     url = create_race_before_information_page_url(
         date, StadiumTelCode(stadium_tel_code), race_number
     )
     html_io = fetch_html_as_io(url)
     start_exhibition_records = extract_start_exhibition_records(html_io)
-    if not start_exhibition_records:
-        try:
-            crawl_race_result_page(StadiumTelCode(stadium_tel_code), date, race_number)
-        except RaceCanceled:
-            raise
-        except Exception as e:
-            raise DataNotFound from e
-
-    start_exhibition_record_repository = StartExhibitionRecordRepository()
-    start_exhibition_record_repository.create_or_update_many(start_exhibition_records)
 
     html_io.seek(0)
     circumference_exhibition_records = extract_circumference_exhibition_records(html_io)
     if not circumference_exhibition_records:
-        raise RaceCanceled
-
-    circumference_exhibition_record_repository = CircumferenceExhibitionRecordRepository()
-    circumference_exhibition_record_repository.create_or_update_many(
-        circumference_exhibition_records
-    )
+        # note: 周回展示がなければ中止になっているので、ほかの項目は読まない
+        return RaceBeforeInformationPage(start_exhibition_records, circumference_exhibition_records)
 
     html_io.seek(0)
     racer_conditions = extract_racer_conditions(html_io)
-    racer_condition_repository = RacerConditionRepository()
-    racer_condition_repository.create_or_update_many(racer_conditions)
 
     html_io.seek(0)
     boat_settings = extract_boat_settings(html_io)
-    boat_setting_repository = BoatSettingRepository()
-    boat_setting_repository.create_or_update_many(boat_settings, ["tilt", "is_propeller_renewed"])
-
-    motor_maintenance_repsitory = MotorMaintenanceRepository()
-    motor_maintenance_repsitory.create_or_update_many(
-        [b for b in boat_settings if len(b.motor_parts_exchanges) > 0]
-    )
 
     html_io.seek(0)
+    weather_condition = None
+    weather_condition_error = None
     try:
         weather_condition = extract_weather_condition(html_io)
     except ValueError as e:
-        raise IncompleteDataError from e
-    weather_condition_repository = WeatherConditionRepository()
-    weather_condition_repository.create_or_update(weather_condition)
+        weather_condition_error = e
+
+    return RaceBeforeInformationPage(
+        start_exhibition_records,
+        circumference_exhibition_records,
+        racer_conditions,
+        boat_settings,
+        weather_condition,
+        weather_condition_error,
+    )
+
+
+def save_race_before_information_page(page: RaceBeforeInformationPage) -> None:
+    """周回展示がない (中止になった) 場合は、スタート展示の記録だけ書き込んで RaceCanceled を投げる"""
+    if not page.circumference_exhibition_records:
+        # note: スタート展示の後に中止になった場合も、スタート展示の記録は残しておく
+        start_exhibition_record_repository = StartExhibitionRecordRepository()
+        start_exhibition_record_repository.create_or_update_many(page.start_exhibition_records)
+        raise RaceCanceled
+
+    with unit_of_work():
+        start_exhibition_record_repository = StartExhibitionRecordRepository()
+        start_exhibition_record_repository.create_or_update_many(page.start_exhibition_records)
+
+        circumference_exhibition_record_repository = CircumferenceExhibitionRecordRepository()
+        circumference_exhibition_record_repository.create_or_update_many(
+            page.circumference_exhibition_records
+        )
+
+        racer_condition_repository = RacerConditionRepository()
+        racer_condition_repository.create_or_update_many(page.racer_conditions)
+
+        boat_setting_repository = BoatSettingRepository()
+        boat_setting_repository.create_or_update_many(
+            page.boat_settings, ["tilt", "is_propeller_renewed"]
+        )
+
+        motor_maintenance_repsitory = MotorMaintenanceRepository()
+        motor_maintenance_repsitory.create_or_update_many(
+            [b for b in page.boat_settings if len(b.motor_parts_exchanges) > 0]
+        )
+
+        if page.weather_condition is not None:
+            weather_condition_repository = WeatherConditionRepository()
+            weather_condition_repository.create_or_update(page.weather_condition)
 
 
 @app.task
-def crawl_trifecta_odds_page(stadium_tel_code: int, date: date, race_number: int) -> None:
+def crawl_race_before_information_page(stadium_tel_code: int, date: date, race_number: int) -> None:
+    if is_race_canceled(date, stadium_tel_code, race_number):
+        return
+    page = scrape_race_before_information_page(stadium_tel_code, date, race_number)
+    if not page.start_exhibition_records:
+        try:
+            crawl_race_result_page(stadium_tel_code, date, race_number)
+        except RaceCanceled:
+            raise
+        except Exception as e:
+            raise DataNotFound from e
+
+    save_race_before_information_page(page)
+
+    if page.weather_condition_error is not None:
+        raise IncompleteDataError from page.weather_condition_error
+
+
+def scrape_trifecta_odds_page(stadium_tel_code: int, date: date, race_number: int) -> list[Odds]:
     url = create_odds_page_url(date, StadiumTelCode(stadium_tel_code), race_number)
     html_io = fetch_html_as_io(url)
-    odds = extract_odds(html_io)
+    return extract_odds(html_io)
+
+
+def save_trifecta_odds_page(odds: list[Odds]) -> None:
     odds_repository = OddsRepository()
     odds_repository.create_or_update_many(odds)
 
 
 @app.task
-def crawl_race_result_page(stadium_tel_code: int, date: date, race_number: int) -> None:
+def crawl_trifecta_odds_page(stadium_tel_code: int, date: date, race_number: int) -> None:
+    if is_race_canceled(date, stadium_tel_code, race_number):
+        return
+    save_trifecta_odds_page(scrape_trifecta_odds_page(stadium_tel_code, date, race_number))
+
+
+@dataclass
+class RaceResultPage:
+    payoffs: list[Payoff]
+    weather_condition: WeatherCondition
+    race_records: list[RaceRecord]
+
+
+def scrape_race_result_page(stadium_tel_code: int, date: date, race_number: int) -> RaceResultPage:
     url = create_race_result_page_url(date, StadiumTelCode(stadium_tel_code), race_number)
     html_io = fetch_html_as_io(url)
     payoffs = extract_race_payoffs(html_io)
-    payoff_repository = PayoffRepository()
-    payoff_repository.create_or_update_many(payoffs)
 
-    html_io = fetch_html_as_io(url)
+    html_io.seek(0)
     weather_condition = extract_weather_condition_in_performance(html_io)
-    weather_condition_repository = WeatherConditionRepository()
-    weather_condition_repository.create_or_update(weather_condition)
 
-    html_io = fetch_html_as_io(url)
+    html_io.seek(0)
     race_records = extract_race_records(html_io)
-    race_record_repository = RaceRecordRepository()
-    race_record_repository.create_or_update_many(race_records)
-    winning_race_entry_repository = WinningRaceEntryRepository()
-    winning_race_entry_repository.create_or_update_many(
-        [r for r in race_records if r.winning_trick is not None]
-    )
-    disqualified_race_entry_repository = DisqualifiedRaceEntryRepository()
-    disqualified_race_entry_repository.create_or_update_many(
-        [r for r in race_records if r.disqualification is not None]
-    )
+
+    return RaceResultPage(payoffs, weather_condition, race_records)
+
+
+def save_race_result_page(page: RaceResultPage) -> None:
+    # note: 締切後にすべての場の結果がまとまって出るので、1レース分の書き込みは1トランザクションで済ませる
+    with unit_of_work():
+        payoff_repository = PayoffRepository()
+        payoff_repository.create_or_update_many(page.payoffs)
+
+        weather_condition_repository = WeatherConditionRepository()
+        weather_condition_repository.create_or_update(page.weather_condition)
+
+        race_record_repository = RaceRecordRepository()
+        race_record_repository.create_or_update_many(page.race_records)
+        winning_race_entry_repository = WinningRaceEntryRepository()
+        winning_race_entry_repository.create_or_update_many(
+            [r for r in page.race_records if r.winning_trick is not None]
+        )
+        disqualified_race_entry_repository = DisqualifiedRaceEntryRepository()
+        disqualified_race_entry_repository.create_or_update_many(
+            [r for r in page.race_records if r.disqualification is not None]
+        )
+
+
+@app.task
+def crawl_race_result_page(stadium_tel_code: int, date: date, race_number: int) -> None:
+    if is_race_canceled(date, stadium_tel_code, race_number):
+        return
+    save_race_result_page(scrape_race_result_page(stadium_tel_code, date, race_number))
@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from datetime import date
 
 from metaboatrace.crawlers.celery import app
@@ -26,33 +27,59 @@ from metaboatrace.scrapers.official.website.v1707.pages.pre_inspection_informati
 )
 
 
-@app.task
-def crawl_events_from_monthly_schedule_page(
-    year: int, month: int, repository: EventRepository = EventRepository()
-) -> None:
+def scrape_events_from_monthly_schedule_page(year: int, month: int) -> list[Event]:
     url = create_monthly_schedule_page_url(year, month)
     html_io = fetch_html_as_io(url)
     events: list[Event] = extract_events(html_io)
-    repository.create_or_update_many(events)
+    return events
 
 
 @app.task
-def crawl_pre_inspection_information_page(
-    stadium_tel_code: int, date: date, racer_repository: RacerRepository = RacerRepository()
+def crawl_events_from_monthly_schedule_page(
+    year: int, month: int, repository: EventRepository = EventRepository()
 ) -> None:
+    repository.create_or_update_many(scrape_events_from_monthly_schedule_page(year, month))
+
+
+@dataclass
+class PreInspectionInformationPage:
+    racers: list[Racer]
+    motor_renewal: MotorRenewal | None
+
+
+def scrape_pre_inspection_information_page(
+    stadium_tel_code: int, date: date
+) -> PreInspectionInformationPage:
     url = create_event_entry_page_url(StadiumTelCode(stadium_tel_code), date)
     html_io = fetch_html_as_io(url)
 
     racers: list[Racer] = extract_racers(html_io)
-    racer_repository.create_or_update_many(racers)
 
     html_io.seek(0)
     event_entries = extract_event_entries(html_io)
+    motor_renewal = None
     if all(ee.quinella_rate_of_motor == 0 for ee in event_entries):
+        motor_renewal = MotorRenewal(stadium_tel_code=stadium_tel_code, date=date)
+
+    return PreInspectionInformationPage(racers, motor_renewal)
+
+
+def save_pre_inspection_information_page(
+    page: PreInspectionInformationPage, racer_repository: RacerRepository | None = None
+) -> None:
+    (racer_repository or RacerRepository()).create_or_update_many(page.racers)
+
+    if page.motor_renewal is not None:
         motor_renewal_repository = MotorRenewalRepository()
-        motor_renewal_repository.create_or_update(
-            MotorRenewal(stadium_tel_code=stadium_tel_code, date=date)
-        )
+        motor_renewal_repository.create_or_update(page.motor_renewal)
+
+
+@app.task
+def crawl_pre_inspection_information_page(
+    stadium_tel_code: int, date: date, racer_repository: RacerRepository = RacerRepository()
+) -> None:
+    page = scrape_pre_inspection_information_page(stadium_tel_code, date)
+    save_pre_inspection_information_page(page, racer_repository)
 
 
 # TODO: インターフェースが他と明らかに不揃いなのでメソッド名を変えるかなんかして対応
@@ -0,0 +1,60 @@
+from datetime import date
+from enum import Enum
+from urllib.parse import parse_qs, urlparse
+
+
+class PageType(Enum):
+    EVENT_HOLDING = "index"
+    MONTHLY_SCHEDULE = "monthlyschedule"
+    PRE_INSPECTION_INFORMATION = "rankingmotor"
+    RACE_ENTRY = "racelist"
+    RACE_BEFORE_INFORMATION = "beforeinfo"
+    TRIFECTA_ODDS = "odds3t"
+    RACE_RESULT = "raceresult"
+    RACER_PROFILE = "profile"
+    UNKNOWN = "unknown"
+
+
+def detect_page_type(url: str) -> PageType:
+    """公式サイトの URL のパスの末尾からページの種類を判定する"""
+    last_segment = urlparse(url).path.rstrip("/").rsplit("/", 1)[-1]
+    try:
+        return PageType(last_segment)
+    except ValueError:
+        return PageType.UNKNOWN
+
+
+def generate_race_identifier_str(
+    race_holding_date: date, stadium_tel_code: int, race_number: int
+) -> str:
+    # note: ORM のモデルの属性を引数に使うので、 stadium_tel_code は int
+    return f"{race_holding_date.strftime('%Y%m%d')}{str(stadium_tel_code).zfill(2)}{str(race_number).zfill(2)}"
+
+
+def generate_page_identifier_str(url: str) -> str:
+    """
+    URL のクエリ文字列からページを一意に識別する文字列を作る。
+    レースのページは generate_race_identifier_str と同じ形式 (YYYYMMDD + 場コード + レース番号) になる。
+    """
+    query = parse_query(url)
+    race_holding_date = parse_race_holding_date(url)
+    if race_holding_date is not None and "jcd" in query and "rno" in query:
+        return generate_race_identifier_str(race_holding_date, int(query["jcd"]), int(query["rno"]))
+
+    return "".join(
+        query[key].zfill(2) if key == "jcd" else query[key]
+        for key in ("ym", "hd", "jcd", "toban")
+        if key in query
+    )
+
+
+def parse_query(url: str) -> dict[str, str]:
+    return {key: values[0] for key, values in parse_qs(urlparse(url).query).items()}
+
+
+def parse_race_holding_date(url: str) -> date | None:
+    """URL のクエリ文字列 (hd=YYYYMMDD) から開催日を取り出す。含まれていなければ None"""
+    hd = parse_query(url).get("hd")
+    if hd is None or len(hd) != 8 or not hd.isdigit():
+        return None
+    return date(int(hd[:4]), int(hd[4:6]), int(hd[6:]))
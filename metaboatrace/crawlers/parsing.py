@@ -0,0 +1,74 @@
+"""
+取得したページの HTML の解析を1回で済ませるための仕組み
+
+metaboatrace.scrapers の extract_* 関数 (とそのデコレーター) はファイルを受け取り、呼ばれるたびに BeautifulSoup で解析し直す。
+HtmlDocument はファイルとして振る舞いながら解析済みの木を持ち、scrapers のモジュールが参照する BeautifulSoup を
+HtmlDocument が渡されたときは解析済みの木を返すものに差し替えることで、同じページに対する extract_* 関数の間で木を共有する。
+それ以外の入力 (普通のファイルや文字列) や別のパーサーが指定された場合はこれまで通り BeautifulSoup で解析する。
+
+note: 共有した木を書き換える extract_* 関数があると他の関数の結果が変わってしまうが、今のところ読み取りしかしていない
+(tests/metaboatrace/crawlers/test_parsing.py で、同じ木を2回解析しても結果と木が変わらないことを確かめている)。
+scrapers を更新して BeautifulSoup を参照しなくなったモジュールがあれば、差し替えが効かないので import したときに例外を投げる
+"""
+
+import importlib
+import io
+import threading
+from typing import Any
+
+from bs4 import BeautifulSoup
+
+PARSER = "html.parser"
+
+_SCRAPER_MODULES = [
+    "metaboatrace.scrapers.official.website.v1707.decorators",
+    "metaboatrace.scrapers.official.website.v1707.pages.event_holding_page.scraping",
+    "metaboatrace.scrapers.official.website.v1707.pages.monthly_schedule_page.scraping",
+    "metaboatrace.scrapers.official.website.v1707.pages.pre_inspection_information_page.scraping",
+    "metaboatrace.scrapers.official.website.v1707.pages.race.common",
+    "metaboatrace.scrapers.official.website.v1707.pages.race.before_information_page.scraping",
+    "metaboatrace.scrapers.official.website.v1707.pages.race.entry_page.scraping",
+    "metaboatrace.scrapers.official.website.v1707.pages.race.odds.trifecta_page.scraping",
+    "metaboatrace.scrapers.official.website.v1707.pages.race.result_page.scraping",
+    "metaboatrace.scrapers.official.website.v1707.pages.racer.profile_page.scraping",
+]
+
+
+class HtmlDocument(io.StringIO):
+    """解析済みの木を持ち回る StringIO"""
+
+    def __init__(self, html: str) -> None:
+        super().__init__(html)
+        self._soup: BeautifulSoup | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def soup(self) -> BeautifulSoup:
+        if self._soup is None:
+            with self._lock:
+                if self._soup is None:
+                    self._soup = BeautifulSoup(self.getvalue(), PARSER)
+        return self._soup
+
+
+def _shared_beautiful_soup(
+    markup: Any = "", features: Any = None, *args: Any, **kwargs: Any
+) -> Any:
+    if isinstance(markup, HtmlDocument) and features == PARSER and not args and not kwargs:
+        return markup.soup
+    return BeautifulSoup(markup, features, *args, **kwargs)
+
+
+def install() -> None:
+    """scrapers のモジュールが参照する BeautifulSoup を差し替える"""
+    for module_name in _SCRAPER_MODULES:
+        module = importlib.import_module(module_name)
+        beautiful_soup = getattr(module, "BeautifulSoup", None)
+        if beautiful_soup is _shared_beautiful_soup:
+            continue
+        if beautiful_soup is not BeautifulSoup:
+            raise ImportError(f"{module_name} does not use bs4.BeautifulSoup to parse pages")
+        module.BeautifulSoup = _shared_beautiful_soup  # type: ignore[attr-defined]
+
+
+install()
@@ -0,0 +1,210 @@
+"""
+公式サイトへのリクエストのレート制限
+
+ワーカーやスクリプトがいくつ動いていても、ホストごとのリクエスト数が上限を超えないように、
+Redis に置いたトークンバケットを全プロセスで共有する。Redis が使えない間は、プロセス内のトークンバケットで制限する。
+
+- ホストごとのバケット (CRAWLER_HOST_RATE_LIMITS、デフォルト "*=2/5") と、
+  ページの種類ごとのバケット (CRAWLER_PAGE_RATE_LIMITS、デフォルト "profile=0.5/1") の両方からトークンを取る
+- 設定は "キー=1秒あたりのリクエスト数/バースト" をカンマで区切る。ホストの "*" はほかに指定のないホストに使う。
+  ページの種類のキーは PageType の値 (odds3t、racelist など)
+- トークンが足りない場合は、取れるようになるまで待つ。待つ時間はトークンを取るときに予約するので、待っている間にほかのプロセスに追い越されない
+- 締切前のページ (当日以降の出走表・直前情報・オッズ) 以外は、ホストのバケットを CRAWLER_RATE_LIMIT_MAX_WAIT 秒 (デフォルト 2) より先まで予約しない。
+  一括取得が予約を積み上げても、締切前のページはその秒数より長く待たされない
+"""
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Protocol
+from urllib.parse import urlparse
+from zoneinfo import ZoneInfo
+
+import redis
+from redis.commands.core import Script
+
+from metaboatrace.crawlers.pages import PageType, detect_page_type, parse_race_holding_date
+from metaboatrace.crawlers.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST_RATE_LIMITS = "*=2/5"
+DEFAULT_PAGE_RATE_LIMITS = "profile=0.5/1"
+DEFAULT_MAX_WAIT = 2.0
+
+# note: 締切に合わせて取得するページ。celery.LIVE_QUEUE のタスクが取得する
+LIVE_PAGE_TYPES = frozenset(
+    [PageType.RACE_ENTRY, PageType.RACE_BEFORE_INFORMATION, PageType.TRIFECTA_ODDS]
+)
+
+jst = ZoneInfo("Asia/Tokyo")
+
+# note: トークンを1つ取り、足りなければ取れるようになるまでの秒数を返す (トークンは負になり、その分を後の呼び出しが待つ)
+#       時刻は Redis サーバーのものを使うので、プロセスごとに時計がずれていても同じバケットを正しく補充できる
+#       ARGV[3] が 0 以上で、待つ秒数がそれを超える場合はトークンを取らずに -1 を返す
+_RESERVE_TOKEN = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate) - 1
+if max_wait >= 0 and -tokens / rate > max_wait then
+    return '-1'
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+
+@dataclass(frozen=True)
+class Rate:
+    per_second: float
+    burst: float
+
+
+def parse_rate_limits(value: str) -> dict[str, Rate]:
+    rates = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        key, _, rate = item.partition("=")
+        per_second, _, burst = rate.partition("/")
+        rates[key.strip()] = Rate(float(per_second), float(burst or 1))
+    return rates
+
+
+class TokenBucket(Protocol):
+    def reserve(self, key: str, rate: Rate, max_wait: float | None = None) -> float | None:
+        """
+        トークンを1つ取り、取れるようになるまで待つ秒数を返す。
+        待つ秒数が max_wait を超える場合は、トークンを取らずに None を返す
+        """
+        ...
+
+
+class InProcessTokenBucket:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    def reserve(self, key: str, rate: Rate, max_wait: float | None = None) -> float | None:
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at = self._buckets.get(key, (rate.burst, now))
+            tokens = min(rate.burst, tokens + (now - updated_at) * rate.per_second) - 1
+            wait = max(0.0, -tokens / rate.per_second)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._buckets[key] = (tokens, now)
+        return wait
+
+
+class RedisTokenBucket:
+    KEY_PREFIX = "metaboatrace:rate_limit:"
+
+    def __init__(self, client: redis.Redis | None = None) -> None:
+        self._client = client
+        self._reserve_token: dict[int, Script] = {}
+
+    @property
+    def client(self) -> redis.Redis:
+        return self._client if self._client is not None else get_redis_client()
+
+    def reserve(self, key: str, rate: Rate, max_wait: float | None = None) -> float | None:
+        client = self.client
+        reserve_token = self._reserve_token.get(id(client))
+        if reserve_token is None:
+            # note: スクリプトの SHA1 の計算はクライアントごとに1回で済ませる
+            reserve_token = self._reserve_token[id(client)] = client.register_script(_RESERVE_TOKEN)
+        wait = float(
+            reserve_token(
+                keys=[self.KEY_PREFIX + key],
+                args=[rate.per_second, rate.burst, -1 if max_wait is None else max_wait],
+            )
+        )
+        return None if wait < 0 else wait
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        host_rates: dict[str, Rate],
+        page_rates: dict[str, Rate],
+        bucket: TokenBucket,
+        fallback: TokenBucket | None = None,
+        retry_interval: float = 60,
+        max_wait: float | None = DEFAULT_MAX_WAIT,
+    ) -> None:
+        self._host_rates = host_rates
+        self._page_rates = page_rates
+        self._bucket = bucket
+        self._fallback = fallback or InProcessTokenBucket()
+        self._retry_interval = retry_interval
+        self._unavailable_until = 0.0
+        self._max_wait = max_wait
+
+    def acquire(self, url: str) -> float:
+        """URL のホストとページの種類のトークンを取り、取れるまで待つ。待った秒数を返す"""
+        waited = 0.0
+        wait = 0.0
+        for key, rate, max_wait in self._buckets_for(url):
+            while (reserved := self._reserve(key, rate, max_wait)) is None:
+                # note: max_wait 秒より先まで予約が埋まっている間は、トークン1つ分ずつ待ってからやり直す
+                time.sleep(1 / rate.per_second)
+                waited += 1 / rate.per_second
+            wait = max(wait, reserved)
+        if wait > 0:
+            time.sleep(wait)
+        return waited + wait
+
+    def _buckets_for(self, url: str) -> list[tuple[str, Rate, float | None]]:
+        buckets = []
+        host = urlparse(url).hostname or ""
+        page_type = detect_page_type(url)
+        host_rate = self._host_rates.get(host, self._host_rates.get("*"))
+        if host_rate is not None:
+            max_wait = None if _is_live_page(url, page_type) else self._max_wait
+            buckets.append((f"host:{host}", host_rate, max_wait))
+        page_rate = self._page_rates.get(page_type.value)
+        if page_type != PageType.UNKNOWN and page_rate is not None:
+            buckets.append((f"page:{host}:{page_type.value}", page_rate, None))
+        return buckets
+
+    def _reserve(self, key: str, rate: Rate, max_wait: float | None) -> float | None:
+        if time.monotonic() >= self._unavailable_until:
+            try:
+                return self._bucket.reserve(key, rate, max_wait)
+            except redis.RedisError as e:
+                # note: Redis が落ちている間にリクエストごとにタイムアウトを待たないよう、しばらくはプロセス内で制限する
+                logger.warning(f"Rate limiter is unavailable, falling back to in-process: {e}")
+                self._unavailable_until = time.monotonic() + self._retry_interval
+        return self._fallback.reserve(key, rate, max_wait)
+
+
+def _is_live_page(url: str, page_type: PageType) -> bool:
+    race_holding_date = parse_race_holding_date(url)
+    return (
+        page_type in LIVE_PAGE_TYPES
+        and race_holding_date is not None
+        and race_holding_date >= datetime.now(jst).date()
+    )
+
+
+def create_rate_limiter() -> RateLimiter:
+    return RateLimiter(
+        parse_rate_limits(os.environ.get("CRAWLER_HOST_RATE_LIMITS", DEFAULT_HOST_RATE_LIMITS)),
+        parse_rate_limits(os.environ.get("CRAWLER_PAGE_RATE_LIMITS", DEFAULT_PAGE_RATE_LIMITS)),
+        RedisTokenBucket(),
+        max_wait=float(os.environ.get("CRAWLER_RATE_LIMIT_MAX_WAIT", DEFAULT_MAX_WAIT)),
+    )
@@ -0,0 +1,27 @@
+import os
+
+import redis
+
+DEFAULT_REDIS_URL = "redis://localhost:6379/0"
+
+_client: redis.Redis | None = None
+
+
+def get_redis_url() -> str:
+    # note: Celery のブローカーと同じ Redis を使う
+    return os.environ.get("CELERY_BROKER_URL", DEFAULT_REDIS_URL)
+
+
+def get_redis_client() -> redis.Redis:
+    """
+    プロセス内で共有する Redis クライアントを返す。
+    redis-py のコネクションプールは fork を検知して作り直すので prefork のワーカーでもそのまま使える。
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            get_redis_url(),
+            socket_timeout=float(os.environ.get("REDIS_SOCKET_TIMEOUT", "5")),
+            socket_connect_timeout=float(os.environ.get("REDIS_SOCKET_CONNECT_TIMEOUT", "2")),
+        )
+    return _client
@@ -1,9 +1,11 @@
-import time
+from collections.abc import Iterable
 from datetime import date, datetime, timedelta
 
 import pytz
 
+from metaboatrace.crawlers.cancellation import record_race_cancellations
 from metaboatrace.crawlers.celery import app
+from metaboatrace.crawlers.dispatcher import dispatcher
 from metaboatrace.crawlers.exceptions import RaceDeadlineChanged
 from metaboatrace.crawlers.official.website.v1707.race import (
     crawl_all_race_information_for_date_and_stadiums,
@@ -18,9 +20,10 @@ from metaboatrace.crawlers.official.website.v1707.stadium import (
     crawl_events_from_monthly_schedule_page,
     crawl_pre_inspection_information_page,
 )
+from metaboatrace.crawlers.pages import generate_race_identifier_str as _generate_identifier_str
 from metaboatrace.models.race import RaceInformation as RaceEntity
 from metaboatrace.models.stadium import EventHoldingStatus
-from metaboatrace.orm.database import Session
+from metaboatrace.orm.database import ReadSession, pin_to_primary
 from metaboatrace.orm.models import Racer
 from metaboatrace.repositories import RaceRepository, RacerRepository
 from metaboatrace.scrapers.official.website.exceptions import DataNotFound, RaceCanceled
@@ -28,13 +31,6 @@ from metaboatrace.scrapers.official.website.exceptions import DataNotFound, Race
 jst = pytz.timezone("Asia/Tokyo")
 
 
-def _generate_identifier_str(
-    race_holding_date: date, stadium_tel_code: int, race_number: int
-) -> str:
-    # note: ORM のモデルの属性を引数に使うので、 stadium_tel_code は int
-    return f"{race_holding_date.strftime('%Y%m%d')}{str(stadium_tel_code).zfill(2)}{str(race_number).zfill(2)}"
-
-
 def _generate_crawl_race_task_id(
     func_name: str,
     race_holding_date: date,
@@ -45,26 +41,39 @@ def _generate_crawl_race_task_id(
     return f"{prefix}{func_name}_{_generate_identifier_str(race_holding_date, stadium_tel_code, race_number)}"
 
 
-def _revoke_race_tasks(stadium_tel_code: int, race_opened_on: date, race_number: int) -> None:
-    tasks = [
-        crawl_race_information_page,
-        crawl_race_before_information_page,
-        crawl_trifecta_odds_page,
-        crawl_race_result_page,
+_RACE_TASKS = [
+    crawl_race_information_page,
+    crawl_race_before_information_page,
+    crawl_trifecta_odds_page,
+    crawl_race_result_page,
+]
+
+
+def _generate_race_task_ids(
+    stadium_tel_code: int, race_opened_on: date, race_numbers: Iterable[int]
+) -> list[str]:
+    return [
+        _generate_crawl_race_task_id(task.__name__, race_opened_on, stadium_tel_code, race_number)
+        for race_number in race_numbers
+        for task in _RACE_TASKS
     ]
 
-    for task in tasks:
-        task_id = _generate_crawl_race_task_id(
-            task.__name__, race_opened_on, stadium_tel_code, race_number
-        )
-        app.control.revoke(task_id, terminate=True)
+
+def _revoke_race_tasks(stadium_tel_code: int, race_opened_on: date, race_number: int) -> None:
+    task_ids = _generate_race_task_ids(stadium_tel_code, race_opened_on, [race_number])
+    # note: まだキューに入れていないものは予約を取り消すだけで済む。残りは1回の revoke でまとめてワーカーに送る
+    dispatched_task_ids = dispatcher.cancel_many(task_ids)
+    if dispatched_task_ids:
+        app.control.revoke(dispatched_task_ids, terminate=True)
 
 
 def _revoke_future_race_tasks(
     stadium_tel_code: int, race_opened_on: date, start_race_number: int
 ) -> None:
-    for n in range(start_race_number, 13):
-        _revoke_race_tasks(stadium_tel_code, race_opened_on, n)
+    race_numbers = range(start_race_number, 13)
+    # note: キューに入っているタスクは中止の記録を見て取得する前に終わるので、revoke は送らない
+    record_race_cancellations(race_opened_on, stadium_tel_code, race_numbers)
+    dispatcher.cancel_many(_generate_race_task_ids(stadium_tel_code, race_opened_on, race_numbers))
 
 
 @app.task
@@ -77,7 +86,9 @@ def _race_task_failure_handler(request, exc, traceback):  # type: ignore
 
         _revoke_future_race_tasks(stadium_tel_code, race_opened_on, race_number)
     elif isinstance(exc, RaceDeadlineChanged):
-        race = repository.find_by_key(stadium_tel_code, race_opened_on, race_number)
+        # note: 出走表を書き込んだ直後なので、レプリカにはまだ新しい締切が届いていないことがある
+        with pin_to_primary():
+            race = repository.find_by_key(stadium_tel_code, race_opened_on, race_number)
         if race is not None:
             _revoke_race_tasks(stadium_tel_code, race_opened_on, race_number)
 
@@ -95,22 +106,30 @@ def _race_task_failure_handler(request, exc, traceback):  # type: ignore
 
 
 def _schedule_race_tasks(race: RaceEntity, tasks_with_timedelta, prefix: str = "") -> None:  # type: ignore
+    # note: ETA つきで送るとワーカーが実行時刻まで抱え込むので、時刻が来るまでディスパッチャーに預けておく
     for task_func, delta in tasks_with_timedelta:
         eta = race.deadline_at + delta
-        task_func.apply_async(
-            args=[race.stadium_tel_code.value, race.race_holding_date, race.race_number],
-            eta=eta,
-            task_id=_generate_crawl_race_task_id(
-                task_func.__name__,
-                race.race_holding_date,
-                race.stadium_tel_code.value,
-                race.race_number,
-                prefix,
+        dispatcher.schedule(
+            task_func.signature(
+                [race.stadium_tel_code.value, race.race_holding_date, race.race_number],
+                task_id=_generate_crawl_race_task_id(
+                    task_func.__name__,
+                    race.race_holding_date,
+                    race.stadium_tel_code.value,
+                    race.race_number,
+                    prefix,
+                ),
+                link_error=_race_task_failure_handler.s(),
             ),
-            link_error=_race_task_failure_handler.s(),
+            eta,
         )
 
 
+@app.task
+def dispatch_due_race_tasks() -> None:
+    dispatcher.dispatch_due()
+
+
 @app.task
 def schedule_crawl_events_from_monthly_schedule_page() -> None:
     now = datetime.now(jst)
@@ -139,7 +158,6 @@ def schedule_crawl_events_starting_today_for_today() -> None:
     ]
     for event_holding in events_starting_today:
         crawl_pre_inspection_information_page(event_holding.stadium_tel_code.value, today)
-        time.sleep(1)
 
 
 @app.task
@@ -167,18 +185,22 @@ def reserve_crawl_task_for_races_today() -> None:
 
 @app.task
 def enqueue_incomplete_racer_crawling() -> None:
-    session = Session()
+    session = ReadSession()
     try:
         incomplete_racers = session.query(Racer).filter(Racer.status.is_(None)).limit(3).all()
 
         racer_registration_numbers = [racer.registration_number for racer in incomplete_racers]
 
-        for registration_number in racer_registration_numbers:
-            try:
-                crawl_racer_from_racer_profile_page(int(registration_number))
-            except DataNotFound:
-                repository = RacerRepository()
-                repository.make_retired(registration_number)  # type: ignore
+        retired_registration_numbers = []
+        try:
+            for registration_number in racer_registration_numbers:
+                try:
+                    crawl_racer_from_racer_profile_page(int(registration_number))
+                except DataNotFound:
+                    retired_registration_numbers.append(int(registration_number))
+        finally:
+            # note: 途中で失敗しても、それまでに分かった引退は書き込んでおく
+            RacerRepository().make_retired_many(retired_registration_numbers)
 
     finally:
         session.close()
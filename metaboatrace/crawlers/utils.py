@@ -2,41 +2,48 @@ import io
 import logging
 import os
 
-import requests
-from cachetools import TTLCache, cached
 from dotenv import load_dotenv
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
+from metaboatrace.crawlers.archive import create_html_archive
+from metaboatrace.crawlers.cache import create_html_cache
+from metaboatrace.crawlers.http_client import get_http_session, get_timeout
+from metaboatrace.crawlers.parsing import HtmlDocument
+from metaboatrace.crawlers.rate_limit import create_rate_limiter
+
 load_dotenv()
 
 
-cache: TTLCache[str, str] = TTLCache(maxsize=10000, ttl=3600)  # サイズを増やして並列処理に対応
+html_cache = create_html_cache()
+html_archive = create_html_archive()
+rate_limiter = create_rate_limiter()
 
 
-@cached(cache)
 def _fetch_html_text(url: str) -> str:
-    try:
-        # タイムアウトを設定し、リトライを実装
-        response = requests.get(
-            url,
-            timeout=30,  # 30秒のタイムアウト
-            headers={
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
-            },
-        )
-        response.raise_for_status()
-        return response.text
-    except requests.exceptions.Timeout:
-        # タイムアウト時はキャッシュしない
-        raise
-    except requests.exceptions.RequestException:
-        # その他のリクエストエラーもキャッシュしない
-        raise
+    if html_archive.is_replaying:
+        return html_archive.load(url)
+
+    html = html_cache.get(url)
+    if html is not None:
+        return html
+
+    # note: ワーカーやスクリプトの数によらず、公式サイトへのリクエストは共有のトークンバケットの範囲に収める
+    rate_limiter.acquire(url)
+    # note: コネクションプールを共有して TCP/TLS のハンドシェイクを使い回す
+    response = get_http_session().get(url, timeout=get_timeout())
+    # タイムアウトやその他のリクエストエラーは例外になるのでキャッシュされない
+    response.raise_for_status()
+
+    html_cache.set(url, response.text)
+    if html_archive.is_recording:
+        html_archive.store(url, response.text)
+    return response.text
 
 
 def fetch_html_as_io(url: str) -> io.StringIO:
-    return io.StringIO(_fetch_html_text(url))
+    # note: 返り値は StringIO のサブクラスで、同じページに対する extract_* 関数の間で解析結果を共有する
+    return HtmlDocument(_fetch_html_text(url))
 
 
 def send_slack_notification(message: str) -> None:
@@ -0,0 +1,137 @@
+"""
+asyncpg を使う非同期のデータベース接続
+
+同期のリポジトリを AsyncSession.run_sync の中で動かすので、entity から行への変換も upsert の仕方も同期の場合と変わらない。
+run_sync の中の I/O は greenlet を通して asyncpg で待つので、イベントループを止めずに書き込める。
+"""
+
+import asyncio
+import os
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, TypeVar
+
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from metaboatrace.orm.database import get_database_url, use_session
+from metaboatrace.orm.unit_of_work import _UNIT_OF_WORK_KEY
+
+T = TypeVar("T")
+
+ASYNC_DRIVER_NAME = "postgresql+asyncpg"
+
+_engine: AsyncEngine | None = None
+_engine_key: tuple[int, int] | None = None
+
+# note: async_unit_of_work の中では、そのタスクの書き込みはすべてこのセッションで行う
+_current_session: ContextVar[AsyncSession | None] = ContextVar(
+    "current_async_session", default=None
+)
+
+async_session_factory = async_sessionmaker(expire_on_commit=False)
+
+
+def get_async_database_url() -> str:
+    """ASYNC_DATABASE_URL がなければ、DATABASE_URL のドライバーを asyncpg に替えて使う"""
+    url = os.environ.get("ASYNC_DATABASE_URL")
+    if url:
+        return url
+    return (
+        make_url(get_database_url())
+        .set(drivername=ASYNC_DRIVER_NAME)
+        .render_as_string(hide_password=False)
+    )
+
+
+def _create_async_engine() -> AsyncEngine:
+    return create_async_engine(
+        get_async_database_url(),
+        pool_size=int(os.environ.get("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", "-1")),
+        pool_pre_ping=os.environ.get("DB_POOL_PRE_PING", "false").lower() == "true",
+    )
+
+
+def get_async_engine() -> AsyncEngine:
+    """
+    プロセスとイベントループごとに1つのエンジンを返す。
+    asyncpg のコネクションは作ったイベントループでしか使えないので、asyncio.run をやり直した場合もエンジンを作り直す
+    """
+    global _engine, _engine_key
+    key = (os.getpid(), id(asyncio.get_running_loop()))
+    if _engine is None or _engine_key != key:
+        if _engine is not None:
+            # 前のイベントループのコネクションは、そのループなしでは閉じられないので手放すだけにする
+            _engine.sync_engine.dispose(close=False)
+        _engine = _create_async_engine()
+        _engine_key = key
+    return _engine
+
+
+async def dispose_async_engine() -> None:
+    """イベントループを閉じる前に呼び、プールのコネクションを閉じる"""
+    global _engine, _engine_key
+    if _engine is not None and _engine_key == (os.getpid(), id(asyncio.get_running_loop())):
+        await _engine.dispose()
+    _engine = None
+    _engine_key = None
+
+
+def _run_with_session(
+    session: SQLAlchemySession, fn: Callable[..., T], *args: Any, **kwargs: Any
+) -> T:
+    with use_session(session):
+        return fn(*args, **kwargs)
+
+
+async def run_with_async_session(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    fn を AsyncSession.run_sync の中で呼ぶ。
+    fn の中で Session() が返すのは AsyncSession の裏にある同期セッションなので、
+    同期のリポジトリや crawl_* 関数をそのまま asyncpg の上で動かせる。
+
+    async_unit_of_work の中ではそのセッションを使い、外では呼び出しごとに新しいセッションを使う
+    """
+    session = _current_session.get()
+    if session is not None:
+        return await session.run_sync(_run_with_session, fn, *args, **kwargs)
+
+    async with async_session_factory(bind=get_async_engine()) as session:
+        return await session.run_sync(_run_with_session, fn, *args, **kwargs)
+
+
+@asynccontextmanager
+async def async_unit_of_work() -> AsyncIterator[AsyncSession]:
+    """
+    unit_of_work の非同期版。ブロック内の run_with_async_session の書き込みを1つのトランザクションにまとめる。
+
+    セッションは ContextVar に入れるので、ブロックの外で並行に動く別のタスクとは共有しない。
+    AsyncSession は並行に使えないので、ブロックの中で asyncio.gather などを使って並行に書き込んではいけない
+    """
+    session = _current_session.get()
+    if session is not None:
+        yield session
+        return
+
+    async with async_session_factory(bind=get_async_engine()) as session:
+        session.sync_session.info[_UNIT_OF_WORK_KEY] = True
+        token = _current_session.set(session)
+        try:
+            yield session
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+        finally:
+            _current_session.reset(token)
+            session.sync_session.info.pop(_UNIT_OF_WORK_KEY, None)
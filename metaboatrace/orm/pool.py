@@ -0,0 +1,75 @@
+"""
+コネクションプールの計測
+
+ワーカーの数と Postgres の max_connections の兼ね合いを決めるために、
+プールの大きさと、空きのコネクションを待った時間を記録する。
+"""
+
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+@dataclass
+class PoolStats:
+    size: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    checkouts: int
+    timeouts: int
+    total_wait_seconds: float
+    max_wait_seconds: float
+
+    @property
+    def average_wait_seconds(self) -> float:
+        return self.total_wait_seconds / self.checkouts if self.checkouts else 0.0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {**asdict(self), "average_wait_seconds": self.average_wait_seconds}
+
+
+class InstrumentedQueuePool(QueuePool):
+    """コネクションの取り出しにかかった時間 (空きを待った時間を含む) を記録する QueuePool"""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _do_get(self) -> Any:
+        started_at = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            # note: 空きを待ちきれなかった場合だけ数える。接続に失敗した場合は数えずにそのまま投げる
+            with self._stats_lock:
+                self._timeouts += 1
+            raise
+
+        waited = time.perf_counter() - started_at
+        with self._stats_lock:
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return connection
+
+    def stats(self) -> PoolStats:
+        with self._stats_lock:
+            return PoolStats(
+                size=self.size(),
+                checked_in=self.checkedin(),
+                checked_out=self.checkedout(),
+                overflow=self.overflow(),
+                checkouts=self._checkouts,
+                timeouts=self._timeouts,
+                total_wait_seconds=self._total_wait,
+                max_wait_seconds=self._max_wait,
+            )
@@ -0,0 +1,137 @@
+"""
+過去データのバックフィル向けに、COPY で一時テーブルに流し込んでから対象のテーブルにまとめて反映する upsert
+
+    1. 対象のテーブルと同じ形の一時テーブルを作る (トランザクションの終了時に消える)
+    2. COPY FROM STDIN で行を一時テーブルに流し込む
+    3. INSERT INTO 対象 SELECT ... FROM 一時テーブル ON CONFLICT DO UPDATE で1回で反映する
+
+更新する列はリポジトリが指定する on_duplicate_key_update をそのまま使う。PostgreSQL でのみ使える。
+asyncpg で接続している場合は COPY を使わず、通常の upsert で書き込む。
+
+一時テーブルを作る分の往復があるので、行が少ないと複数行の INSERT より遅い
+(scripts/benchmark_upsert.py --batch-sizes で測ると、1回あたり50行前後で逆転する)。
+行数が BULK_LOAD_MIN_ROWS (デフォルト 50) に満たない upsert は、COPY を使わずに通常の upsert で書き込む。
+1レース分のページの書き込みでは、3連単オッズ (120行) などの大きいものだけが COPY になる。
+"""
+
+import csv
+import io
+import os
+import uuid
+from typing import Any
+
+import sqlalchemy.dialects.postgresql as postgresql
+from sqlalchemy import column, select, table, text
+from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from metaboatrace.orm.strategies.upsert import (
+    _count_written_rows,
+    _deduplicate_by_keys,
+    _default_value,
+    _get_primary_keys,
+    _on_conflict,
+    _postgresql_upsert_strategy,
+    _record_written_rows,
+)
+from metaboatrace.orm.unit_of_work import commit
+
+_NULL = r"\N"
+
+DEFAULT_MIN_ROWS = 50
+
+
+def _to_csv(values: list[dict[str, Any]], columns: list[str]) -> io.StringIO:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for value in values:
+        writer.writerow([_NULL if value.get(c) is None else value[c] for c in columns])
+    buffer.seek(0)
+    return buffer
+
+
+def _copy(session: SQLAlchemySession, copy_sql: str, data: io.StringIO) -> None:
+    dbapi_connection = session.connection().connection.driver_connection
+    with dbapi_connection.cursor() as cursor:  # type: ignore[union-attr]
+        if hasattr(cursor, "copy_expert"):
+            # psycopg2
+            cursor.copy_expert(copy_sql, data)
+        else:
+            # psycopg (3系)
+            with cursor.copy(copy_sql) as copy:
+                copy.write(data.getvalue())
+
+
+def _get_min_rows() -> int:
+    return int(os.environ.get("BULK_LOAD_MIN_ROWS", DEFAULT_MIN_ROWS))
+
+
+def postgresql_copy_upsert_strategy(
+    session: SQLAlchemySession,
+    model: type[DeclarativeMeta],
+    values: list[dict[str, Any]],
+    on_duplicate_key_update: list[str],
+    fill_if_null: list[str] | None = None,
+    skip_unchanged: bool = False,
+) -> bool:
+    if not values:
+        return True
+    if session.get_bind().dialect.driver == "asyncpg" or len(values) < _get_min_rows():
+        # note: asyncpg のコネクションは run_sync の中から COPY を使えない。行が少ない場合は一時テーブルを作る分だけ遅くなる。
+        #       どちらも複数行の INSERT で書き込む
+        return _postgresql_upsert_strategy(
+            session, model, values, on_duplicate_key_update, fill_if_null, skip_unchanged
+        )
+
+    try:
+        index_elements = _get_primary_keys(model)
+        rows = _deduplicate_by_keys(values, index_elements)
+
+        target = model.__table__  # type: ignore[attr-defined]
+        # note: Python 側の既定値 (created_at や races.number_of_laps など) は ORM が埋めているので、一時テーブル経由のときはここで埋める
+        defaults = {
+            c.name: _default_value(c)
+            for c in target.c
+            if c.default is not None and (c.default.is_scalar or c.default.is_callable)
+        }
+        rows = [{**defaults, **row} for row in rows]
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+
+        preparer = session.get_bind().dialect.identifier_preparer
+        staging_name = f"staging_{target.name}_{uuid.uuid4().hex[:8]}"
+        session.execute(
+            text(
+                f"CREATE TEMPORARY TABLE {preparer.quote(staging_name)} "
+                f"(LIKE {preparer.format_table(target)} INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+        )
+        _copy(
+            session,
+            f"COPY {preparer.quote(staging_name)} ({', '.join(preparer.quote(c) for c in columns)}) "
+            f"FROM STDIN WITH (FORMAT csv, NULL '{_NULL}')",
+            _to_csv(rows, columns),
+        )
+
+        staging = table(staging_name, *[column(c) for c in columns])
+        insert_statement = postgresql.insert(target).from_select(
+            columns, select(*[staging.c[c] for c in columns])
+        )
+        merge_statement = _on_conflict(
+            insert_statement,
+            target,
+            index_elements,
+            on_duplicate_key_update,
+            skip_unchanged,
+            fill_if_null,
+        )
+        result = session.execute(merge_statement)
+        if skip_unchanged:
+            inserted, updated = _count_written_rows(result)
+        commit(session)
+
+        if skip_unchanged:
+            _record_written_rows(session, model, len(rows), inserted, updated)
+        return True
+    except Exception as e:
+        session.rollback()
+        raise e
@@ -0,0 +1,144 @@
+"""
+psycopg 3 のパイプラインモードで書き込む upsert
+
+1つのページをクロールすると、テーブルごとに小さな upsert がいくつも発行される。
+通常はそれぞれの文の応答を待ってから次の文を送るので、DB までの往復の時間が文の数だけかかる。
+
+ここでは upsert をサーバー側のプリペアドステートメントにして、パイプラインモードで応答を待たずに送り続け、
+コミットするときに応答をまとめて受け取る。
+パイプラインはトランザクションの最初の upsert で開き、コミットする直前 (before_commit) に閉じるので、
+ユニットオブワークの中の upsert は、いくつあってもコミットの1往復しか応答を待たない。
+
+- DATABASE_URL のドライバーが psycopg (postgresql+psycopg://...) の場合にのみ使える。それ以外は通常の upsert で書き込む
+- 失敗した文のエラーは、コミットしたときに発生する
+- ロールバックするときは、その前にパイプラインを閉じて、送ったままの文のエラーを捨てる。
+  どちらの場合もパイプラインを閉じてからコネクションを返すので、プールに返したコネクションにパイプラインが残ることはない
+- 応答を待たないので、skip_unchanged を指定しても挿入/更新した行数はログに出さない
+"""
+
+from contextlib import ExitStack, suppress
+from functools import partial
+from typing import Any
+
+from sqlalchemy import Connection, event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from metaboatrace.orm.strategies.upsert import (
+    _deduplicate_by_keys,
+    _default_value,
+    _get_primary_keys,
+    _get_upsert_statement,
+    _postgresql_upsert_strategy,
+)
+from metaboatrace.orm.unit_of_work import commit
+
+_PIPELINE_KEY = "psycopg_pipeline"
+
+# note: (モデル, 列, 更新する列, NULL のときだけ埋める列, skip_unchanged) -> (SQL, 値が省略されたときに使う既定値を持つ列)
+_queries: dict[tuple[Any, ...], tuple[str, list[Any]]] = {}
+
+
+def psycopg_pipeline_upsert_strategy(
+    session: SQLAlchemySession,
+    model: type[DeclarativeMeta],
+    values: list[dict[str, Any]],
+    on_duplicate_key_update: list[str],
+    fill_if_null: list[str] | None = None,
+    skip_unchanged: bool = False,
+) -> bool:
+    if not values:
+        return True
+    if session.get_bind().dialect.driver != "psycopg":
+        return _postgresql_upsert_strategy(
+            session, model, values, on_duplicate_key_update, fill_if_null, skip_unchanged
+        )
+
+    try:
+        rows = _deduplicate_by_keys(values, _get_primary_keys(model))
+        columns = tuple(dict.fromkeys(key for row in rows for key in row))
+        sql, defaulted_columns = _get_query(
+            session, model, columns, on_duplicate_key_update, fill_if_null or [], skip_unchanged
+        )
+        # note: SQLAlchemy を通さずに実行するので、Python 側の既定値 (created_at など) はここで埋める
+        defaults = {column.name: _default_value(column) for column in defaulted_columns}
+        parameters = [{**defaults, **row} for row in rows]
+
+        cursor = _get_pipeline_cursor(session)
+        dbapi_error = session.get_bind().dialect.loaded_dbapi.Error
+        try:
+            # note: パイプラインの中では応答を待たないので、1行ずつ送ってもコミットするときの1往復で済む
+            for parameter in parameters:
+                cursor.execute(sql, parameter, prepare=True)
+        except dbapi_error as e:
+            # note: SQLAlchemy を通していないので、ほかの strategy と同じ例外 (DataError など) に包む
+            raise DBAPIError.instance(sql, None, e, dbapi_error) from e
+        commit(session)
+
+        return True
+    except Exception as e:
+        session.rollback()
+        raise e
+
+
+def _get_pipeline_cursor(session: SQLAlchemySession) -> Any:
+    """セッションのトランザクションで開いているパイプラインのカーソルを返す。まだ開いていなければ開く"""
+    pipeline = session.info.get(_PIPELINE_KEY)
+    if pipeline is None:
+        connection = session.connection()
+        driver_connection: Any = connection.connection.driver_connection
+        stack = ExitStack()
+        stack.enter_context(driver_connection.pipeline())
+        cursor = stack.enter_context(driver_connection.cursor())
+        pipeline = session.info[_PIPELINE_KEY] = (stack, cursor)
+        # note: after_rollback ではロールバックで送ったままの文のエラーが発生した後なので、ロールバックの直前に閉じる
+        event.listen(connection, "rollback", partial(_discard_pipeline, session), once=True)
+    return pipeline[1]
+
+
+@event.listens_for(SQLAlchemySession, "before_commit")
+def _sync_pipeline(session: SQLAlchemySession) -> None:
+    pipeline = session.info.pop(_PIPELINE_KEY, None)
+    if pipeline is None:
+        return
+    dbapi_error = session.get_bind().dialect.loaded_dbapi.Error
+    try:
+        pipeline[0].close()
+    except dbapi_error as e:
+        raise DBAPIError.instance(None, None, e, dbapi_error) from e
+
+
+def _discard_pipeline(session: SQLAlchemySession, connection: Connection) -> None:
+    pipeline = session.info.pop(_PIPELINE_KEY, None)
+    if pipeline is None:
+        return
+    # note: ロールバックするので、送ったままの文のエラーは捨てる
+    with suppress(session.get_bind().dialect.loaded_dbapi.Error):
+        pipeline[0].close()
+
+
+def _get_query(
+    session: SQLAlchemySession,
+    model: type[DeclarativeMeta],
+    columns: tuple[str, ...],
+    on_duplicate_key_update: list[str],
+    fill_if_null: list[str],
+    skip_unchanged: bool,
+) -> tuple[str, list[Any]]:
+    key = (model, columns, tuple(on_duplicate_key_update), tuple(fill_if_null), skip_unchanged)
+    query = _queries.get(key)
+    if query is None:
+        statement = _get_upsert_statement(
+            model, on_duplicate_key_update, fill_if_null, "postgresql", skip_unchanged
+        )
+        compiled = statement.compile(  # type: ignore[attr-defined]
+            dialect=session.get_bind().dialect, column_keys=list(columns)
+        )
+        table = model.__table__  # type: ignore[attr-defined]
+        defaulted_columns = [
+            table.c[name] for name in compiled.binds if name not in columns and name in table.c
+        ]
+        query = (compiled.string, defaulted_columns)
+        _queries[key] = query
+    return query
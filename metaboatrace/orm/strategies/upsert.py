@@ -1,26 +1,68 @@
+import logging
 import os
 from collections.abc import Callable
-from typing import Any
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Protocol
 
 import sqlalchemy.dialects.mysql as mysql
 import sqlalchemy.dialects.postgresql as postgresql
-from sqlalchemy import inspect
+from sqlalchemy import ColumnElement, Table, func, inspect, literal_column, or_
+from sqlalchemy.engine import Result
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy.orm import Session as SQLAlchemySession
+from sqlalchemy.sql import Executable
 
+from metaboatrace.orm.unit_of_work import commit
 
-def create_upsert_strategy() -> Callable[
-    [
-        SQLAlchemySession,
-        type[DeclarativeMeta],
-        list[dict[str, Any]],
-        list[str],
-    ],
-    bool,
-]:
+DEFAULT_CHUNK_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+# note: (モデル, 更新する列, NULL のときだけ埋める列, 方言, skip_unchanged) -> 値を含まない upsert 文
+_upsert_statements: dict[tuple[Any, ...], Executable] = {}
+_primary_keys: dict[type[DeclarativeMeta], list[str]] = {}
+
+_WRITTEN_ROWS_KEY = "written_rows"
+
+
+class UpsertStrategy(Protocol):
+    def __call__(
+        self,
+        session: SQLAlchemySession,
+        model: type[DeclarativeMeta],
+        values: list[dict[str, Any]],
+        on_duplicate_key_update: list[str],
+        fill_if_null: list[str] | None = None,
+    ) -> bool: ...
+
+
+def create_upsert_strategy(skip_unchanged: bool = False) -> UpsertStrategy:
+    """
+    skip_unchanged を指定すると、on_duplicate_key_update の列の値がどれも変わらない行は更新しない。
+    再クロールで同じ内容を書き直すたびに行が書き換わって WAL やテーブルが膨らむのを防ぐ。
+    挿入/更新した行数と変わらなかった行数はログに出し、get_written_rows でセッションから取り出せる。
+    値の変わらない行を判定する分だけ重くなるので、同じ行を何度も書き直す (ポーリングする) リポジトリでだけ指定する
+
+    返す関数の fill_if_null に指定した列は、既存の行の値が NULL のときだけ埋める
+    """
     if os.environ.get("DB", "postgresql") == "mysql":
+        # note: MySQL は値の変わらない行をもともと書き換えないので skip_unchanged は関係ない
         return _mysql_upsert_strategy
-    return _postgresql_upsert_strategy
+
+    strategy: Callable[..., bool] = _postgresql_upsert_strategy
+    if os.environ.get("UPSERT_MODE") == "copy":
+        # note: bulk_load がこのモジュールの関数を使うので、循環しないようにここで import する
+        from metaboatrace.orm.strategies.bulk_load import postgresql_copy_upsert_strategy
+
+        strategy = postgresql_copy_upsert_strategy
+    elif os.environ.get("UPSERT_MODE") == "pipeline":
+        from metaboatrace.orm.strategies.pipeline import psycopg_pipeline_upsert_strategy
+
+        strategy = psycopg_pipeline_upsert_strategy
+    if skip_unchanged:
+        return partial(strategy, skip_unchanged=True)
+    return strategy
 
 
 def _mysql_upsert_strategy(
@@ -28,13 +70,17 @@ def _mysql_upsert_strategy(
     model: type[DeclarativeMeta],
     values: list[dict[str, Any]],
     on_duplicate_key_update: list[str],
+    fill_if_null: list[str] | None = None,
 ) -> bool:
+    if not values:
+        return True
+
     try:
-        upsert_statement = mysql.insert(model).values(values)
-        update_dict = {field: upsert_statement.inserted[field] for field in on_duplicate_key_update}
-        on_duplicate_key_statement = upsert_statement.on_duplicate_key_update(**update_dict)
-        session.execute(on_duplicate_key_statement)
-        session.commit()
+        on_duplicate_key_statement = _get_upsert_statement(
+            model, on_duplicate_key_update, fill_if_null or [], "mysql", False
+        )
+        session.execute(on_duplicate_key_statement, values)
+        commit(session)
 
         return True
     except Exception as e:
@@ -47,33 +93,207 @@ def _postgresql_upsert_strategy(
     model: type[DeclarativeMeta],
     values: list[dict[str, Any]],
     on_duplicate_key_update: list[str],
+    fill_if_null: list[str] | None = None,
+    skip_unchanged: bool = False,
 ) -> bool:
+    if not values:
+        return True
+
     try:
-        index_elements = _get_primary_keys(model)
-        for value in values:
-            upsert_statement = postgresql.insert(model).values(value)
-            update_dict = {
-                field: upsert_statement.excluded[field] for field in on_duplicate_key_update
-            }
-            on_conflict_statement = upsert_statement.on_conflict_do_update(
-                index_elements=index_elements, set_=update_dict
-            )
-            session.execute(on_conflict_statement)
-        session.commit()
+        rows = _deduplicate_by_keys(values, _get_primary_keys(model))
+        on_conflict_statement = _get_upsert_statement(
+            model, on_duplicate_key_update, fill_if_null or [], "postgresql", skip_unchanged
+        )
+        # note: 行は executemany で渡し、SQLAlchemy が chunk_size 行ずつ複数行の VALUES にまとめて送る
+        result = session.execute(
+            on_conflict_statement,
+            rows,
+            execution_options={"insertmanyvalues_page_size": _get_chunk_size()},
+        )
+        if skip_unchanged:
+            inserted, updated = _count_written_rows(result)
+        commit(session)
 
+        if skip_unchanged:
+            _record_written_rows(session, model, len(rows), inserted, updated)
         return True
     except Exception as e:
         session.rollback()
         raise e
 
 
+def _get_upsert_statement(
+    model: type[DeclarativeMeta],
+    on_duplicate_key_update: list[str],
+    fill_if_null: list[str],
+    dialect: str,
+    skip_unchanged: bool,
+) -> Executable:
+    """
+    値を含まない upsert 文を (モデル, 更新する列, 方言) ごとに1回だけ組み立てて使い回す。
+    値は実行時に executemany のパラメーターとして渡すので、文の組み立てとコンパイルは初回だけで済む
+    """
+    key = (model, tuple(on_duplicate_key_update), tuple(fill_if_null), dialect, skip_unchanged)
+    statement = _upsert_statements.get(key)
+    if statement is None:
+        statement = _build_upsert_statement(
+            model, on_duplicate_key_update, fill_if_null, dialect, skip_unchanged
+        )
+        _upsert_statements[key] = statement
+    return statement
+
+
+def _build_upsert_statement(
+    model: type[DeclarativeMeta],
+    on_duplicate_key_update: list[str],
+    fill_if_null: list[str],
+    dialect: str,
+    skip_unchanged: bool,
+) -> Executable:
+    table = model.__table__  # type: ignore[attr-defined]
+    if dialect == "mysql":
+        upsert_statement = mysql.insert(table)
+        update_dict: dict[str, Any] = {
+            field: upsert_statement.inserted[field] for field in on_duplicate_key_update
+        }
+        for field in fill_if_null:
+            update_dict[field] = func.coalesce(table.c[field], upsert_statement.inserted[field])
+        if not update_dict:
+            return upsert_statement.prefix_with("IGNORE")
+        return upsert_statement.on_duplicate_key_update(**update_dict)
+
+    return _on_conflict(
+        postgresql.insert(table),
+        table,
+        _get_primary_keys(model),
+        on_duplicate_key_update,
+        skip_unchanged,
+        fill_if_null,
+    )
+
+
+def _on_conflict(
+    insert_statement: postgresql.Insert,
+    table: Table,
+    index_elements: list[str],
+    on_duplicate_key_update: list[str],
+    skip_unchanged: bool,
+    fill_if_null: list[str] | None = None,
+) -> Executable:
+    """
+    INSERT 文に ON CONFLICT 句を付ける。fill_if_null の列は COALESCE で既存の値を優先する。
+
+    skip_unchanged のときは、更新する列のどれかが IS DISTINCT FROM で異なる行だけを更新し、
+    そのときだけ updated_at も進める。
+    RETURNING (xmax = 0) で書き込んだ行ごとに挿入 (true) か更新 (false) かを返すので、返らなかった行は変化なしとみなせる
+    """
+    update_dict: dict[str, ColumnElement[Any]] = {
+        field: insert_statement.excluded[field] for field in on_duplicate_key_update
+    }
+    for field in fill_if_null or []:
+        update_dict[field] = func.coalesce(table.c[field], insert_statement.excluded[field])
+
+    if not update_dict:
+        statement = insert_statement.on_conflict_do_nothing(index_elements=index_elements)
+    elif skip_unchanged:
+        where = or_(
+            *[table.c[field].is_distinct_from(value) for field, value in update_dict.items()]
+        )
+        if "updated_at" in table.c:
+            update_dict["updated_at"] = insert_statement.excluded["updated_at"]
+        statement = insert_statement.on_conflict_do_update(
+            index_elements=index_elements, set_=update_dict, where=where
+        )
+    else:
+        statement = insert_statement.on_conflict_do_update(
+            index_elements=index_elements, set_=update_dict
+        )
+
+    if skip_unchanged:
+        return statement.returning(literal_column("xmax = 0").label("inserted"))
+    return statement
+
+
+def _count_written_rows(result: Result[Any]) -> tuple[int, int]:
+    """RETURNING (xmax = 0) の結果から (挿入した行数, 更新した行数) を返す"""
+    flags = result.scalars().all()
+    inserted = sum(1 for flag in flags if flag)
+    return inserted, len(flags) - inserted
+
+
+@dataclass
+class WrittenRows:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+
+def get_written_rows(session: SQLAlchemySession) -> dict[str, WrittenRows]:
+    """skip_unchanged を指定した upsert でセッションが挿入/更新した行数と、変わらなかった行数をテーブルごとに返す"""
+    written_rows: dict[str, WrittenRows] = session.info.get(_WRITTEN_ROWS_KEY, {})
+    return written_rows
+
+
+def _record_written_rows(
+    session: SQLAlchemySession,
+    model: type[DeclarativeMeta],
+    total: int,
+    inserted: int,
+    updated: int,
+) -> None:
+    table_name = model.__tablename__  # type: ignore[attr-defined]
+    written_rows = session.info.setdefault(_WRITTEN_ROWS_KEY, {}).setdefault(
+        table_name, WrittenRows()
+    )
+    written_rows.inserted += inserted
+    written_rows.updated += updated
+    written_rows.unchanged += total - inserted - updated
+    logger.info(
+        "upsert %s: inserted=%d updated=%d unchanged=%d",
+        table_name,
+        inserted,
+        updated,
+        total - inserted - updated,
+    )
+
+
+def _default_value(column: Any) -> Any:
+    if column.default.is_callable:
+        # note: SQLAlchemy は既定値の関数を実行コンテキストを受け取る形に包んでいる
+        return column.default.arg(None)
+    return column.default.arg
+
+
+def _get_chunk_size() -> int:
+    """
+    1つの INSERT 文にまとめる行数。
+    PostgreSQL のバインドパラメーターの上限 (65535) を超えないように、列の多いテーブルでも収まる程度にしておく
+    """
+    return int(os.environ.get("UPSERT_CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+
+
+def _deduplicate_by_keys(
+    values: list[dict[str, Any]], index_elements: list[str]
+) -> list[dict[str, Any]]:
+    """
+    同じキーの行が1つの文に含まれていると ON CONFLICT DO UPDATE が
+    "cannot affect row a second time" で失敗するので、後に出てきた行を優先して1行にまとめる
+    """
+    deduplicated = {tuple(value[key] for key in index_elements): value for value in values}
+    return list(deduplicated.values())
+
+
 def _get_primary_keys(model: type[DeclarativeMeta]) -> list[str]:
     """
     指定された SQLAlchemy モデルから主キーのカラム名のリストを返す。
     :param model: SQLAlchemy モデルクラス
     :return: 主キーのカラム名のリスト
     """
-    mapper = inspect(model)
-    if mapper is None:
-        raise ValueError("Model has no mapper or is not a valid SQLAlchemy model.")
-    return [key.name for key in mapper.primary_key]
+    primary_keys = _primary_keys.get(model)
+    if primary_keys is None:
+        mapper = inspect(model)
+        if mapper is None:
+            raise ValueError("Model has no mapper or is not a valid SQLAlchemy model.")
+        primary_keys = [key.name for key in mapper.primary_key]
+        _primary_keys[model] = primary_keys
+    return primary_keys
@@ -0,0 +1,52 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from metaboatrace.orm.database import Session, pin_to_primary
+
+_UNIT_OF_WORK_KEY = "unit_of_work"
+
+
+def is_in_unit_of_work(session: SQLAlchemySession) -> bool:
+    return bool(session.info.get(_UNIT_OF_WORK_KEY))
+
+
+def commit(session: SQLAlchemySession) -> None:
+    """ユニットオブワークの中ではコミットせず、ブロックを抜けるときにまとめてコミットさせる"""
+    if not is_in_unit_of_work(session):
+        session.commit()
+
+
+def close(session: SQLAlchemySession) -> None:
+    """ユニットオブワークの中では閉じない (閉じると書き込み途中のトランザクションが捨てられてしまう)"""
+    if not is_in_unit_of_work(session):
+        session.close()
+
+
+@contextmanager
+def unit_of_work() -> Iterator[SQLAlchemySession]:
+    """
+    ブロック内のリポジトリの書き込みを1つのトランザクションにまとめる。
+
+    リポジトリは scoped_session からスレッドごとに同じセッションを受け取るので、
+    ブロック内の書き込みはすべてこのセッションで行われ、ブロックを抜けるときに1回だけコミットされる。
+    途中で例外が起きた場合はすべてロールバックする。入れ子にした場合は外側のブロックにまとめる。
+    ブロック内の読み取りは、書き込み途中の行が見えるようにレプリカではなくこのセッションで行う。
+    """
+    session = Session()
+    if is_in_unit_of_work(session):
+        yield session
+        return
+
+    session.info[_UNIT_OF_WORK_KEY] = True
+    try:
+        with pin_to_primary():
+            yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.info.pop(_UNIT_OF_WORK_KEY, None)
+        session.close()
@@ -0,0 +1,212 @@
+"""
+リポジトリの非同期版
+
+同期のリポジトリを run_with_async_session で asyncpg の上で動かすので、
+entity から行への変換も upsert の仕方も同期のリポジトリと同じになる。
+"""
+
+from datetime import date
+from typing import Generic, TypeVar
+
+from metaboatrace.models.boat import BoatPerformance, MotorPerformance
+from metaboatrace.models.race import BoatSetting as BoatSettingEntity
+from metaboatrace.models.race import (
+    CircumferenceExhibitionRecord as CircumferenceExhibitionRecordEntity,
+)
+from metaboatrace.models.race import Odds as OddsEntity
+from metaboatrace.models.race import Payoff as PayoffEntity
+from metaboatrace.models.race import RaceEntry as RaceEntryEntity
+from metaboatrace.models.race import RaceInformation as RaceEntity
+from metaboatrace.models.race import RaceRecord as RaceRecordEntity
+from metaboatrace.models.race import StartExhibitionRecord as StartExhibitionRecordEntity
+from metaboatrace.models.race import WeatherCondition as WeatherConditionEntity
+from metaboatrace.models.racer import Racer as RacerEntity
+from metaboatrace.models.racer import RacerCondition as RacerConditionEntity
+from metaboatrace.models.racer import RacerPerformance as RacerPerformanceEntity
+from metaboatrace.models.stadium import Event as EventEntity
+from metaboatrace.models.stadium import MotorRenewal as MotorRenewalEntity
+from metaboatrace.orm.async_database import run_with_async_session
+
+from .base import Repository
+from .boat import (
+    BoatBettingContributeRateAggregationRepository,
+    BoatSettingRepository,
+    MotorBettingContributeRateAggregationRepository,
+    MotorMaintenanceRepository,
+)
+from .race import (
+    CircumferenceExhibitionRecordRepository,
+    DisqualifiedRaceEntryRepository,
+    OddsRepository,
+    PayoffRepository,
+    RaceEntryRepository,
+    RaceRecordRepository,
+    RaceRepository,
+    StartExhibitionRecordRepository,
+    WinningRaceEntryRepository,
+)
+from .racer import (
+    RacerConditionRepository,
+    RacerRepository,
+    RacerWinningRateAggregationRepository,
+)
+from .stadium import EventRepository, MotorRenewalRepository, WeatherConditionRepository
+
+T = TypeVar("T")
+R = TypeVar("R", bound=Repository)  # type: ignore[type-arg]
+
+
+class AsyncRepository(Generic[T, R]):
+    repository_class: type[R]
+
+    def __init__(self) -> None:
+        self._repository = self.repository_class()
+
+    async def create_or_update(self, entity: T) -> bool:
+        return await run_with_async_session(self._repository.create_or_update, entity)
+
+    async def create_or_update_many(
+        self, data: list[T], on_duplicate_key_update: list[str] | None = None
+    ) -> bool:
+        # note: 更新する列を省略した場合は、同期のリポジトリのデフォルトに任せる
+        if on_duplicate_key_update is None:
+            return await run_with_async_session(self._repository.create_or_update_many, data)
+        return await run_with_async_session(
+            self._repository.create_or_update_many, data, on_duplicate_key_update
+        )
+
+
+class AsyncEventRepository(AsyncRepository[EventEntity, EventRepository]):
+    repository_class = EventRepository
+
+
+class AsyncMotorRenewalRepository(AsyncRepository[MotorRenewalEntity, MotorRenewalRepository]):
+    repository_class = MotorRenewalRepository
+
+
+class AsyncWeatherConditionRepository(
+    AsyncRepository[WeatherConditionEntity, WeatherConditionRepository]
+):
+    repository_class = WeatherConditionRepository
+
+
+class AsyncRaceRepository(AsyncRepository[RaceEntity, RaceRepository]):
+    repository_class = RaceRepository
+
+    async def find_by_key(
+        self, stadium_tel_code: int, date: date, race_number: int
+    ) -> RaceEntity | None:
+        return await run_with_async_session(
+            self._repository.find_by_key, stadium_tel_code, date, race_number
+        )
+
+    async def find_all_by_date(self, date: date) -> list[RaceEntity]:
+        return await run_with_async_session(self._repository.find_all_by_date, date)
+
+    async def cancel(self, stadium_tel_code: int, date: date, race_number: int) -> bool:
+        return await run_with_async_session(
+            self._repository.cancel, stadium_tel_code, date, race_number
+        )
+
+    async def cancel_many(self, keys: list[tuple[int, date, int]]) -> bool:
+        return await run_with_async_session(self._repository.cancel_many, keys)
+
+
+class AsyncRaceEntryRepository(AsyncRepository[RaceEntryEntity, RaceEntryRepository]):
+    repository_class = RaceEntryRepository
+
+
+class AsyncStartExhibitionRecordRepository(
+    AsyncRepository[StartExhibitionRecordEntity, StartExhibitionRecordRepository]
+):
+    repository_class = StartExhibitionRecordRepository
+
+
+class AsyncCircumferenceExhibitionRecordRepository(
+    AsyncRepository[CircumferenceExhibitionRecordEntity, CircumferenceExhibitionRecordRepository]
+):
+    repository_class = CircumferenceExhibitionRecordRepository
+
+
+class AsyncOddsRepository(AsyncRepository[OddsEntity, OddsRepository]):
+    repository_class = OddsRepository
+
+
+class AsyncPayoffRepository(AsyncRepository[PayoffEntity, PayoffRepository]):
+    repository_class = PayoffRepository
+
+
+class AsyncRaceRecordRepository(AsyncRepository[RaceRecordEntity, RaceRecordRepository]):
+    repository_class = RaceRecordRepository
+
+
+class AsyncWinningRaceEntryRepository(
+    AsyncRepository[RaceRecordEntity, WinningRaceEntryRepository]
+):
+    repository_class = WinningRaceEntryRepository
+
+
+class AsyncDisqualifiedRaceEntryRepository(
+    AsyncRepository[RaceRecordEntity, DisqualifiedRaceEntryRepository]
+):
+    repository_class = DisqualifiedRaceEntryRepository
+
+
+class AsyncRacerRepository(AsyncRepository[RacerEntity, RacerRepository]):
+    repository_class = RacerRepository
+
+    async def make_retired(self, racer_registration_number: int) -> bool:
+        return await run_with_async_session(
+            self._repository.make_retired, racer_registration_number
+        )
+
+    async def make_retired_many(self, racer_registration_numbers: list[int]) -> bool:
+        return await run_with_async_session(
+            self._repository.make_retired_many, racer_registration_numbers
+        )
+
+
+class AsyncRacerConditionRepository(
+    AsyncRepository[RacerConditionEntity, RacerConditionRepository]
+):
+    repository_class = RacerConditionRepository
+
+
+class AsyncRacerWinningRateAggregationRepository(
+    AsyncRepository[RacerPerformanceEntity, RacerWinningRateAggregationRepository]
+):
+    repository_class = RacerWinningRateAggregationRepository
+
+
+class AsyncBoatSettingRepository(AsyncRepository[BoatSettingEntity, BoatSettingRepository]):
+    repository_class = BoatSettingRepository
+
+    async def get_motor_number(
+        self, stadium_tel_code: int, date: date, race_number: int, pit_number: int
+    ) -> int:
+        return await run_with_async_session(
+            self._repository.get_motor_number, stadium_tel_code, date, race_number, pit_number
+        )
+
+    async def get_motor_numbers(
+        self, keys: list[tuple[int, date, int, int]]
+    ) -> dict[tuple[int, date, int, int], int]:
+        return await run_with_async_session(self._repository.get_motor_numbers, keys)
+
+
+class AsyncBoatBettingContributeRateAggregationRepository(
+    AsyncRepository[BoatPerformance, BoatBettingContributeRateAggregationRepository]
+):
+    repository_class = BoatBettingContributeRateAggregationRepository
+
+
+class AsyncMotorBettingContributeRateAggregationRepository(
+    AsyncRepository[MotorPerformance, MotorBettingContributeRateAggregationRepository]
+):
+    repository_class = MotorBettingContributeRateAggregationRepository
+
+
+class AsyncMotorMaintenanceRepository(
+    AsyncRepository[BoatSettingEntity, MotorMaintenanceRepository]
+):
+    repository_class = MotorMaintenanceRepository
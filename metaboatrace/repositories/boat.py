@@ -1,11 +1,13 @@
 from datetime import date
 from typing import Any
 
+from sqlalchemy import tuple_
+
 from metaboatrace.models.boat import BoatPerformance, MotorPerformance
 
 # hack: こっちのリポジトリでは boat モジュールに置いてるので統一したい
 from metaboatrace.models.race import BoatSetting as BoatSettingEntity
-from metaboatrace.orm.database import Session
+from metaboatrace.orm.database import ReadSession, Session, pin_to_primary
 from metaboatrace.orm.models.boat import (
     BoatBettingContributeRateAggregation as BoatBettingContributeRateAggregationOrm,
 )
@@ -15,6 +17,7 @@ from metaboatrace.orm.models.boat import (
 )
 from metaboatrace.orm.models.boat import MotorMaintenance as MotorMaintenanceOrm
 from metaboatrace.orm.strategies.upsert import create_upsert_strategy
+from metaboatrace.orm.unit_of_work import close
 
 from .base import Repository
 
@@ -47,7 +50,7 @@ class BoatSettingRepository(Repository[BoatSettingEntity]):
     ) -> bool:
         values = [_transform_boat_setting_entity(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_upsert_strategy(skip_unchanged=True)
         session = Session()
 
         return upsert_strategy(
@@ -60,7 +63,8 @@ class BoatSettingRepository(Repository[BoatSettingEntity]):
     def get_motor_number(
         self, stadium_tel_code: int, date: date, race_number: int, pit_number: int
     ) -> int:
-        with Session() as session:
+        session = ReadSession()
+        try:
             boat_setting = (
                 session.query(BoatSettingOrm)
                 .filter(
@@ -76,6 +80,46 @@ class BoatSettingRepository(Repository[BoatSettingEntity]):
                 raise MotorNumberNotFoundError()
 
             return boat_setting.motor_number  # type: ignore[return-value]
+        finally:
+            close(session)
+
+    def get_motor_numbers(
+        self, keys: list[tuple[int, date, int, int]]
+    ) -> dict[tuple[int, date, int, int], int]:
+        """
+        (場コード, 開催日, レース番号, 枠番) のリストに対応するモーター番号を1回のクエリでまとめて引く。
+        モーター番号が登録されていないキーは結果に含まれない
+        """
+        if not keys:
+            return {}
+
+        session = ReadSession()
+        try:
+            rows = (
+                session.query(
+                    BoatSettingOrm.stadium_tel_code,
+                    BoatSettingOrm.date,
+                    BoatSettingOrm.race_number,
+                    BoatSettingOrm.pit_number,
+                    BoatSettingOrm.motor_number,
+                )
+                .filter(
+                    tuple_(
+                        BoatSettingOrm.stadium_tel_code,
+                        BoatSettingOrm.date,
+                        BoatSettingOrm.race_number,
+                        BoatSettingOrm.pit_number,
+                    ).in_(set(keys)),
+                    BoatSettingOrm.motor_number.isnot(None),
+                )
+                .all()
+            )
+            return {
+                (stadium_tel_code, date, race_number, pit_number): motor_number
+                for stadium_tel_code, date, race_number, pit_number, motor_number in rows
+            }
+        finally:
+            close(session)
 
 
 def _transform_boat_performance_entity(entity: BoatPerformance) -> dict[str, Any]:
@@ -101,7 +145,7 @@ class BoatBettingContributeRateAggregationRepository(Repository[BoatPerformance]
             on_duplicate_key_update = ["quinella_rate", "trio_rate"]
         values = [_transform_boat_performance_entity(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_upsert_strategy(skip_unchanged=True)
         session = Session()
 
         return upsert_strategy(
@@ -135,7 +179,7 @@ class MotorBettingContributeRateAggregationRepository(Repository[MotorPerformanc
             on_duplicate_key_update = ["quinella_rate", "trio_rate"]
         values = [_transform_motor_performance_entity(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_upsert_strategy(skip_unchanged=True)
         session = Session()
 
         return upsert_strategy(
@@ -158,9 +202,11 @@ class MotorMaintenanceRepository(Repository[BoatSettingEntity]):
         if on_duplicate_key_update is None:
             on_duplicate_key_update = ["quantity"]
         boat_setting_repository = BoatSettingRepository()
-        values = self._transform_entities_to_values(data, boat_setting_repository)
+        # note: 直前に書き込んだ展示情報のモーター番号を引くので、レプリカではなくプライマリで読む
+        with pin_to_primary():
+            values = self._transform_entities_to_values(data, boat_setting_repository)
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_upsert_strategy(skip_unchanged=True)
         session = Session()
 
         return upsert_strategy(
@@ -173,19 +219,33 @@ class MotorMaintenanceRepository(Repository[BoatSettingEntity]):
     def _transform_entities_to_values(
         self, data: list[BoatSettingEntity], boat_setting_repository: BoatSettingRepository
     ) -> list[dict[str, Any]]:
-        transformed_values = []
-        for entity in data:
-            if not entity.motor_parts_exchanges:
-                continue
+        entities = [entity for entity in data if entity.motor_parts_exchanges]
+        motor_numbers = boat_setting_repository.get_motor_numbers(
+            [
+                (
+                    entity.stadium_tel_code.value,
+                    entity.race_holding_date,
+                    entity.race_number,
+                    entity.pit_number,
+                )
+                for entity in entities
+            ]
+        )
 
-            for motor_part, quantity in entity.motor_parts_exchanges:
-                motor_number = boat_setting_repository.get_motor_number(
+        transformed_values = []
+        for entity in entities:
+            motor_number = motor_numbers.get(
+                (
                     entity.stadium_tel_code.value,
                     entity.race_holding_date,
                     entity.race_number,
                     entity.pit_number,
                 )
+            )
+            if motor_number is None:
+                raise MotorNumberNotFoundError()
 
+            for motor_part, quantity in entity.motor_parts_exchanges:
                 transformed_values.append(
                     {
                         "stadium_tel_code": entity.stadium_tel_code.value,
@@ -0,0 +1,320 @@
+"""
+リポジトリの書き込みをまとめて反映するライトビハインドバッファー
+
+オッズを取得する時間帯は、多数のタスクがそれぞれ同じテーブルに少しずつ upsert する。
+WRITE_BEHIND_ENABLED=true にすると、書き込みをすぐには反映せずに (モデル, 更新する列) ごとのバッファーに溜め、
+同じキーの行は後から来た値で1行にまとめて (fill_if_null の列は最初の NULL でない値を残す)、一定の行数か一定の時間ごとに (モデル, 更新する列) ごとのトランザクションで反映する。
+
+- WRITE_BEHIND_FLUSH_INTERVAL 秒 (デフォルト 5) ごとに、バックグラウンドのスレッドが反映する
+- 溜まった行が WRITE_BEHIND_MAX_ROWS 行 (デフォルト 5000) に達したら、間隔を待たずに反映する
+- 反映に失敗した行はバッファーに戻して次の反映でやり直す。WRITE_BEHIND_MAX_RETRIES 回 (デフォルト 3) 続けて失敗したら、
+  ほかの書き込みを止めないようにバッファーから外してスプール (spool.py) に書く
+- ユニットオブワークの中の書き込みは、コミットしたときにバッファーに入れる (ロールバックしたら捨てる)
+- すぐに反映しなければならない書き込みは write_through() のブロックの中で行う
+- Celery のワーカーを終了するときは、溜まっている行をすべて反映してから終了する。反映できなければスプール (spool.py) に書く
+- SPOOL_ENABLED=true のときは、バッファーの代わりにスプールに書く
+
+反映するまではほかのプロセスから見えないので、書いた直後に読む必要のあるテーブル (races など) には使わない。
+"""
+
+import atexit
+import logging
+import os
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+from functools import partial
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from metaboatrace.orm.database import Session
+from metaboatrace.orm.strategies.upsert import (
+    UpsertStrategy,
+    _get_primary_keys,
+    create_upsert_strategy,
+)
+from metaboatrace.orm.unit_of_work import is_in_unit_of_work, unit_of_work
+
+from .spool import get_spool_writer, is_spool_enabled, merge_rows
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 5.0
+DEFAULT_MAX_ROWS = 5000
+DEFAULT_MAX_RETRIES = 3
+
+_PENDING_KEY = "write_behind_pending"
+
+# note: (モデル, 更新する列, NULL のときだけ埋める列)
+BufferKey = tuple[type[DeclarativeMeta], tuple[str, ...], tuple[str, ...]]
+
+_write_through: ContextVar[bool] = ContextVar("write_through", default=False)
+
+
+def is_write_behind_enabled() -> bool:
+    return os.environ.get("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+
+
+@contextmanager
+def write_through() -> Iterator[None]:
+    """ブロック内の書き込みはバッファーを使わずにすぐに反映する"""
+    token = _write_through.set(True)
+    try:
+        yield
+    finally:
+        _write_through.reset(token)
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self, flush_interval: float, max_rows: int, max_retries: int = DEFAULT_MAX_RETRIES
+    ) -> None:
+        self._flush_interval = flush_interval
+        self._max_rows = max_rows
+        self._max_retries = max_retries
+        self._lock = threading.Lock()
+        # note: バックグラウンドのスレッドと終了時の反映が重ならないように、反映は1つずつ行う
+        self._flush_lock = threading.Lock()
+        self._buckets: dict[BufferKey, dict[tuple[Any, ...], dict[str, Any]]] = {}
+        self._rows = 0
+        # note: (モデル, 更新する列) ごとの続けて反映に失敗した回数
+        self._failures: dict[BufferKey, int] = {}
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+        self._thread.start()
+
+    def add(self, key: BufferKey, values: list[dict[str, Any]]) -> None:
+        index_elements = _get_primary_keys(key[0])
+        with self._lock:
+            bucket = self._buckets.setdefault(key, {})
+            for value in values:
+                row_key = tuple(value[column] for column in index_elements)
+                if row_key in bucket:
+                    bucket[row_key] = merge_rows(bucket[row_key], value, key[2])
+                else:
+                    bucket[row_key] = value
+                    self._rows += 1
+            is_full = self._rows >= self._max_rows
+        if is_full:
+            self._wake.set()
+
+    def pending_rows(self) -> int:
+        with self._lock:
+            return self._rows
+
+    def flush(self) -> int:
+        """
+        溜まっている行を (モデル, 更新する列) ごとのトランザクションで反映し、反映した行数を返す。
+        失敗した行はバッファーに戻し (続けて失敗した場合はスプールに書き)、ほかの行を反映してから例外を投げ直す
+        """
+        with self._flush_lock:
+            with self._lock:
+                buckets, self._buckets, self._rows = self._buckets, {}, 0
+            if not buckets:
+                return 0
+
+            flushed = 0
+            error: Exception | None = None
+            upsert_strategy = create_upsert_strategy(skip_unchanged=True)
+            for key, bucket in buckets.items():
+                model, on_duplicate_key_update, fill_if_null = key
+                try:
+                    with unit_of_work() as session:
+                        upsert_strategy(
+                            session,
+                            model,
+                            list(bucket.values()),
+                            list(on_duplicate_key_update),
+                            list(fill_if_null),
+                        )
+                except Exception as e:
+                    error = e
+                    self._fail(key, bucket)
+                    continue
+                finally:
+                    Session.remove()
+                self._failures.pop(key, None)
+                flushed += len(bucket)
+
+            logger.info("write-behind flushed %d rows in %d tables", flushed, len(buckets))
+            if error is not None:
+                raise error
+            return flushed
+
+    def _fail(self, key: BufferKey, bucket: dict[tuple[Any, ...], dict[str, Any]]) -> None:
+        failures = self._failures.get(key, 0) + 1
+        if failures < self._max_retries:
+            logger.exception(
+                "Failed to flush %d buffered rows into %s; they will be retried",
+                len(bucket),
+                key[0].__name__,
+            )
+            self._failures[key] = failures
+            self._restore({key: bucket})
+            return
+
+        # note: 反映できない行が1つでもあると同じバケットの行がずっと反映されないので、諦めてスプールに移す
+        self._failures.pop(key, None)
+        try:
+            get_spool_writer().append(key, list(bucket.values()))
+        except Exception:
+            logger.exception(
+                "Dropped %d buffered rows into %s that failed %d times",
+                len(bucket),
+                key[0].__name__,
+                failures,
+            )
+            return
+        logger.exception(
+            "Spooled %d buffered rows into %s that failed %d times",
+            len(bucket),
+            key[0].__name__,
+            failures,
+        )
+
+    def close(self) -> None:
+        """バックグラウンドのスレッドを止め、溜まっている行をすべて反映する"""
+        self._closed.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        try:
+            self.flush()
+        except Exception:
+            self._spool_pending_rows()
+
+    def _spool_pending_rows(self) -> None:
+        # note: 終了するまでに DB に反映できなかった行は、失わないようにスプールに書いておく
+        with self._lock:
+            buckets, self._buckets, self._rows = self._buckets, {}, 0
+        rows = sum(len(bucket) for bucket in buckets.values())
+        try:
+            writer = get_spool_writer()
+            for key, bucket in buckets.items():
+                writer.append(key, list(bucket.values()))
+        except Exception:
+            logger.exception("Lost %d buffered rows on shutdown", rows)
+            return
+        logger.error("Spooled %d buffered rows that could not be flushed on shutdown", rows)
+
+    def _restore(self, buckets: dict[BufferKey, dict[tuple[Any, ...], dict[str, Any]]]) -> None:
+        # note: 反映に失敗している間に来た新しい値を、失敗した古い値で上書きしない
+        with self._lock:
+            for key, bucket in buckets.items():
+                current = self._buckets.setdefault(key, {})
+                for row_key, value in bucket.items():
+                    if row_key in current:
+                        current[row_key] = merge_rows(value, current[row_key], key[2])
+                    else:
+                        current[row_key] = value
+                        self._rows += 1
+
+    def _run(self) -> None:
+        while not self._closed.is_set():
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            if self._closed.is_set():
+                return
+            # note: 失敗した行はバッファーに戻してあるので、次の反映でやり直す
+            with suppress(Exception):
+                self.flush()
+
+
+_buffer: WriteBehindBuffer | None = None
+_buffer_pid: int | None = None
+_buffer_lock = threading.Lock()
+
+
+def get_write_behind_buffer() -> WriteBehindBuffer:
+    """
+    プロセスごとに1つのバッファーを返す。
+    fork された子プロセスは親のバッファーの行 (親が反映する) とスレッドを引き継がずに、新しいバッファーを作る
+    """
+    global _buffer, _buffer_pid
+    pid = os.getpid()
+    if _buffer is None or _buffer_pid != pid:
+        with _buffer_lock:
+            if _buffer is None or _buffer_pid != pid:
+                _buffer = WriteBehindBuffer(
+                    float(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)),
+                    int(os.environ.get("WRITE_BEHIND_MAX_ROWS", DEFAULT_MAX_ROWS)),
+                    int(os.environ.get("WRITE_BEHIND_MAX_RETRIES", DEFAULT_MAX_RETRIES)),
+                )
+                _buffer.start()
+                _buffer_pid = pid
+                atexit.register(_buffer.close)
+    return _buffer
+
+
+def flush_write_behind_buffer() -> None:
+    """このプロセスのバッファーを閉じ、溜まっている行をすべて反映する。ワーカーの終了時に呼ぶ"""
+    global _buffer, _buffer_pid
+    if _buffer is None or _buffer_pid != os.getpid():
+        return
+    with _buffer_lock:
+        buffer, _buffer, _buffer_pid = _buffer, None, None
+    atexit.unregister(buffer.close)
+    buffer.close()
+
+
+def create_write_behind_upsert_strategy(skip_unchanged: bool = False) -> UpsertStrategy:
+    """
+    WRITE_BEHIND_ENABLED のときは書き込みをバッファーに、SPOOL_ENABLED のときはスプールに入れる strategy を返す。
+    どちらでもなければ create_upsert_strategy(skip_unchanged) と同じ。
+    バッファーやスプールから反映するときは、同じ行をまとめて書き直すことが多いので常に skip_unchanged で反映する
+    """
+    if not is_write_behind_enabled() and not is_spool_enabled():
+        return create_upsert_strategy(skip_unchanged=skip_unchanged)
+    return partial(_write_behind_upsert_strategy, skip_unchanged=skip_unchanged)
+
+
+def _write_behind_upsert_strategy(
+    session: SQLAlchemySession,
+    model: type[DeclarativeMeta],
+    values: list[dict[str, Any]],
+    on_duplicate_key_update: list[str],
+    fill_if_null: list[str] | None = None,
+    skip_unchanged: bool = False,
+) -> bool:
+    if _write_through.get():
+        return create_upsert_strategy(skip_unchanged=skip_unchanged)(
+            session, model, values, on_duplicate_key_update, fill_if_null
+        )
+    if not values:
+        return True
+
+    key = (model, tuple(on_duplicate_key_update), tuple(fill_if_null or []))
+    if is_in_unit_of_work(session):
+        if session.get_transaction() is None:
+            # note: DB にまだ何も書いていなくても、ロールバックしたときに after_rollback が呼ばれるようにする
+            session.begin()
+        session.info.setdefault(_PENDING_KEY, []).append((key, values))
+    else:
+        _defer(key, values)
+    return True
+
+
+def _defer(key: BufferKey, values: list[dict[str, Any]]) -> None:
+    if is_spool_enabled():
+        get_spool_writer().append(key, values)
+    else:
+        get_write_behind_buffer().add(key, values)
+
+
+@event.listens_for(SQLAlchemySession, "after_commit")
+def _enqueue_pending_writes(session: SQLAlchemySession) -> None:
+    for key, values in session.info.pop(_PENDING_KEY, None) or []:
+        _defer(key, values)
+
+
+@event.listens_for(SQLAlchemySession, "after_rollback")
+def _discard_pending_writes(session: SQLAlchemySession) -> None:
+    session.info.pop(_PENDING_KEY, None)
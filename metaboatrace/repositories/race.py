@@ -12,7 +12,7 @@ from metaboatrace.models.race import RaceInformation as RaceEntity
 from metaboatrace.models.race import RaceRecord as RaceRecordEntity
 from metaboatrace.models.race import StartExhibitionRecord as StartExhibitionRecordEntity
 from metaboatrace.models.stadium import StadiumTelCode
-from metaboatrace.orm.database import Session
+from metaboatrace.orm.database import ReadSession, Session
 from metaboatrace.orm.models.race import (
     CircumferenceExhibitionRecord as CircumferenceExhibitionRecordOrm,
 )
@@ -25,8 +25,10 @@ from metaboatrace.orm.models.race import RaceRecord as RaceRecordOrm
 from metaboatrace.orm.models.race import StartExhibitionRecord as StartExhibitionRecordOrm
 from metaboatrace.orm.models.race import WinningRaceEntry as WinningRaceEntryOrm
 from metaboatrace.orm.strategies.upsert import create_upsert_strategy
+from metaboatrace.orm.unit_of_work import close
 
 from .base import Repository
+from .buffer import create_write_behind_upsert_strategy
 
 
 def _transform_race_entity(entity: RaceEntity) -> dict[str, Any]:
@@ -57,7 +59,7 @@ def _race_orm_to_entity(race_orm: RaceOrm) -> RaceEntity:
 
 class RaceRepository(Repository[RaceEntity]):
     def find_by_key(self, stadium_tel_code: int, date: date, race_number: int) -> RaceEntity | None:
-        session = Session()
+        session = ReadSession()
         try:
             race_orm = (
                 session.query(RaceOrm)
@@ -68,15 +70,15 @@ class RaceRepository(Repository[RaceEntity]):
                 return _race_orm_to_entity(race_orm)
             return None
         finally:
-            session.close()
+            close(session)
 
     def find_all_by_date(self, date: date) -> list[RaceEntity]:
-        session = Session()
+        session = ReadSession()
         try:
             race_orms = session.query(RaceOrm).filter_by(date=date).all()
             return [_race_orm_to_entity(race_orm) for race_orm in race_orms]
         finally:
-            session.close()
+            close(session)
 
     def create_or_update(self, entity: RaceEntity) -> bool:
         return self.create_or_update_many(
@@ -105,7 +107,7 @@ class RaceRepository(Repository[RaceEntity]):
             ]
         values = [_transform_race_entity(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_upsert_strategy(skip_unchanged=True)
         session = Session()
 
         return upsert_strategy(
@@ -116,35 +118,24 @@ class RaceRepository(Repository[RaceEntity]):
         )
 
     def cancel(self, stadium_tel_code: int, date: date, race_number: int) -> bool:
-        session = Session()
+        return self.cancel_many([(stadium_tel_code, date, race_number)])
 
-        try:
-            race_orm = (
-                session.query(RaceOrm)
-                .filter_by(stadium_tel_code=stadium_tel_code, date=date, race_number=race_number)
-                .first()
-            )
-
-            if not race_orm:
-                race_orm = RaceOrm(
-                    stadium_tel_code=stadium_tel_code,
-                    date=date,
-                    race_number=race_number,
-                    is_canceled=True,
-                )
-                session.add(race_orm)
-            else:
-                race_orm.is_canceled = True  # type: ignore
-
-            session.commit()
-            return True
+    def cancel_many(self, keys: list[tuple[int, date, int]]) -> bool:
+        """(場コード, 開催日, レース番号) のレースを中止にする。まだ登録されていないレースはキーだけで登録する"""
+        values = [
+            {
+                "stadium_tel_code": stadium_tel_code,
+                "date": date,
+                "race_number": race_number,
+                "is_canceled": True,
+            }
+            for stadium_tel_code, date, race_number in keys
+        ]
 
-        except Exception as e:
-            session.rollback()
-            raise e
+        upsert_strategy = create_upsert_strategy()
+        session = Session()
 
-        finally:
-            session.close()
+        return upsert_strategy(session, RaceOrm, values, ["is_canceled"])
 
 
 def _transform_race_entry_entity(entity: RaceEntryEntity) -> dict[str, Any]:
@@ -170,7 +161,7 @@ class RaceEntryRepository(Repository[RaceEntryEntity]):
             on_duplicate_key_update = ["racer_registration_number"]
         values = [_transform_race_entry_entity(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_upsert_strategy(skip_unchanged=True)
         session = Session()
 
         return upsert_strategy(
@@ -207,7 +198,7 @@ class StartExhibitionRecordRepository(Repository[StartExhibitionRecordEntity]):
             on_duplicate_key_update = ["course_number", "start_time"]
         values = [_transform_start_exhibition_record_entity(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_write_behind_upsert_strategy(skip_unchanged=True)
         session = Session()
 
         return upsert_strategy(
@@ -243,7 +234,7 @@ class CircumferenceExhibitionRecordRepository(Repository[CircumferenceExhibition
             on_duplicate_key_update = ["exhibition_time"]
         values = [_transform_circumference_exhibition_record_entity(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_write_behind_upsert_strategy(skip_unchanged=True)
         session = Session()
 
         return upsert_strategy(
@@ -282,7 +273,7 @@ class OddsRepository(Repository[OddsEntity]):
             on_duplicate_key_update = ["ratio"]
         values = [_transform_odds_entity(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_write_behind_upsert_strategy(skip_unchanged=True)
         session = Session()
 
         return upsert_strategy(
@@ -321,7 +312,7 @@ class PayoffRepository(Repository[PayoffEntity]):
             on_duplicate_key_update = ["amount"]
         values = [_transform_payoff_entity(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_write_behind_upsert_strategy()
         session = Session()
 
         return upsert_strategy(
@@ -374,7 +365,7 @@ class RaceRecordRepository(Repository[RaceRecordEntity]):
             )
         ]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_write_behind_upsert_strategy()
         session = Session()
 
         return upsert_strategy(
@@ -412,7 +403,7 @@ class WinningRaceEntryRepository(Repository[RaceRecordEntity]):
             ]
         values = [_transform_race_record_entity_to_winning_race_entry(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_write_behind_upsert_strategy()
         session = Session()
 
         return upsert_strategy(
@@ -452,7 +443,7 @@ class DisqualifiedRaceEntryRepository(Repository[RaceRecordEntity]):
             _transform_race_record_entity_to_disqualified_race_entry(entity) for entity in data
         ]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_write_behind_upsert_strategy()
         session = Session()
 
         return upsert_strategy(
@@ -13,6 +13,7 @@ from metaboatrace.orm.models.racer import (
 from metaboatrace.orm.strategies.upsert import create_upsert_strategy
 
 from .base import Repository
+from .buffer import create_write_behind_upsert_strategy
 
 
 class RacerStatus(Enum):
@@ -20,64 +21,51 @@ class RacerStatus(Enum):
     retired = 2
 
 
+def _transform_racer_entity(entity: RacerEntity) -> dict[str, Any]:
+    return {
+        "registration_number": entity.registration_number,
+        "last_name": entity.last_name,
+        "first_name": entity.first_name,
+        "gender": entity.gender.value if entity.gender else None,
+        "term": entity.term,
+        "birth_date": entity.birth_date,
+        "branch_id": entity.branch.value if entity.branch else None,
+        "birth_prefecture_id": entity.born_prefecture.value if entity.born_prefecture else None,
+        "height": entity.height,
+    }
+
+
 class RacerRepository(Repository[RacerEntity]):
     def create_or_update(self, entity: RacerEntity) -> bool:
+        """プロフィールの内容で上書きして現役にする。性別は未登録の場合だけ埋める"""
+        values = [{**_transform_racer_entity(entity), "status": RacerStatus.active.value}]
+
+        upsert_strategy = create_upsert_strategy()
         session = Session()
 
-        try:
-            racer_orm = (
-                session.query(RacerOrm)
-                .filter_by(registration_number=entity.registration_number)
-                .first()
-            )
-            if racer_orm is None:
-                racer_orm = RacerOrm()
-                session.add(racer_orm)
-
-            racer_orm.registration_number = entity.registration_number
-            racer_orm.last_name = entity.last_name
-            racer_orm.first_name = entity.first_name
-            if racer_orm.gender is None:
-                racer_orm.gender = entity.gender.value if entity.gender else None
-            racer_orm.term = entity.term
-            racer_orm.birth_date = entity.birth_date
-            racer_orm.branch_id = entity.branch.value if entity.branch else None
-            racer_orm.birth_prefecture_id = (
-                entity.born_prefecture.value if entity.born_prefecture else None
-            )
-            racer_orm.height = entity.height
-            racer_orm.status = RacerStatus.active.value  # type: ignore[assignment]
-
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.close()
-
-        return True
+        return upsert_strategy(
+            session,
+            RacerOrm,
+            values,
+            [
+                "last_name",
+                "first_name",
+                "term",
+                "birth_date",
+                "branch_id",
+                "birth_prefecture_id",
+                "height",
+                "status",
+            ],
+            fill_if_null=["gender"],
+        )
 
     def create_or_update_many(
         self, data: list[RacerEntity], on_duplicate_key_update: list[str] | None = None
     ) -> bool:
         if on_duplicate_key_update is None:
             on_duplicate_key_update = ["gender"]
-        values = [
-            {
-                "registration_number": racer.registration_number,
-                "last_name": racer.last_name,
-                "first_name": racer.first_name,
-                "gender": racer.gender.value if racer.gender else None,
-                "term": racer.term,
-                "birth_date": racer.birth_date,
-                "branch_id": racer.branch.value if racer.branch else None,
-                "birth_prefecture_id": (
-                    racer.born_prefecture.value if racer.born_prefecture else None
-                ),
-                "height": racer.height,
-            }
-            for racer in data
-        ]
+        values = [_transform_racer_entity(racer) for racer in data]
 
         upsert_strategy = create_upsert_strategy()
         session = Session()
@@ -85,28 +73,19 @@ class RacerRepository(Repository[RacerEntity]):
         return upsert_strategy(session, RacerOrm, values, on_duplicate_key_update)
 
     def make_retired(self, racer_registration_number: int) -> bool:
-        session = Session()
+        return self.make_retired_many([racer_registration_number])
 
-        try:
-            racer_orm = (
-                session.query(RacerOrm)
-                .filter_by(registration_number=racer_registration_number)
-                .first()
-            )
-            if racer_orm is None:
-                racer_orm = RacerOrm(registration_number=racer_registration_number)
-                session.add(racer_orm)
-
-            racer_orm.status = RacerStatus.retired.value  # type: ignore[assignment]
+    def make_retired_many(self, racer_registration_numbers: list[int]) -> bool:
+        """引退扱いにする。登録されていないレーサーは登録番号だけで登録する"""
+        values = [
+            {"registration_number": registration_number, "status": RacerStatus.retired.value}
+            for registration_number in racer_registration_numbers
+        ]
 
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.close()
+        upsert_strategy = create_upsert_strategy()
+        session = Session()
 
-        return True
+        return upsert_strategy(session, RacerOrm, values, ["status"])
 
 
 def _transform_racer_condition_entity(
@@ -133,7 +112,7 @@ class RacerConditionRepository(Repository[RacerConditionEntity]):
             on_duplicate_key_update = ["weight", "adjust"]
         values = [_transform_racer_condition_entity(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_write_behind_upsert_strategy(skip_unchanged=True)
         session = Session()
 
         return upsert_strategy(
@@ -170,7 +149,7 @@ class RacerWinningRateAggregationRepository(Repository[RacerPerformanceEntity]):
             on_duplicate_key_update = ["rate_in_all_stadium", "rate_in_event_going_stadium"]
         values = [_transform_racer_performance_entity(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_upsert_strategy(skip_unchanged=True)
         session = Session()
 
         return upsert_strategy(
@@ -0,0 +1,332 @@
+"""
+DB に書き込む代わりに、行をローカルのファイルに追記するスプール
+
+SPOOL_ENABLED=true にすると、ライトビハインドバッファーを使うリポジトリ (buffer.py) の書き込みは DB に送らずに
+SPOOL_DIR (デフォルト ./spool) のセグメントファイルに追記する。クロールの速さが DB の応答時間や障害に左右されなくなる。
+スプールした行は scripts/replay_spool.py が DB が使えるようになってから反映する。
+
+スプールに書くのは、ライトビハインドバッファーを使うテーブル (オッズ、展示、選手のコンディション、水面気象、払戻金、レース結果など) だけ。
+races、race_entries、boat_settings など書いた直後に読むテーブルは DB に直接書くので、DB が使えない間は
+それらに書き込むページ (出走表、直前情報、開催日程、選手のプロフィールなど) のタスクは失敗し、スプールには残らない。
+直前情報は1つのトランザクションで書くので、スプールに書くテーブルの行も一緒に捨てられる。
+最後までスプールに書けるのは、3連単オッズ (crawl_trifecta_odds_page) と結果 (crawl_race_result_page) のページ。
+
+セグメントファイルには、4バイト (ビッグエンディアン) の長さと msgpack でエンコードした
+{"table", "update", "fill_if_null", "rows"} を1件ずつ追記し、追記するたびに fsync する。
+
+- 書き込み中のセグメントは <作成時刻 (ns)>-<pid>.part で、SPOOL_SEGMENT_BYTES (デフォルト 64MiB) を超えるか
+  SPOOL_SEGMENT_SECONDS 秒 (デフォルト 60) 経つと <作成時刻>-<pid>.msgpack に名前を変えて閉じる
+- 書き込み中のセグメントはライターが flock で排他ロックしておく。反映するのは閉じたセグメントと、
+  ロックが取れる (書き込んでいたプロセスがもう存在しない) .part のセグメント。
+  PID を見ないので、コンテナーなど PID 名前空間が違うプロセスとスプールを共有しても判定を誤らない
+- 途中で書き込みが途切れた最後の1件は読み飛ばす
+- 同じキーの行は後から追記した値で1行にまとめ (fill_if_null の列は最初の NULL でない値を残す)、セグメントごとに1つのトランザクションで反映する。
+  反映したセグメントは削除する。反映してから削除するまでの間に止まってもう一度反映しても、upsert なので結果は変わらない
+- DB に接続できない場合は、どのセグメントも反映できないので、そのセグメントとそれより新しいセグメントを残したまま止める。
+  それ以外の理由 (制約違反など) で SPOOL_MAX_REPLAY_FAILURES 回 (デフォルト 3) 続けて反映できなかったセグメントは
+  <作成時刻>-<pid>.failed に名前を変えて隔離し、それより新しいセグメントの反映を続ける。失敗した回数は <作成時刻>-<pid>.failures に書いておく
+"""
+
+import atexit
+import fcntl
+import logging
+import os
+import struct
+import threading
+import time
+from collections.abc import Iterator
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import msgpack
+from sqlalchemy import exc
+from sqlalchemy.ext.declarative import DeclarativeMeta
+
+from metaboatrace.orm.database import Base, Session
+from metaboatrace.orm.strategies.upsert import _get_primary_keys, create_upsert_strategy
+from metaboatrace.orm.unit_of_work import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPOOL_DIR = "spool"
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_SEGMENT_SECONDS = 60.0
+DEFAULT_MAX_REPLAY_FAILURES = 3
+
+_LENGTH = struct.Struct(">I")
+_OPEN_SUFFIX = ".part"
+_SEALED_SUFFIX = ".msgpack"
+_FAILED_SUFFIX = ".failed"
+_FAILURES_SUFFIX = ".failures"
+
+_EXT_DATETIME = 1
+_EXT_DATE = 2
+_EXT_DECIMAL = 3
+
+# note: (モデル, 更新する列, NULL のときだけ埋める列)
+SpoolKey = tuple[type[DeclarativeMeta], tuple[str, ...], tuple[str, ...]]
+
+
+def is_spool_enabled() -> bool:
+    return os.environ.get("SPOOL_ENABLED", "false").lower() == "true"
+
+
+def get_spool_dir() -> Path:
+    return Path(os.environ.get("SPOOL_DIR", DEFAULT_SPOOL_DIR))
+
+
+def _encode(value: Any) -> msgpack.ExtType:
+    if isinstance(value, datetime):
+        return msgpack.ExtType(_EXT_DATETIME, value.isoformat().encode())
+    if isinstance(value, date):
+        return msgpack.ExtType(_EXT_DATE, value.isoformat().encode())
+    if isinstance(value, Decimal):
+        return msgpack.ExtType(_EXT_DECIMAL, str(value).encode())
+    raise TypeError(f"Cannot spool a value of type {type(value).__name__}")
+
+
+def _decode(code: int, data: bytes) -> Any:
+    if code == _EXT_DATETIME:
+        return datetime.fromisoformat(data.decode())
+    if code == _EXT_DATE:
+        return date.fromisoformat(data.decode())
+    if code == _EXT_DECIMAL:
+        return Decimal(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+def merge_rows(
+    current: dict[str, Any], row: dict[str, Any], fill_if_null: tuple[str, ...]
+) -> dict[str, Any]:
+    """
+    同じキーの行を後から来た値で1行にまとめる。
+    fill_if_null の列は既存の行の値が NULL のときだけ埋めるので、まとめるときも最初の NULL でない値を残す
+    """
+    merged = {**current, **row}
+    for column in fill_if_null:
+        if current.get(column) is not None:
+            merged[column] = current[column]
+    return merged
+
+
+def encode_record(key: SpoolKey, values: list[dict[str, Any]]) -> bytes:
+    model, on_duplicate_key_update, fill_if_null = key
+    payload: bytes = msgpack.packb(
+        {
+            "table": model.__tablename__,  # type: ignore[attr-defined]
+            "update": list(on_duplicate_key_update),
+            "fill_if_null": list(fill_if_null),
+            "rows": values,
+        },
+        default=_encode,
+    )
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def read_segment(path: Path) -> Iterator[dict[str, Any]]:
+    with path.open("rb") as f:
+        while True:
+            header = f.read(_LENGTH.size)
+            if not header:
+                return
+            if len(header) == _LENGTH.size:
+                (length,) = _LENGTH.unpack(header)
+                payload = f.read(length)
+                if len(payload) == length:
+                    yield msgpack.unpackb(payload, ext_hook=_decode)
+                    continue
+            # note: 追記の途中でプロセスが止まった場合。fsync まで済んでいないので、呼び出し元には失敗として伝わっている
+            logger.warning("Skipped a truncated record at the end of %s", path)
+            return
+
+
+class SpoolWriter:
+    def __init__(self, directory: Path, segment_bytes: int, segment_seconds: float) -> None:
+        self._directory = directory
+        self._segment_bytes = segment_bytes
+        self._segment_seconds = segment_seconds
+        self._lock = threading.Lock()
+        self._file: BinaryIO | None = None
+        self._path: Path | None = None
+        self._opened_at = 0.0
+        self._closed = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="spool-sealer", daemon=True)
+        self._thread.start()
+
+    def append(self, key: SpoolKey, values: list[dict[str, Any]]) -> None:
+        record = encode_record(key, values)
+        with self._lock:
+            if self._file is None:
+                self._open()
+            assert self._file is not None
+            self._file.write(record)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            if self._file.tell() >= self._segment_bytes:
+                self._seal()
+
+    def close(self) -> None:
+        self._closed.set()
+        with self._lock:
+            self._seal()
+
+    def _open(self) -> None:
+        name = f"{time.time_ns()}-{os.getpid()}"
+        self._path = self._directory / f"{name}{_OPEN_SUFFIX}"
+        self._file = self._path.open("ab")
+        # note: プロセスが終了するとロックは外れるので、ロックが取れる .part は書き込んでいたプロセスが異常終了したもの
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._opened_at = time.monotonic()
+
+    def _seal(self) -> None:
+        if self._file is None or self._path is None:
+            return
+        # note: 名前を変えるまでロックを持っておき、閉じる途中の .part を反映する側に取られないようにする
+        self._path.rename(self._path.with_suffix(_SEALED_SUFFIX))
+        self._file.close()
+        self._file = None
+        self._path = None
+
+    def _run(self) -> None:
+        while not self._closed.wait(1.0):
+            with self._lock:
+                if (
+                    self._file is not None
+                    and time.monotonic() - self._opened_at >= self._segment_seconds
+                ):
+                    self._seal()
+
+
+_writer: SpoolWriter | None = None
+_writer_pid: int | None = None
+_writer_lock = threading.Lock()
+
+
+def get_spool_writer() -> SpoolWriter:
+    """プロセスごとに1つのライターを返す。プロセスごとに別のセグメントに書くので、書き込みどうしが重なることはない"""
+    global _writer, _writer_pid
+    pid = os.getpid()
+    if _writer is None or _writer_pid != pid:
+        with _writer_lock:
+            if _writer is None or _writer_pid != pid:
+                _writer = SpoolWriter(
+                    get_spool_dir(),
+                    int(os.environ.get("SPOOL_SEGMENT_BYTES", DEFAULT_SEGMENT_BYTES)),
+                    float(os.environ.get("SPOOL_SEGMENT_SECONDS", DEFAULT_SEGMENT_SECONDS)),
+                )
+                _writer.start()
+                _writer_pid = pid
+                atexit.register(_writer.close)
+    return _writer
+
+
+def close_spool_writer() -> None:
+    """このプロセスのセグメントを閉じて、反映できるようにする。ワーカーの終了時に呼ぶ"""
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        return
+    with _writer_lock:
+        writer, _writer, _writer_pid = _writer, None, None
+    atexit.unregister(writer.close)
+    writer.close()
+
+
+def _is_abandoned(path: Path) -> bool:
+    try:
+        with path.open("rb") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except FileNotFoundError:
+        # note: ロックを取ろうとする間に閉じられた。次に反映するときに .msgpack として見つかる
+        return False
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _replayable_segments(directory: Path) -> list[Path]:
+    segments = list(directory.glob(f"*{_SEALED_SUFFIX}"))
+    for path in directory.glob(f"*{_OPEN_SUFFIX}"):
+        # note: 書き込んでいたプロセスが異常終了すると、セグメントは .part のまま残る
+        if _is_abandoned(path):
+            segments.append(path)
+    return sorted(segments, key=lambda path: path.stem)
+
+
+def _models_by_table() -> dict[str, type[DeclarativeMeta]]:
+    return {mapper.class_.__tablename__: mapper.class_ for mapper in Base.registry.mappers}
+
+
+def replay_segment(path: Path) -> int:
+    """セグメントの行を1つのトランザクションで反映して削除し、反映した行数を返す"""
+    models = _models_by_table()
+    groups: dict[SpoolKey, dict[tuple[Any, ...], dict[str, Any]]] = {}
+    for record in read_segment(path):
+        model = models[record["table"]]
+        key = (model, tuple(record["update"]), tuple(record["fill_if_null"]))
+        group = groups.setdefault(key, {})
+        index_elements = _get_primary_keys(model)
+        for row in record["rows"]:
+            row_key = tuple(row[column] for column in index_elements)
+            group[row_key] = merge_rows(group.get(row_key, {}), row, key[2])
+
+    upsert_strategy = create_upsert_strategy(skip_unchanged=True)
+    try:
+        with unit_of_work() as session:
+            for (model, on_duplicate_key_update, fill_if_null), group in groups.items():
+                upsert_strategy(
+                    session,
+                    model,
+                    list(group.values()),
+                    list(on_duplicate_key_update),
+                    list(fill_if_null),
+                )
+    finally:
+        Session.remove()
+
+    path.unlink()
+    path.with_suffix(_FAILURES_SUFFIX).unlink(missing_ok=True)
+    return sum(len(group) for group in groups.values())
+
+
+def _quarantine_if_failed_too_often(path: Path, max_failures: int) -> bool:
+    """セグメントを反映できなかった回数を数え、max_failures 回に達したら隔離して True を返す"""
+    failures_path = path.with_suffix(_FAILURES_SUFFIX)
+    failures = int(failures_path.read_text()) + 1 if failures_path.exists() else 1
+    if failures < max_failures:
+        failures_path.write_text(str(failures))
+        return False
+    path.rename(path.with_suffix(_FAILED_SUFFIX))
+    failures_path.unlink(missing_ok=True)
+    return True
+
+
+def replay_spool(directory: Path | None = None) -> int:
+    """
+    反映できるセグメントを古い順にすべて反映し、反映した行数を返す。
+    DB に書き込めなかった場合は、そのセグメントとそれより新しいセグメントを残したまま例外を投げる。
+    ただし、SPOOL_MAX_REPLAY_FAILURES 回反映できなかったセグメントは隔離して、それより新しいセグメントの反映を続ける
+    """
+    max_failures = int(os.environ.get("SPOOL_MAX_REPLAY_FAILURES", DEFAULT_MAX_REPLAY_FAILURES))
+    rows = 0
+    for path in _replayable_segments(directory or get_spool_dir()):
+        try:
+            replayed = replay_segment(path)
+        except (exc.OperationalError, exc.InterfaceError):
+            # note: DB に接続できない間はどのセグメントも反映できないので、失敗した回数に数えない
+            raise
+        except Exception:
+            if not _quarantine_if_failed_too_often(path, max_failures):
+                raise
+            logger.exception(
+                "Quarantined %s that failed to replay %d times", path.name, max_failures
+            )
+            continue
+        logger.info("replayed %d rows from %s", replayed, path.name)
+        rows += replayed
+    return rows
@@ -11,6 +11,7 @@ from metaboatrace.orm.models.stadium import WeatherCondition as WeatherCondition
 from metaboatrace.orm.strategies.upsert import create_upsert_strategy
 
 from .base import Repository
+from .buffer import create_write_behind_upsert_strategy
 
 
 class EventRepository(Repository[EventEntity]):
@@ -44,36 +45,28 @@ class EventRepository(Repository[EventEntity]):
         )
 
 
-class MotorRenewalRepository(Repository[MotorRenewalOrm]):
+class MotorRenewalRepository(Repository[MotorRenewalEntity]):
     def create_or_update(self, entity: MotorRenewalEntity) -> bool:
-        session = Session()
         try:
-            existing_record = (
-                session.query(MotorRenewalOrm)
-                .filter_by(stadium_tel_code=entity.stadium_tel_code.value, date=entity.date)
-                .one_or_none()
-            )
-
-            if existing_record is None:
-                new_record = MotorRenewalOrm(
-                    stadium_tel_code=entity.stadium_tel_code.value, date=entity.date
-                )
-                session.add(new_record)
-            else:
-                pass
-
-            session.commit()
-            return True
+            return self.create_or_update_many([entity])
         except Exception:
-            session.rollback()
             return False
-        finally:
-            session.close()
 
     def create_or_update_many(
-        self, data: list[EventEntity], on_duplicate_key_update: list[str]
+        self, data: list[MotorRenewalEntity], on_duplicate_key_update: list[str] | None = None
     ) -> bool:
-        raise NotImplementedError
+        # note: 記録するのはモーターが更新された日だけなので、既にあれば何もしない
+        if on_duplicate_key_update is None:
+            on_duplicate_key_update = []
+        values = [
+            {"stadium_tel_code": entity.stadium_tel_code.value, "date": entity.date}
+            for entity in data
+        ]
+
+        upsert_strategy = create_upsert_strategy()
+        session = Session()
+
+        return upsert_strategy(session, MotorRenewalOrm, values, on_duplicate_key_update)
 
 
 def _transform_weather_condition_entity(
@@ -123,7 +116,7 @@ class WeatherConditionRepository(Repository[WeatherConditionEntity]):
             ]
         values = [_transform_weather_condition_entity(entity) for entity in data]
 
-        upsert_strategy = create_upsert_strategy()
+        upsert_strategy = create_write_behind_upsert_strategy(skip_unchanged=True)
         session = Session()
 
         return upsert_strategy(
@@ -0,0 +1,183 @@
+"""
+odds テーブルへの upsert の速度 (行/秒) を、1行ずつ文を発行する従来の方法と複数行をまとめる方法と COPY を経由する方法で比較するスクリプト
+DATABASE_URL のドライバーが psycopg (postgresql+psycopg://...) の場合は、パイプラインモードで書き込む方法も比較する
+あわせて、upsert 文をキャッシュする場合としない場合の、DB に送るまでの1回あたりの処理時間も比べる。
+--batch-sizes を指定すると、1回の upsert の行数ごとに複数行をまとめる方法と COPY を経由する方法を比べる
+(バックフィルでは1レース分のページごとに書き込むので、出走表なら6行、3連単オッズなら120行になる)
+
+DATABASE_URL の DB に実際に書き込むので、ローカルの開発用 DB に対して実行すること。
+書き込んだ行は最後に削除する。stadiums テーブルに初期データが入っている必要がある。
+"""
+
+import argparse
+import os
+import time
+import timeit
+from collections.abc import Callable
+from datetime import date, timedelta
+from typing import Any
+
+import sqlalchemy.dialects.postgresql as postgresql
+from sqlalchemy import delete
+from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from metaboatrace.orm.database import Session
+from metaboatrace.orm.models.race import Odds
+from metaboatrace.orm.strategies.bulk_load import postgresql_copy_upsert_strategy
+from metaboatrace.orm.strategies.pipeline import psycopg_pipeline_upsert_strategy
+from metaboatrace.orm.strategies.upsert import (
+    _get_primary_keys,
+    _get_upsert_statement,
+    _on_conflict,
+    _postgresql_upsert_strategy,
+)
+
+# 実データと被らない日付に書き込む
+BASE_DATE = date(1970, 1, 1)
+
+TRIFECTA_BETTING_NUMBERS = [
+    int(f"{a}{b}{c}")
+    for a in range(1, 7)
+    for b in range(1, 7)
+    for c in range(1, 7)
+    if len({a, b, c}) == 3
+]
+
+
+def _row_by_row_upsert_strategy(
+    session: SQLAlchemySession,
+    model: type[DeclarativeMeta],
+    values: list[dict[str, Any]],
+    on_duplicate_key_update: list[str],
+) -> bool:
+    """複数行をまとめる前の実装 (比較用)"""
+    index_elements = _get_primary_keys(model)
+    for value in values:
+        upsert_statement = postgresql.insert(model).values(value)
+        update_dict = {field: upsert_statement.excluded[field] for field in on_duplicate_key_update}
+        session.execute(
+            upsert_statement.on_conflict_do_update(index_elements=index_elements, set_=update_dict)
+        )
+    session.commit()
+    return True
+
+
+def _odds_values(
+    race_index: int, ratio: float, rows: int = len(TRIFECTA_BETTING_NUMBERS)
+) -> list[dict[str, Any]]:
+    return [
+        {
+            "stadium_tel_code": 1,
+            "date": BASE_DATE + timedelta(days=race_index // 12),
+            "race_number": race_index % 12 + 1,
+            "betting_method": 1,
+            "betting_number": betting_number,
+            "ratio": ratio,
+        }
+        for betting_number in TRIFECTA_BETTING_NUMBERS[:rows]
+    ]
+
+
+def _measure(
+    strategy: Callable[..., bool],
+    races: int,
+    rows: int = len(TRIFECTA_BETTING_NUMBERS),
+) -> float:
+    session = Session()
+    started_at = time.perf_counter()
+    # 1回目は INSERT、2回目は UPDATE になる
+    for ratio in (1.0, 2.0):
+        for race_index in range(races):
+            strategy(session, Odds, _odds_values(race_index, ratio, rows), ["ratio"])
+    elapsed = time.perf_counter() - started_at
+
+    session.execute(delete(Odds).where(Odds.date < BASE_DATE + timedelta(days=races // 12 + 1)))
+    session.commit()
+    session.close()
+
+    return races * rows * 2 / elapsed
+
+
+def _measure_statement_cache(iterations: int = 50) -> tuple[float, float]:
+    """
+    1レース分の3連単オッズを書き込むときの、文を組み立てる処理時間 (秒/回) を比べる。
+    SQLAlchemy は実行のたびに文のキャッシュキーを計算するので、それも含める
+    """
+    rows = _odds_values(0, 1.0)
+    index_elements = _get_primary_keys(Odds)
+
+    def build_every_call() -> None:
+        for _ in range(iterations):
+            statement = _on_conflict(
+                postgresql.insert(Odds).values(rows),
+                Odds.__table__,
+                index_elements,
+                ["ratio"],
+                True,
+            )
+            statement._generate_cache_key()  # type: ignore[attr-defined]
+
+    def use_cached_statement() -> None:
+        for _ in range(iterations):
+            statement = _get_upsert_statement(Odds, ["ratio"], [], "postgresql", True)
+            statement._generate_cache_key()  # type: ignore[attr-defined]
+
+    uncached = min(timeit.repeat(build_every_call, number=1, repeat=3)) / iterations
+    cached = min(timeit.repeat(use_cached_statement, number=1, repeat=3)) / iterations
+    return uncached, cached
+
+
+def _restore_env(name: str, value: str | None) -> None:
+    if value is None:
+        os.environ.pop(name, None)
+    else:
+        os.environ[name] = value
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--races", type=int, default=120, help="書き込むレースの数")
+    parser.add_argument(
+        "--batch-sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=None,
+        help="1回の upsert の行数 (カンマ区切り、最大 120)。指定すると行数ごとに複数行と COPY を比べる",
+    )
+    args = parser.parse_args()
+
+    if args.batch_sizes is not None:
+        min_rows = os.environ.get("BULK_LOAD_MIN_ROWS")
+        for rows in args.batch_sizes:
+            multi_row = _measure(_postgresql_upsert_strategy, args.races, rows)
+            # note: 行数によらず COPY を使う場合と、BULK_LOAD_MIN_ROWS に満たなければ複数行の INSERT にする場合
+            os.environ["BULK_LOAD_MIN_ROWS"] = "0"
+            copy = _measure(postgresql_copy_upsert_strategy, args.races, rows)
+            _restore_env("BULK_LOAD_MIN_ROWS", min_rows)
+            bulk_load = _measure(postgresql_copy_upsert_strategy, args.races, rows)
+            print(
+                f"{rows:>3} rows: multi row {multi_row:,.0f} rows/s, "
+                f"copy {copy:,.0f} rows/s ({copy / multi_row:.2f}x), "
+                f"--bulk-load {bulk_load:,.0f} rows/s ({bulk_load / multi_row:.2f}x)"
+            )
+        return
+
+    uncached, cached = _measure_statement_cache()
+    print(f"statement : uncached {uncached * 1e6:,.0f}us, cached {cached * 1e6:,.1f}us per call")
+
+    row_by_row = _measure(_row_by_row_upsert_strategy, args.races)
+    print(f"row by row: {row_by_row:,.0f} rows/s")
+
+    multi_row = _measure(_postgresql_upsert_strategy, args.races)
+    print(f"multi row : {multi_row:,.0f} rows/s ({multi_row / row_by_row:.1f}x)")
+
+    copy = _measure(postgresql_copy_upsert_strategy, args.races)
+    print(f"copy      : {copy:,.0f} rows/s ({copy / row_by_row:.1f}x)")
+
+    if Session().get_bind().dialect.driver == "psycopg":
+        pipeline = _measure(psycopg_pipeline_upsert_strategy, args.races)
+        print(f"pipeline  : {pipeline:,.0f} rows/s ({pipeline / row_by_row:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
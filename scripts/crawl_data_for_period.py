@@ -1,6 +1,7 @@
 import argparse
+import logging
+import os
 from datetime import date, datetime, timedelta
-from time import sleep
 from zoneinfo import ZoneInfo
 
 from tqdm import tqdm
@@ -22,6 +23,8 @@ from metaboatrace.models.stadium import EventHoldingStatus
 from metaboatrace.repositories import RaceRepository
 from metaboatrace.scrapers.official.website.exceptions import DataNotFound, RaceCanceled
 
+logger = logging.getLogger(__name__)
+
 
 def _valid_end_date(s: str) -> date:
     try:
@@ -43,15 +46,30 @@ def _parse_args() -> argparse.Namespace:
         help="開始日 (YYYY-MM-DD 形式)",
     )
     parser.add_argument("end_date", type=_valid_end_date, help="終了日 (YYYY-MM-DD 形式)")
-    parser.add_argument("--sleep", type=int, default=1, help="クロール間のスリープ時間 (秒)")
+    parser.add_argument(
+        "--bulk-load",
+        action="store_true",
+        help="COPY で一時テーブルに流し込んでからまとめて反映する (PostgreSQL のみ)",
+    )
+    parser.add_argument(
+        "--sleep",
+        type=int,
+        default=None,
+        help="非推奨。何もしない (リクエストの間隔は CRAWLER_HOST_RATE_LIMITS で指定する)",
+    )
     return parser.parse_args()
 
 
 def _main() -> None:
     args = _parse_args()
+    if args.sleep is not None:
+        logger.warning(
+            "--sleep is deprecated and ignored; requests are rate-limited by CRAWLER_HOST_RATE_LIMITS"
+        )
+    if args.bulk_load:
+        os.environ["UPSERT_MODE"] = "copy"
     start_date = args.start_date
     end_date = args.end_date
-    sleep_second = args.sleep
 
     start_message = f"🚀 Starting data crawl from {start_date} to {end_date}"
     send_slack_notification(start_message)
@@ -66,7 +84,6 @@ def _main() -> None:
             if current_date.day == 1:
                 crawl_events_from_monthly_schedule_page(current_date.year, current_date.month)
                 print("\tProcessing monthly schedule page.")
-                sleep(sleep_second)
 
             event_holdings = crawl_event_holding_page(current_date)
             will_be_opned_event_holdings = [
@@ -80,7 +97,6 @@ def _main() -> None:
                             e.stadium_tel_code.value, current_date
                         )
                         print("\t\tProcessing pre inspection information page.")
-                        sleep(sleep_second)
                     except DataNotFound:
                         print(
                             "\t\t\t\033[93m[warn] The pre inspection information page had not found.\033[0m"
@@ -105,8 +121,6 @@ def _main() -> None:
                                 )
                             except RaceDeadlineChanged:
                                 pass
-
-                            sleep(sleep_second)
                     except RaceCanceled:
                         repository = RaceRepository()
                         repository.cancel(e.stadium_tel_code.value, current_date, race_number)
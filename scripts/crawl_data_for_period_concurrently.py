@@ -0,0 +1,105 @@
+"""
+crawl_data_for_period.py の並行版
+
+ページの取得を公式サイトへのリクエスト予算の範囲内で並行に行い、待ち時間を解析や DB への書き込みに回す。
+逐次に処理したい場合は従来通り crawl_data_for_period.py を使う。
+"""
+
+import argparse
+import logging
+import os
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+from metaboatrace.crawlers.official.website.v1707.backfill import PeriodCrawler
+from metaboatrace.crawlers.utils import send_slack_notification
+
+
+def _valid_end_date(s: str) -> date:
+    try:
+        end_date = datetime.strptime(s, "%Y-%m-%d").date()
+        if end_date >= datetime.now(tz=ZoneInfo("Asia/Tokyo")).date():
+            raise argparse.ArgumentTypeError("end_date は本日以前の日付である必要があります。")
+        return end_date
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(
+            "不正な日付形式です。YYYY-MM-DD 形式で入力してください。"
+        ) from e
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="クロールする期間を指定してデータを並行に取得します。"
+    )
+    parser.add_argument(
+        "start_date",
+        type=lambda s: datetime.strptime(s, "%Y-%m-%d").date(),
+        help="開始日 (YYYY-MM-DD 形式)",
+    )
+    parser.add_argument("end_date", type=_valid_end_date, help="終了日 (YYYY-MM-DD 形式)")
+    parser.add_argument(
+        "--rate", type=float, default=1.0, help="公式サイトへの1秒あたりのリクエスト数の上限"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="同時に発行するリクエスト数の上限"
+    )
+    parser.add_argument("--dates-in-flight", type=int, default=2, help="同時に処理する開催日の数")
+    parser.add_argument("--db-workers", type=int, default=4, help="DB に書き込むスレッドの数")
+    parser.add_argument(
+        "--bulk-load",
+        action="store_true",
+        help="COPY で一時テーブルに流し込んでからまとめて反映する (PostgreSQL のみ)",
+    )
+    parser.add_argument(
+        "--async-db",
+        action="store_true",
+        help="DB への書き込みをスレッドプールではなく asyncpg で行う (PostgreSQL のみ)",
+    )
+    return parser.parse_args()
+
+
+def _main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = _parse_args()
+    if args.bulk_load:
+        os.environ["UPSERT_MODE"] = "copy"
+    if args.async_db:
+        os.environ["REPOSITORY_BACKEND"] = "async"
+    start_date = args.start_date
+    end_date = args.end_date
+
+    start_message = f"🚀 Starting concurrent data crawl from {start_date} to {end_date}"
+    send_slack_notification(start_message)
+
+    crawler = PeriodCrawler(
+        requests_per_second=args.rate,
+        max_concurrency=args.concurrency,
+        max_dates_in_flight=args.dates_in_flight,
+        db_workers=args.db_workers,
+    )
+    try:
+        report = crawler.run(start_date, end_date)
+    except Exception as e:
+        error_message = (
+            f"❌ Error during concurrent data crawl from {start_date} to {end_date}: {e!s}"
+        )
+        send_slack_notification(error_message)
+        raise
+
+    summary = (
+        f"{report.crawled_races} races crawled, {report.canceled_races} canceled, "
+        f"{len(report.failures)} failed"
+    )
+    if report.failures:
+        failures = "\n".join(report.failures)
+        send_slack_notification(
+            f"⚠️ Completed concurrent data crawl from {start_date} to {end_date} with errors ({summary})\n{failures}"
+        )
+    else:
+        send_slack_notification(
+            f"✅ Successfully completed concurrent data crawl from {start_date} to {end_date} ({summary})"
+        )
+
+
+if __name__ == "__main__":
+    _main()
@@ -1,9 +1,7 @@
-import time
-
 from tqdm import tqdm
 
 from metaboatrace.crawlers.official.website.v1707.racer import crawl_racer_from_racer_profile_page
-from metaboatrace.orm.database import Session
+from metaboatrace.orm.database import ReadSession, Session
 from metaboatrace.orm.models.racer import Racer
 from metaboatrace.repositories.racer import RacerRepository
 from metaboatrace.scrapers.official.website.exceptions import DataNotFound
@@ -12,32 +10,34 @@ from metaboatrace.scrapers.official.website.exceptions import DataNotFound
 def update_racers() -> None:
     repository = RacerRepository()
     try:
-        all_racers = Session()
+        all_racers = ReadSession()
         racers = all_racers.query(Racer).filter(Racer.status.is_(None)).all()
         all_racers.close()
 
-        for racer in tqdm(racers, desc="Updating racers"):
-            session = Session()
-            try:
-                crawl_racer_from_racer_profile_page(int(racer.registration_number))
-                if racer.registration_number % 3 == 0:
-                    time.sleep(1)
-                session.commit()
-                print(
-                    f"\033[92m[success] Successfully processed racer {racer.registration_number}.\033[0m"
-                )
-            except DataNotFound:
-                repository.make_retired(racer.registration_number)
-                print(
-                    f"\033[90m[info] Racer {racer.registration_number} retired due to DataNotFound.\033[0m"
-                )
-            except Exception as e:
-                print(
-                    f"\033[91m[error] Error processing racer {racer.registration_number}: {e}\033[0m"
-                )
-                session.rollback()
-            finally:
-                session.close()
+        retired_registration_numbers = []
+        try:
+            for racer in tqdm(racers, desc="Updating racers"):
+                session = Session()
+                try:
+                    crawl_racer_from_racer_profile_page(int(racer.registration_number))
+                    session.commit()
+                    print(
+                        f"\033[92m[success] Successfully processed racer {racer.registration_number}.\033[0m"
+                    )
+                except DataNotFound:
+                    retired_registration_numbers.append(int(racer.registration_number))
+                    print(
+                        f"\033[90m[info] Racer {racer.registration_number} retired due to DataNotFound.\033[0m"
+                    )
+                except Exception as e:
+                    print(
+                        f"\033[91m[error] Error processing racer {racer.registration_number}: {e}\033[0m"
+                    )
+                    session.rollback()
+                finally:
+                    session.close()
+        finally:
+            repository.make_retired_many(retired_registration_numbers)
     except Exception as e:
         print(f"\033[91m[error] Error retrieving racers: {e}\033[0m")
 
@@ -2,20 +2,18 @@
 race_entriesテーブルに存在するがracersテーブルに存在しないレーサーの情報をクロールするスクリプト
 """
 
-import time
-
 from sqlalchemy import text
 from tqdm import tqdm
 
 from metaboatrace.crawlers.official.website.v1707.racer import crawl_racer_from_racer_profile_page
-from metaboatrace.orm.database import Session
+from metaboatrace.orm.database import ReadSession, Session, pin_to_primary
 from metaboatrace.repositories.racer import RacerRepository
 from metaboatrace.scrapers.official.website.exceptions import DataNotFound
 
 
 def find_missing_racers() -> list[int]:
     """race_entriesに存在するがracersテーブルに存在しないregistration_numberを取得"""
-    session = Session()
+    session = ReadSession()
     try:
         # race_entriesに存在するがracersに存在しないregistration_numberを取得
         query = text(
@@ -50,32 +48,34 @@ def crawl_missing_racers() -> None:
     print(f"Found {len(missing_registration_numbers)} missing racers.")
 
     # 各レーサーの情報をクロール
-    for registration_number in tqdm(missing_registration_numbers, desc="Crawling missing racers"):
-        session = Session()
-        try:
-            # レーサー情報をクロール
-            crawl_racer_from_racer_profile_page(registration_number)
-
-            # 負荷軽減のためのスリープ
-            if registration_number % 2 == 0:
-                time.sleep(1)
-
-            session.commit()
-            print(f"\033[92m[success] Successfully crawled racer {registration_number}.\033[0m")
-        except DataNotFound:
-            # プロフィールページが見つからない場合は引退扱い
-            repository.make_retired(registration_number)
-            print(
-                f"\033[90m[info] Racer {registration_number} marked as retired (DataNotFound).\033[0m"
-            )
-        except Exception as e:
-            print(f"\033[91m[error] Error crawling racer {registration_number}: {e}\033[0m")
-            session.rollback()
-        finally:
-            session.close()
-
-    # 最終確認
-    remaining_missing = find_missing_racers()
+    retired_registration_numbers = []
+    try:
+        for registration_number in tqdm(missing_registration_numbers, desc="Crawling missing racers"):
+            session = Session()
+            try:
+                # レーサー情報をクロール
+                crawl_racer_from_racer_profile_page(registration_number)
+
+                session.commit()
+                print(f"\033[92m[success] Successfully crawled racer {registration_number}.\033[0m")
+            except DataNotFound:
+                # プロフィールページが見つからない場合は引退扱いにし、最後にまとめて更新する
+                retired_registration_numbers.append(registration_number)
+                print(
+                    f"\033[90m[info] Racer {registration_number} marked as retired (DataNotFound).\033[0m"
+                )
+            except Exception as e:
+                print(f"\033[91m[error] Error crawling racer {registration_number}: {e}\033[0m")
+                session.rollback()
+            finally:
+                session.close()
+    finally:
+        # 中断されても、それまでに分かった引退は書き込んでおく
+        repository.make_retired_many(retired_registration_numbers)
+
+    # 最終確認 (登録したばかりのレーサーを読むので、レプリカの遅れの影響を受けないようにプライマリで確認する)
+    with pin_to_primary():
+        remaining_missing = find_missing_racers()
     if remaining_missing:
         print(
             f"\033[93m[warning] Still {len(remaining_missing)} racers missing after crawling.\033[0m"
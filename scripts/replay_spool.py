@@ -0,0 +1,61 @@
+"""
+スプール (SPOOL_ENABLED=true) に書いた行を DB に反映するスクリプト
+
+--watch を指定すると、DB が使えるようになるのを待ちながら指定した秒数ごとに反映を繰り返す。
+"""
+
+import argparse
+import logging
+import time
+from pathlib import Path
+
+from sqlalchemy import text
+
+from metaboatrace.orm.database import Session
+from metaboatrace.repositories.spool import get_spool_dir, replay_spool
+
+logger = logging.getLogger(__name__)
+
+
+def _is_database_healthy() -> bool:
+    session = Session()
+    try:
+        session.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        logger.warning(f"Database is unavailable: {e}")
+        return False
+    finally:
+        Session.remove()
+
+
+def _replay(directory: Path) -> None:
+    if not _is_database_healthy():
+        return
+    try:
+        rows = replay_spool(directory)
+    except Exception as e:
+        logger.error(f"Failed to replay the spool: {e}")
+        return
+    if rows:
+        logger.info(f"Replayed {rows} rows from {directory}")
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--dir", type=Path, default=None, help="スプールのディレクトリ (デフォルトは SPOOL_DIR)"
+    )
+    parser.add_argument("--watch", type=float, default=None, help="反映を繰り返す間隔 (秒)")
+    args = parser.parse_args()
+    directory = args.dir or get_spool_dir()
+
+    _replay(directory)
+    while args.watch is not None:
+        time.sleep(args.watch)
+        _replay(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from itertools import pairwise
+from typing import Any
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from metaboatrace.crawlers.official.website.v1707.backfill import (
+    BackfillReport,
+    PeriodCrawler,
+    PolitenessBudget,
+)
+from metaboatrace.models.stadium import EventHolding, EventHoldingStatus, StadiumTelCode
+from metaboatrace.scrapers.official.website.exceptions import RaceCanceled
+
+MODULE = "metaboatrace.crawlers.official.website.v1707.backfill"
+RACE_DATE = date(2023, 11, 16)
+
+
+def test_politeness_budget_limits_rate_and_concurrency() -> None:
+    started_at: list[float] = []
+    in_flight = 0
+    max_in_flight = 0
+
+    async def request(budget: PolitenessBudget) -> None:
+        nonlocal in_flight, max_in_flight
+        async with budget:
+            started_at.append(time.monotonic())
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.05)
+            in_flight -= 1
+
+    async def run() -> None:
+        budget = PolitenessBudget(requests_per_second=50, max_concurrency=2)
+        await asyncio.gather(*(request(budget) for _ in range(6)))
+
+    asyncio.run(run())
+
+    assert max_in_flight == 2
+    intervals = [b - a for a, b in pairwise(started_at)]
+    assert min(intervals) >= 0.02 - 0.005
+
+
+def test_races_after_a_canceled_race_are_not_crawled() -> None:
+    crawled: list[int] = []
+
+    async def crawl_race(stadium_tel_code: int, date: date, race_number: int) -> None:
+        crawled.append(race_number)
+        if race_number == 3:
+            raise RaceCanceled
+
+    async def crawl() -> BackfillReport:
+        crawler = PeriodCrawler()
+        crawler._report = BackfillReport()
+        with (
+            ThreadPoolExecutor(1, thread_name_prefix="save") as savers,
+            patch.object(crawler, "_prefetch", AsyncMock()),
+            patch.object(crawler, "_crawl_race", crawl_race),
+        ):
+            crawler._savers = savers
+            await crawler._crawl_event_holding(
+                RACE_DATE,
+                EventHolding(
+                    stadium_tel_code=StadiumTelCode.KIRYU,
+                    date=RACE_DATE,
+                    status=EventHoldingStatus.OPEN,
+                    progress_day=2,
+                ),
+            )
+        return crawler._report
+
+    with patch(f"{MODULE}.RaceRepository") as race_repository:
+        report = asyncio.run(crawl())
+
+    assert crawled == [1, 2, 3]
+    assert report == BackfillReport(crawled_races=2, canceled_races=1)
+    race_repository.return_value.cancel.assert_called_once_with(1, RACE_DATE, 3)
+
+
+def test_async_repository_only_runs_the_writes_on_the_event_loop(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("REPOSITORY_BACKEND", "async")
+    scraped_on: list[str] = []
+    saved: list[str] = []
+
+    def scrape(name: str) -> Callable[..., Mock]:
+        def _scrape(*args: Any) -> Mock:
+            scraped_on.append(threading.current_thread().name)
+            return Mock(name=name, start_exhibition_records=[1], weather_condition_error=None)
+
+        return _scrape
+
+    async def run_with_async_session(func: Callable[..., Any], *args: Any) -> None:
+        saved.append(func.__name__)
+
+    async def crawl() -> None:
+        crawler = PeriodCrawler(db_workers=1)
+        with ThreadPoolExecutor(1, thread_name_prefix="save") as savers:
+            crawler._savers = savers
+            await crawler._crawl_race(1, RACE_DATE, 1)
+
+    with (
+        patch(f"{MODULE}.scrape_race_information_page", scrape("information")),
+        patch(f"{MODULE}.scrape_race_before_information_page", scrape("before")),
+        patch(f"{MODULE}.scrape_race_result_page", scrape("result")),
+        patch(f"{MODULE}.scrape_trifecta_odds_page", scrape("odds")),
+        patch(f"{MODULE}.run_with_async_session", run_with_async_session),
+    ):
+        asyncio.run(crawl())
+
+    assert len(scraped_on) == 4
+    assert all(name.startswith("save") for name in scraped_on)
+    assert saved == [
+        "save_race_information_page",
+        "save_race_before_information_page",
+        "save_race_result_page",
+        "save_trifecta_odds_page",
+    ]
@@ -0,0 +1,169 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import date
+from unittest.mock import MagicMock, Mock, patch
+
+import pytest
+
+from metaboatrace.crawlers.exceptions import IncompleteDataError
+from metaboatrace.crawlers.official.website.v1707.race import (
+    crawl_race_before_information_page,
+    crawl_race_information_page,
+    crawl_race_result_page,
+)
+from metaboatrace.scrapers.official.website.exceptions import RaceCanceled
+
+MODULE = "metaboatrace.crawlers.official.website.v1707.race"
+RACE_DATE = date(2024, 5, 1)
+
+
+class UnitOfWork:
+    """リポジトリへの書き込みがトランザクションの中で行われたかを記録する"""
+
+    def __init__(self) -> None:
+        self.transactions = 0
+        self.active = False
+        self.writes_outside: list[str] = []
+
+    @contextmanager
+    def __call__(self) -> Iterator[None]:
+        self.transactions += 1
+        self.active = True
+        try:
+            yield
+        finally:
+            self.active = False
+
+    def repository(self, name: str) -> MagicMock:
+        def write(*args: object) -> bool:
+            if not self.active:
+                self.writes_outside.append(name)
+            return True
+
+        repository = MagicMock(name=name)
+        repository.return_value.create_or_update.side_effect = write
+        repository.return_value.create_or_update_many.side_effect = write
+        return repository
+
+
+@pytest.fixture
+def unit_of_work() -> Iterator[UnitOfWork]:
+    recording = UnitOfWork()
+    with (
+        patch(f"{MODULE}.is_race_canceled", return_value=False),
+        patch(f"{MODULE}.unit_of_work", recording),
+    ):
+        yield recording
+
+
+def test_result_page_is_fetched_once_and_written_in_one_transaction(
+    unit_of_work: UnitOfWork,
+) -> None:
+    winner = Mock(winning_trick=1, disqualification=None)
+    disqualified = Mock(winning_trick=None, disqualification=1)
+    repositories = {
+        name: unit_of_work.repository(name)
+        for name in [
+            "PayoffRepository",
+            "WeatherConditionRepository",
+            "RaceRecordRepository",
+            "WinningRaceEntryRepository",
+            "DisqualifiedRaceEntryRepository",
+        ]
+    }
+    with (
+        patch(f"{MODULE}.fetch_html_as_io") as fetch_html_as_io,
+        patch(f"{MODULE}.extract_race_payoffs", return_value=[Mock()]),
+        patch(f"{MODULE}.extract_weather_condition_in_performance", return_value=Mock()),
+        patch(f"{MODULE}.extract_race_records", return_value=[winner, disqualified]),
+        patch.multiple(MODULE, **repositories),
+    ):
+        crawl_race_result_page(1, RACE_DATE, 1)
+
+    fetch_html_as_io.assert_called_once()
+    assert unit_of_work.transactions == 1
+    assert unit_of_work.writes_outside == []
+    winning = repositories["WinningRaceEntryRepository"].return_value
+    winning.create_or_update_many.assert_called_once_with([winner])
+    disqualified_entries = repositories["DisqualifiedRaceEntryRepository"].return_value
+    disqualified_entries.create_or_update_many.assert_called_once_with([disqualified])
+
+
+BEFORE_INFORMATION_REPOSITORIES = [
+    "StartExhibitionRecordRepository",
+    "CircumferenceExhibitionRecordRepository",
+    "RacerConditionRepository",
+    "BoatSettingRepository",
+    "MotorMaintenanceRepository",
+    "WeatherConditionRepository",
+]
+
+
+def test_race_information_page_is_written_in_one_transaction(unit_of_work: UnitOfWork) -> None:
+    repositories = {
+        name: unit_of_work.repository(name)
+        for name in [
+            "RaceRepository",
+            "RaceEntryRepository",
+            "BoatSettingRepository",
+            "BoatBettingContributeRateAggregationRepository",
+            "MotorBettingContributeRateAggregationRepository",
+            "RacerWinningRateAggregationRepository",
+        ]
+    }
+    with (
+        patch(f"{MODULE}.fetch_html_as_io"),
+        patch(f"{MODULE}.extract_race_information"),
+        patch(f"{MODULE}.extract_race_entries", return_value=[]),
+        patch(f"{MODULE}.extract_boat_performances", return_value=[]),
+        patch(f"{MODULE}.extract_motor_performances", return_value=[]),
+        patch(f"{MODULE}.extract_racer_performances", return_value=[]),
+        patch(f"{MODULE}.is_deadline_changed", return_value=False),
+        patch.multiple(MODULE, **repositories),
+    ):
+        crawl_race_information_page(1, RACE_DATE, 1)
+
+    assert unit_of_work.transactions == 1
+    assert unit_of_work.writes_outside == []
+    assert all(repository.return_value.method_calls for repository in repositories.values())
+
+
+def test_start_exhibition_is_kept_when_the_race_is_canceled_before_the_circumference(
+    unit_of_work: UnitOfWork,
+) -> None:
+    repositories = {name: unit_of_work.repository(name) for name in BEFORE_INFORMATION_REPOSITORIES}
+    start_exhibition_records = [Mock()]
+    with (
+        patch(f"{MODULE}.fetch_html_as_io"),
+        patch(f"{MODULE}.extract_start_exhibition_records", return_value=start_exhibition_records),
+        patch(f"{MODULE}.extract_circumference_exhibition_records", return_value=[]),
+        patch.multiple(MODULE, **repositories),
+        pytest.raises(RaceCanceled),
+    ):
+        crawl_race_before_information_page(1, RACE_DATE, 1)
+
+    start_exhibition = repositories["StartExhibitionRecordRepository"].return_value
+    start_exhibition.create_or_update_many.assert_called_once_with(start_exhibition_records)
+    assert not repositories["CircumferenceExhibitionRecordRepository"].return_value.method_calls
+
+
+def test_missing_weather_is_reported_after_the_other_rows_are_written(
+    unit_of_work: UnitOfWork,
+) -> None:
+    repositories = {name: unit_of_work.repository(name) for name in BEFORE_INFORMATION_REPOSITORIES}
+    with (
+        patch(f"{MODULE}.fetch_html_as_io"),
+        patch(f"{MODULE}.extract_start_exhibition_records", return_value=[Mock()]),
+        patch(f"{MODULE}.extract_circumference_exhibition_records", return_value=[Mock()]),
+        patch(f"{MODULE}.extract_racer_conditions", return_value=[Mock()]),
+        patch(f"{MODULE}.extract_boat_settings", return_value=[]),
+        patch(f"{MODULE}.extract_weather_condition", side_effect=ValueError),
+        patch.multiple(MODULE, **repositories),
+        pytest.raises(IncompleteDataError),
+    ):
+        crawl_race_before_information_page(1, RACE_DATE, 1)
+
+    assert unit_of_work.transactions == 1
+    assert unit_of_work.writes_outside == []
+    assert repositories["RacerConditionRepository"].return_value.create_or_update_many.called
+    assert not repositories["WeatherConditionRepository"].return_value.method_calls
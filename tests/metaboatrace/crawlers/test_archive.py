@@ -0,0 +1,31 @@
+from pathlib import Path
+
+import pytest
+
+from metaboatrace.crawlers.archive import ArchiveMode, HtmlArchive
+from metaboatrace.crawlers.exceptions import ArchivedPageNotFound
+
+RESULT_URL = "https://boatrace.jp/owpc/pc/race/raceresult?rno=3&jcd=01&hd=20231124"
+
+
+def test_store_and_load(tmp_path: Path) -> None:
+    archive = HtmlArchive(tmp_path)
+    digest = archive.store(RESULT_URL, "<html>結果</html>")
+
+    assert (tmp_path / "refs" / "raceresult" / "202311240103").read_text() == digest
+    assert archive.load(RESULT_URL) == "<html>結果</html>"
+
+
+def test_same_content_is_stored_once(tmp_path: Path) -> None:
+    archive = HtmlArchive(tmp_path)
+    archive.store(RESULT_URL, "<html>結果</html>")
+    archive.store(RESULT_URL.replace("rno=3", "rno=4"), "<html>結果</html>")
+
+    assert len(list((tmp_path / "objects").glob("*/*.html.gz"))) == 1
+
+
+def test_load_missing_page(tmp_path: Path) -> None:
+    archive = HtmlArchive(tmp_path, ArchiveMode.REPLAY)
+
+    with pytest.raises(ArchivedPageNotFound):
+        archive.load(RESULT_URL)
@@ -0,0 +1,94 @@
+import zlib
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import fakeredis
+import pytest
+import redis
+import requests
+
+from metaboatrace.crawlers import utils
+from metaboatrace.crawlers.cache import (
+    FINALIZED_PAGE_TTL,
+    PAGE_TYPE_TTLS,
+    InProcessHtmlCache,
+    RedisHtmlCache,
+    TieredHtmlCache,
+    jst,
+    ttl_for,
+)
+from metaboatrace.crawlers.pages import PageType
+
+TODAY = datetime.now(jst).date()
+TODAY_STR = TODAY.strftime("%Y%m%d")
+ODDS_URL = f"https://boatrace.jp/owpc/pc/race/odds3t?rno=1&jcd=01&hd={TODAY_STR}"
+RESULT_URL = f"https://boatrace.jp/owpc/pc/race/raceresult?rno=1&jcd=01&hd={TODAY_STR}"
+
+
+@pytest.fixture
+def redis_client() -> fakeredis.FakeRedis:
+    return fakeredis.FakeRedis()
+
+
+def test_ttl_for() -> None:
+    assert ttl_for(ODDS_URL) == PAGE_TYPE_TTLS[PageType.TRIFECTA_ODDS]
+    assert ttl_for(RESULT_URL) == PAGE_TYPE_TTLS[PageType.RACE_RESULT]
+    assert ttl_for(ODDS_URL) < ttl_for(RESULT_URL)
+    assert (
+        ttl_for("https://boatrace.jp/owpc/pc/race/odds3t?rno=1&jcd=01&hd=20231124")
+        == FINALIZED_PAGE_TTL
+    )
+
+
+def test_redis_tier_stores_compressed_html_with_ttl(redis_client: fakeredis.FakeRedis) -> None:
+    tier = RedisHtmlCache(redis_client)
+    tier.set(ODDS_URL, "<html>オッズ</html>", 60)
+
+    stored: bytes = redis_client.get(RedisHtmlCache.KEY_PREFIX + ODDS_URL)  # type: ignore[assignment]
+    assert zlib.decompress(stored).decode("utf-8") == "<html>オッズ</html>"
+    ttl: int = redis_client.ttl(RedisHtmlCache.KEY_PREFIX + ODDS_URL)  # type: ignore[assignment]
+    assert 0 < ttl <= 60
+
+    html, remaining_ttl = tier.get(ODDS_URL)  # type: ignore[misc]
+    assert html == "<html>オッズ</html>"
+    assert 0 < remaining_ttl <= 60
+
+
+def test_lower_tier_hit_fills_upper_tier(redis_client: fakeredis.FakeRedis) -> None:
+    l1 = InProcessHtmlCache()
+    l2 = RedisHtmlCache(redis_client)
+    l2.set(RESULT_URL, "<html>結果</html>", 600)
+
+    cache = TieredHtmlCache([l1, l2])
+    assert cache.get(RESULT_URL) == "<html>結果</html>"
+    assert l1.get(RESULT_URL) is not None
+
+
+def test_unavailable_redis_is_skipped() -> None:
+    client = MagicMock()
+    client.pipeline.side_effect = redis.ConnectionError("down")
+    tier = RedisHtmlCache(client)
+
+    assert tier.get(ODDS_URL) is None
+    tier.set(ODDS_URL, "<html></html>", 60)
+    client.set.assert_not_called()
+
+
+def test_fetch_errors_are_not_cached(redis_client: fakeredis.FakeRedis) -> None:
+    url = f"https://boatrace.jp/owpc/pc/race/racelist?rno=1&jcd=01&hd={TODAY_STR}"
+    response = MagicMock(text="<html>出走表</html>")
+    session = MagicMock()
+    session.get.side_effect = [requests.exceptions.Timeout(), response]
+
+    cache = TieredHtmlCache([InProcessHtmlCache(), RedisHtmlCache(redis_client)])
+    with (
+        patch.object(utils, "html_cache", cache),
+        patch.object(utils, "get_http_session", return_value=session),
+    ):
+        with pytest.raises(requests.exceptions.Timeout):
+            utils.fetch_html_as_io(url)
+        assert redis_client.get(RedisHtmlCache.KEY_PREFIX + url) is None
+
+        assert utils.fetch_html_as_io(url).read() == "<html>出走表</html>"
+        assert utils.fetch_html_as_io(url).read() == "<html>出走表</html>"
+        assert session.get.call_count == 2
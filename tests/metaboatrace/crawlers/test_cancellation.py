@@ -0,0 +1,75 @@
+from collections.abc import Iterator
+from datetime import UTC, date, datetime
+from unittest.mock import MagicMock, patch
+
+import fakeredis
+import pytest
+import redis
+
+from metaboatrace.crawlers import cancellation, dispatcher, scheduler
+from metaboatrace.crawlers.cancellation import is_race_canceled
+from metaboatrace.crawlers.official.website.v1707.race import crawl_trifecta_odds_page
+
+RACE_DATE = date(2024, 5, 1)
+
+
+@pytest.fixture(autouse=True)
+def redis_client(monkeypatch: pytest.MonkeyPatch) -> Iterator[fakeredis.FakeRedis]:
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(cancellation, "get_redis_client", lambda: client)
+    monkeypatch.setattr(dispatcher, "get_redis_client", lambda: client)
+    monkeypatch.setattr(cancellation, "_unavailable_until", 0.0)
+    yield client
+
+
+def _reserve(race_number: int) -> None:
+    for task_id in scheduler._generate_race_task_ids(1, RACE_DATE, [race_number]):
+        dispatcher.dispatcher.schedule(
+            crawl_trifecta_odds_page.signature([1, RACE_DATE, race_number], task_id=task_id),
+            datetime(2024, 5, 1, 12, tzinfo=UTC),
+        )
+
+
+def test_future_races_are_canceled_without_revoke() -> None:
+    for race_number in range(1, 13):
+        _reserve(race_number)
+
+    with patch.object(scheduler.app.control, "revoke") as revoke:
+        scheduler._revoke_future_race_tasks(1, RACE_DATE, 5)
+
+    revoke.assert_not_called()
+    assert not is_race_canceled(RACE_DATE, 1, 4)
+    assert all(is_race_canceled(RACE_DATE, 1, n) for n in range(5, 13))
+    assert dispatcher.dispatcher.pending() == 4 * 4
+
+
+def test_dispatched_race_tasks_are_revoked_in_one_call() -> None:
+    _reserve(1)
+    dispatcher.dispatcher.cancel(scheduler._generate_race_task_ids(1, RACE_DATE, [1])[2])
+
+    with patch.object(scheduler.app.control, "revoke") as revoke:
+        scheduler._revoke_race_tasks(1, RACE_DATE, 1)
+
+    revoke.assert_called_once_with(
+        [scheduler._generate_race_task_ids(1, RACE_DATE, [1])[2]], terminate=True
+    )
+    assert dispatcher.dispatcher.pending() == 0
+
+
+def test_canceled_race_is_not_fetched() -> None:
+    cancellation.record_race_cancellations(RACE_DATE, 1, [3])
+
+    with patch("metaboatrace.crawlers.official.website.v1707.race.fetch_html_as_io") as fetch:
+        crawl_trifecta_odds_page(1, RACE_DATE, 3)
+
+    fetch.assert_not_called()
+
+
+def test_unavailable_redis_is_treated_as_not_canceled(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = MagicMock()
+    client.exists.side_effect = redis.ConnectionError
+    monkeypatch.setattr(cancellation, "get_redis_client", lambda: client)
+
+    assert not is_race_canceled(RACE_DATE, 1, 3)
+    assert not is_race_canceled(RACE_DATE, 1, 4)
+    client.exists.assert_called_once()
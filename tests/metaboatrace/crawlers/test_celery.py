@@ -0,0 +1,99 @@
+import logging
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+from typing import Any
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.pool import QueuePool
+
+from metaboatrace.crawlers import scheduler
+from metaboatrace.crawlers.celery import BULK_QUEUE, LIVE_QUEUE, RESULT_QUEUE, app
+from metaboatrace.crawlers.official.website.v1707 import race
+from metaboatrace.models.stadium import StadiumTelCode
+from metaboatrace.orm import database
+from metaboatrace.scrapers.official.website.exceptions import DataNotFound
+
+CONCURRENCY = 4
+
+
+@app.task
+def _query_without_closing_session() -> None:
+    # note: リポジトリの upsert と同じく、Session() を閉じずに返す
+    database.Session().execute(text("SELECT 1"))
+
+
+@pytest.fixture(autouse=True)
+def sqlite_engine(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv("DB_POOL_SIZE", str(CONCURRENCY))
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "10")
+    database.reset_engine()
+    yield
+    database.reset_engine()
+
+
+def test_session_is_removed_after_each_task() -> None:
+    engine = database.get_engine()
+    pool = engine.pool
+    assert isinstance(pool, QueuePool)
+    max_checked_out = 0
+    lock = threading.Lock()
+
+    @event.listens_for(engine, "checkout")
+    def record_checked_out(*_: Any) -> None:
+        nonlocal max_checked_out
+        with lock:
+            max_checked_out = max(max_checked_out, pool.checkedout())
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        results = list(executor.map(lambda _: _query_without_closing_session.apply(), range(1000)))
+
+    assert all(result.successful() for result in results)
+    # note: タスクの終わりにセッションを閉じていなければ、同時に取り出すコネクションの数がスレッドの数を超える
+    assert 0 < max_checked_out <= CONCURRENCY
+    stats = database.get_pool_stats()
+    assert stats is not None
+    assert stats.checkouts == 1000
+    assert stats.checked_out == 0
+    assert stats.overflow <= 0
+    assert stats.checked_in <= CONCURRENCY
+
+
+@pytest.mark.parametrize(
+    "task, queue",
+    [
+        (scheduler.crawl_trifecta_odds_page, LIVE_QUEUE),
+        (scheduler.crawl_race_before_information_page, LIVE_QUEUE),
+        (scheduler.dispatch_due_race_tasks, LIVE_QUEUE),
+        (scheduler.crawl_race_result_page, RESULT_QUEUE),
+        (scheduler.crawl_all_race_information_for_date_and_stadiums, BULK_QUEUE),
+        (scheduler.enqueue_incomplete_racer_crawling, BULK_QUEUE),
+    ],
+)
+def test_task_routes(task: Any, queue: str) -> None:
+    assert app.amqp.router.route({}, task.name)["queue"].name == queue
+
+
+def test_race_information_crawl_failures_are_reported_together(
+    monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    def crawl(stadium_tel_code: int, date: date, race_number: int) -> None:
+        if race_number in (3, 7):
+            raise DataNotFound
+
+    monkeypatch.setattr(race, "crawl_race_information_page", crawl)
+    monkeypatch.setattr(app.conf, "task_always_eager", True)
+
+    with caplog.at_level(logging.INFO, logger=race.__name__):
+        race.crawl_all_race_information_for_date_and_stadiums(
+            date(2024, 5, 1), [StadiumTelCode.KIRYU, StadiumTelCode.TODA]
+        )
+
+    [record] = [r for r in caplog.records if r.name == race.__name__]
+    assert record.levelno == logging.ERROR
+    assert record.getMessage().startswith("Failed to crawl 4 of 24 races on 2024-05-01")
+    assert "KIRYU 7R: DataNotFound" in record.getMessage()
@@ -0,0 +1,118 @@
+import time
+from datetime import UTC, date, datetime, timedelta
+from unittest.mock import patch
+
+import fakeredis
+import pytest
+
+from metaboatrace.crawlers.celery import app
+from metaboatrace.crawlers.dispatcher import CLAIM_TIMEOUT, DelayedTaskDispatcher
+
+NOW = datetime(2024, 5, 1, 12, 0, tzinfo=UTC)
+
+
+@app.task
+def _crawl(stadium_tel_code: int, race_holding_date: date, race_number: int) -> None:
+    pass
+
+
+@app.task
+def _on_error(request, exc, traceback):  # type: ignore
+    pass
+
+
+@pytest.fixture
+def dispatcher() -> DelayedTaskDispatcher:
+    return DelayedTaskDispatcher(fakeredis.FakeRedis())
+
+
+def _schedule(dispatcher: DelayedTaskDispatcher, task_id: str, eta: datetime) -> None:
+    dispatcher.schedule(
+        _crawl.signature([1, date(2024, 5, 1), 1], task_id=task_id, link_error=_on_error.s()), eta
+    )
+
+
+def test_dispatches_only_due_tasks(dispatcher: DelayedTaskDispatcher) -> None:
+    _schedule(dispatcher, "odds", NOW - timedelta(seconds=1))
+    _schedule(dispatcher, "result", NOW + timedelta(minutes=25))
+
+    with patch.object(app, "send_task") as send_task:
+        assert dispatcher.dispatch_due(NOW.timestamp()) == 1
+        assert dispatcher.dispatch_due(NOW.timestamp()) == 0
+
+    send_task.assert_called_once()
+    args, kwargs = send_task.call_args
+    assert args[1] == [1, date(2024, 5, 1), 1]
+    assert kwargs["task_id"] == "odds"
+    assert kwargs["link_error"]["task"] == _on_error.name
+    assert dispatcher.pending() == 1
+
+
+def test_reschedule_and_cancel_by_task_id(dispatcher: DelayedTaskDispatcher) -> None:
+    _schedule(dispatcher, "odds", NOW)
+    _schedule(dispatcher, "odds", NOW + timedelta(minutes=5))
+
+    assert dispatcher.pending() == 1
+    assert dispatcher.eta_of("odds") == (NOW + timedelta(minutes=5)).timestamp()
+    assert dispatcher.cancel("odds")
+    assert not dispatcher.cancel("odds")
+    assert dispatcher.pending() == 0
+
+
+def test_naive_eta_is_treated_as_utc(
+    dispatcher: DelayedTaskDispatcher, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # note: ワーカーのローカル時刻が UTC でなくても、予約する時刻がずれないこと
+    monkeypatch.setenv("TZ", "Asia/Tokyo")
+    time.tzset()
+    try:
+        _schedule(dispatcher, "odds", NOW.replace(tzinfo=None))
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+    assert dispatcher.eta_of("odds") == NOW.timestamp()
+
+
+def test_restores_tasks_that_could_not_be_dispatched(dispatcher: DelayedTaskDispatcher) -> None:
+    _schedule(dispatcher, "odds", NOW)
+
+    with (
+        patch.object(app, "send_task", side_effect=ConnectionError),
+        pytest.raises(ConnectionError),
+    ):
+        dispatcher.dispatch_due(NOW.timestamp())
+
+    assert dispatcher.eta_of("odds") == NOW.timestamp()
+    with patch.object(app, "send_task") as send_task:
+        assert dispatcher.dispatch_due(NOW.timestamp()) == 1
+    send_task.assert_called_once()
+
+
+def test_tasks_claimed_by_a_crashed_process_are_dispatched_later(
+    dispatcher: DelayedTaskDispatcher,
+) -> None:
+    _schedule(dispatcher, "odds", NOW)
+
+    # note: キューに入れる前にプロセスが止められた場合 (except Exception では捕まらない)
+    with patch.object(app, "send_task", side_effect=SystemExit), pytest.raises(SystemExit):
+        dispatcher.dispatch_due(NOW.timestamp())
+
+    with patch.object(app, "send_task") as send_task:
+        assert dispatcher.dispatch_due(NOW.timestamp()) == 0
+        assert dispatcher.dispatch_due(NOW.timestamp() + CLAIM_TIMEOUT) == 1
+        assert dispatcher.dispatch_due(NOW.timestamp() + CLAIM_TIMEOUT * 2) == 0
+    send_task.assert_called_once()
+
+
+def test_scripts_are_registered_once(dispatcher: DelayedTaskDispatcher) -> None:
+    client = dispatcher.client
+    with (
+        patch.object(client, "register_script", wraps=client.register_script) as register_script,
+        patch.object(app, "send_task"),
+    ):
+        for task_id in ("odds", "result"):
+            _schedule(dispatcher, task_id, NOW)
+            dispatcher.dispatch_due(NOW.timestamp())
+
+    assert register_script.call_count == 2
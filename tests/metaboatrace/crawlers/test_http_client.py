@@ -0,0 +1,41 @@
+import os
+from collections.abc import Iterator
+
+import pytest
+
+from metaboatrace.crawlers import http_client
+from metaboatrace.crawlers.http_client import get_http_session
+
+
+@pytest.fixture(autouse=True)
+def fresh_session(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    monkeypatch.setattr(http_client, "_session", None)
+    yield
+
+
+def test_session_is_shared_with_a_bounded_pool(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("CRAWLER_HTTP_POOL_MAXSIZE", "3")
+
+    session = get_http_session()
+
+    assert get_http_session() is session
+    adapter = session.get_adapter("https://www.boatrace.jp/")
+    assert adapter._pool_maxsize == 3  # type: ignore[attr-defined]
+    assert adapter._pool_block is True  # type: ignore[attr-defined]
+
+
+def test_session_is_recreated_after_fork() -> None:
+    session = get_http_session()
+    read_fd, write_fd = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        recreated = get_http_session() is not session
+        os.write(write_fd, b"1" if recreated else b"0")
+        os._exit(0)
+
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 1) == b"1"
+    assert get_http_session() is session
@@ -0,0 +1,75 @@
+import io
+from collections.abc import Callable
+from datetime import date
+from pathlib import Path
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from bs4 import BeautifulSoup
+
+from metaboatrace.crawlers import parsing
+from metaboatrace.crawlers.official.website.v1707.race import (
+    scrape_race_before_information_page,
+    scrape_race_information_page,
+    scrape_race_result_page,
+)
+from metaboatrace.crawlers.parsing import PARSER, HtmlDocument
+from metaboatrace.scrapers.official.website.v1707 import decorators
+
+FIXTURES = Path(__file__).parent / "fixtures"
+RACE_MODULE = "metaboatrace.crawlers.official.website.v1707.race"
+
+HTML = "<html><body><div class='l-main'>本日のレース</div></body></html>"
+
+
+def test_html_document_is_parsed_once() -> None:
+    document = HtmlDocument(HTML)
+
+    assert decorators.BeautifulSoup(document, "html.parser") is document.soup
+    assert decorators.BeautifulSoup(document, "html.parser") is document.soup
+
+
+def test_other_inputs_are_parsed_as_before() -> None:
+    file = io.StringIO(HTML)
+    soup = decorators.BeautifulSoup(file, "html.parser")
+
+    assert soup.select_one(".l-main").get_text() == "本日のレース"
+    assert decorators.BeautifulSoup(io.StringIO(HTML), "html.parser") is not soup
+
+
+@pytest.mark.parametrize(
+    ("fixture", "scrape", "args"),
+    [
+        ("racelist.html", scrape_race_information_page, (14, date(2024, 1, 4), 8)),
+        ("beforeinfo.html", scrape_race_before_information_page, (3, date(2024, 3, 22), 8)),
+        ("raceresult.html", scrape_race_result_page, (16, date(2023, 12, 4), 5)),
+    ],
+)
+def test_scrapers_do_not_mutate_the_shared_tree(
+    fixture: str, scrape: Callable[..., Any], args: tuple[Any, ...]
+) -> None:
+    html = (FIXTURES / fixture).read_text()
+    document = HtmlDocument(html)
+
+    def fetch_shared_document(url: str) -> HtmlDocument:
+        document.seek(0)
+        return document
+
+    with patch(f"{RACE_MODULE}.fetch_html_as_io", side_effect=lambda url: io.StringIO(html)):
+        expected = scrape(*args)
+    with patch(f"{RACE_MODULE}.fetch_html_as_io", side_effect=fetch_shared_document):
+        # note: 同じ木を2回解析しても、1回目の extract_* が木を書き換えていれば結果が変わる
+        assert scrape(*args) == expected
+        assert scrape(*args) == expected
+
+    assert str(document.soup) == str(BeautifulSoup(html, PARSER))
+
+
+def test_install_fails_when_a_scraper_module_no_longer_uses_beautiful_soup(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.delattr(decorators, "BeautifulSoup")
+
+    with pytest.raises(ImportError, match="decorators"):
+        parsing.install()
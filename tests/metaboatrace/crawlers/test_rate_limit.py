@@ -0,0 +1,124 @@
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import fakeredis
+import pytest
+import redis
+
+from metaboatrace.crawlers.rate_limit import (
+    InProcessTokenBucket,
+    Rate,
+    RateLimiter,
+    RedisTokenBucket,
+    jst,
+    parse_rate_limits,
+)
+
+ODDS_URL = "https://boatrace.jp/owpc/pc/race/odds3t?rno=1&jcd=01&hd=20240501"
+PROFILE_URL = "https://boatrace.jp/owpc/pc/data/racersearch/profile?toban=4444"
+
+
+def test_parse_rate_limits() -> None:
+    assert parse_rate_limits("*=2/5, profile=0.5") == {
+        "*": Rate(2, 5),
+        "profile": Rate(0.5, 1),
+    }
+
+
+@pytest.mark.parametrize(
+    "bucket", [RedisTokenBucket(fakeredis.FakeRedis()), InProcessTokenBucket()]
+)
+def test_bucket_allows_burst_then_reserves_slots(bucket: RedisTokenBucket) -> None:
+    rate = Rate(2, 3)
+
+    waits = [bucket.reserve("host:boatrace.jp", rate) for _ in range(5)]
+
+    assert waits[:3] == [0, 0, 0]
+    assert waits[3] == pytest.approx(0.5, abs=0.05)
+    assert waits[4] == pytest.approx(1.0, abs=0.05)
+
+
+@pytest.mark.parametrize(
+    "bucket", [RedisTokenBucket(fakeredis.FakeRedis()), InProcessTokenBucket()]
+)
+def test_bucket_does_not_reserve_beyond_max_wait(bucket: RedisTokenBucket) -> None:
+    rate = Rate(2, 1)
+
+    waits = [bucket.reserve("host:boatrace.jp", rate, max_wait=0.6) for _ in range(4)]
+
+    assert waits[:2] == [0, pytest.approx(0.5, abs=0.05)]
+    assert waits[2:] == [None, None]
+    assert bucket.reserve("host:boatrace.jp", rate) == pytest.approx(1.0, abs=0.05)
+
+
+def _fake_clock() -> MagicMock:
+    clock = MagicMock()
+    clock.monotonic.return_value = 0.0
+    clock.sleep.side_effect = lambda seconds: setattr(
+        clock.monotonic, "return_value", clock.monotonic.return_value + seconds
+    )
+    return clock
+
+
+def test_live_pages_do_not_queue_behind_bulk_reservations() -> None:
+    live_url = ODDS_URL.replace("hd=20240501", f"hd={datetime.now(jst):%Y%m%d}")
+    bucket = InProcessTokenBucket()
+    limiter = RateLimiter({"*": Rate(1, 1)}, {}, bucket, max_wait=1)
+
+    with patch("metaboatrace.crawlers.rate_limit.time", _fake_clock()):
+        # note: 一括取得をするプロセスが同時に予約しても、max_wait 秒より先は予約されない
+        waits = [bucket.reserve("host:boatrace.jp", Rate(1, 1), max_wait=1) for _ in range(5)]
+        assert waits == [0, 1, None, None, None]
+
+        assert limiter.acquire(live_url) == 2
+
+
+def test_bulk_pages_retry_until_the_reservation_fits_in_max_wait() -> None:
+    bucket = InProcessTokenBucket()
+    limiter = RateLimiter({"*": Rate(1, 1)}, {}, bucket, max_wait=1)
+    clock = _fake_clock()
+
+    with patch("metaboatrace.crawlers.rate_limit.time", clock):
+        for _ in range(3):
+            bucket.reserve("host:boatrace.jp", Rate(1, 1))
+
+        assert limiter.acquire(ODDS_URL) == 3
+
+    assert [call.args[0] for call in clock.sleep.call_args_list] == [1, 1, 1]
+
+
+def test_script_is_registered_once_per_client() -> None:
+    client = fakeredis.FakeRedis()
+    bucket = RedisTokenBucket(client)
+
+    with patch.object(client, "register_script", wraps=client.register_script) as register:
+        for _ in range(3):
+            bucket.reserve("host:boatrace.jp", Rate(2, 3))
+
+    register.assert_called_once()
+
+
+def test_page_type_bucket_is_consulted_with_host_bucket() -> None:
+    limiter = RateLimiter(
+        {"*": Rate(100, 100)}, {"profile": Rate(1, 1)}, RedisTokenBucket(fakeredis.FakeRedis())
+    )
+
+    with patch("metaboatrace.crawlers.rate_limit.time.sleep") as sleep:
+        assert limiter.acquire(ODDS_URL) == 0
+        assert limiter.acquire(ODDS_URL) == 0
+        assert limiter.acquire(PROFILE_URL) == 0
+        assert limiter.acquire(PROFILE_URL) == pytest.approx(1.0, abs=0.05)
+
+    sleep.assert_called_once()
+
+
+def test_falls_back_to_in_process_bucket_while_redis_is_unavailable() -> None:
+    bucket = MagicMock()
+    bucket.reserve.side_effect = redis.ConnectionError
+    limiter = RateLimiter({"*": Rate(1, 1)}, {}, bucket)
+
+    with patch("metaboatrace.crawlers.rate_limit.time.sleep"):
+        assert limiter.acquire(ODDS_URL) == 0
+        assert limiter.acquire(ODDS_URL) == pytest.approx(1.0, abs=0.05)
+
+    bucket.reserve.assert_called_once()
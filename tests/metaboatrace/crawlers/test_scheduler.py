@@ -0,0 +1,22 @@
+from datetime import date
+from unittest.mock import Mock, patch
+
+from metaboatrace.crawlers.exceptions import RaceDeadlineChanged
+from metaboatrace.crawlers.scheduler import _race_task_failure_handler
+from metaboatrace.orm import database
+
+MODULE = "metaboatrace.crawlers.scheduler"
+RACE_DATE = date(2024, 5, 1)
+
+
+def test_rescheduled_race_is_read_from_the_primary() -> None:
+    pinned: list[bool] = []
+
+    def find_by_key(*args: object) -> None:
+        pinned.append(database._pinned_to_primary.get())
+
+    with patch(f"{MODULE}.RaceRepository") as race_repository:
+        race_repository.return_value.find_by_key.side_effect = find_by_key
+        _race_task_failure_handler(Mock(args=(1, RACE_DATE, 1)), RaceDeadlineChanged(), None)
+
+    assert pinned == [True]
@@ -0,0 +1,89 @@
+import os
+from collections.abc import Iterator
+from datetime import date
+from typing import Any
+
+import pytest
+from sqlalchemy import create_engine, delete, event, select
+
+from metaboatrace.orm import database
+from metaboatrace.orm.database import Base, Session
+from metaboatrace.orm.models.race import Race
+from metaboatrace.orm.strategies.bulk_load import postgresql_copy_upsert_strategy
+from metaboatrace.orm.strategies.upsert import WrittenRows, get_written_rows
+from metaboatrace.orm.unit_of_work import unit_of_work
+
+# note: Postgres が必要なので TEST_DATABASE_URL を指定したときだけ実行する (docker compose の db など)
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(TEST_DATABASE_URL is None, reason="TEST_DATABASE_URL is not set")
+
+RACE_DATE = date(1970, 1, 2)
+
+
+@pytest.fixture(autouse=True)
+def postgresql_database(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    assert TEST_DATABASE_URL is not None
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    # note: 1行でも COPY を使わせる
+    monkeypatch.setenv("BULK_LOAD_MIN_ROWS", "1")
+    database.reset_engine()
+
+    engine = create_engine(TEST_DATABASE_URL)
+    Base.metadata.create_all(engine, tables=[Race.__table__])
+    yield
+    database.reset_engine()
+    with engine.begin() as connection:
+        connection.execute(delete(Race).where(Race.date == RACE_DATE))
+    engine.dispose()
+
+
+def test_python_defaults_are_filled_for_partial_rows() -> None:
+    # note: 中止になったレースのように、タイトルなどが欠けた行
+    with unit_of_work() as session:
+        postgresql_copy_upsert_strategy(
+            session, Race, [{"stadium_tel_code": 1, "date": RACE_DATE, "race_number": 1}], []
+        )
+
+    session = Session()
+    try:
+        race = session.execute(select(Race).where(Race.date == RACE_DATE)).scalar_one()
+        assert race.is_course_fixed is False
+        assert race.is_stabilizer_used is False
+        assert race.number_of_laps == 3
+        assert race.created_at is not None
+        assert race.updated_at is not None
+    finally:
+        session.close()
+
+
+def test_written_rows_are_counted_on_the_session() -> None:
+    race = {"stadium_tel_code": 1, "date": RACE_DATE, "race_number": 1, "title": "予選"}
+
+    with unit_of_work() as session:
+        for title in ("予選", "予選", "一般戦"):
+            postgresql_copy_upsert_strategy(
+                session, Race, [{**race, "title": title}], ["title"], skip_unchanged=True
+            )
+
+        assert get_written_rows(session) == {
+            "races": WrittenRows(inserted=1, updated=1, unchanged=1)
+        }
+
+
+def test_small_writes_do_not_create_a_staging_table(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("BULK_LOAD_MIN_ROWS", "2")
+    statements: list[str] = []
+
+    def record(conn: Any, cursor: Any, statement: str, *_: Any) -> None:
+        statements.append(statement)
+
+    event.listen(database.get_engine(), "before_cursor_execute", record)
+    race = {"stadium_tel_code": 1, "date": RACE_DATE, "title": "予選"}
+    with unit_of_work() as session:
+        postgresql_copy_upsert_strategy(session, Race, [{**race, "race_number": 1}], [])
+        postgresql_copy_upsert_strategy(
+            session, Race, [{**race, "race_number": 2}, {**race, "race_number": 3}], []
+        )
+
+    assert sum("CREATE TEMPORARY TABLE" in statement for statement in statements) == 1
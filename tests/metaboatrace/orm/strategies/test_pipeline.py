@@ -0,0 +1,100 @@
+import os
+from collections.abc import Iterator
+from datetime import date, datetime, time
+
+import pytest
+from sqlalchemy import create_engine, delete, make_url, select
+from sqlalchemy.exc import DataError
+
+from metaboatrace.orm import database
+from metaboatrace.orm.database import Base, Session
+from metaboatrace.orm.models.race import Race
+from metaboatrace.orm.strategies.pipeline import _PIPELINE_KEY, psycopg_pipeline_upsert_strategy
+from metaboatrace.orm.unit_of_work import unit_of_work
+
+# note: Postgres が必要なので TEST_DATABASE_URL を指定したときだけ実行する (docker compose の db など)
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(TEST_DATABASE_URL is None, reason="TEST_DATABASE_URL is not set")
+
+RACE_DATE = date(1970, 1, 1)
+
+
+@pytest.fixture(autouse=True)
+def psycopg_database(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    assert TEST_DATABASE_URL is not None
+    url = make_url(TEST_DATABASE_URL).set(drivername="postgresql+psycopg")
+    monkeypatch.setenv("DATABASE_URL", url.render_as_string(hide_password=False))
+    database.reset_engine()
+
+    engine = create_engine(TEST_DATABASE_URL)
+    Base.metadata.create_all(engine, tables=[Race.__table__])
+    yield
+    database.reset_engine()
+    with engine.begin() as connection:
+        connection.execute(delete(Race).where(Race.date == RACE_DATE))
+    engine.dispose()
+
+
+def _race(race_number: int, title: str) -> dict[str, object]:
+    return {
+        "stadium_tel_code": 1,
+        "date": RACE_DATE,
+        "race_number": race_number,
+        "title": title,
+        "betting_deadline_at": datetime.combine(RACE_DATE, time(15, 0)),
+    }
+
+
+def _titles() -> list[tuple[int, str]]:
+    session = Session()
+    try:
+        rows = session.execute(
+            select(Race.race_number, Race.title).where(Race.date == RACE_DATE)
+        ).all()
+        return sorted((race_number, title) for race_number, title in rows)
+    finally:
+        session.close()
+
+
+def test_writes_in_unit_of_work_are_committed_together() -> None:
+    with unit_of_work() as session:
+        psycopg_pipeline_upsert_strategy(session, Race, [_race(1, "予選"), _race(2, "予選")], [])
+        psycopg_pipeline_upsert_strategy(session, Race, [_race(1, "一般戦")], ["title"])
+
+    assert _titles() == [(1, "一般戦"), (2, "予選")]
+
+
+def test_error_rolls_back_the_unit_of_work() -> None:
+    with pytest.raises(DataError), unit_of_work() as session:
+        psycopg_pipeline_upsert_strategy(session, Race, [_race(1, "予選")], ["title"])
+        # note: title は VARCHAR(255) なので失敗する
+        psycopg_pipeline_upsert_strategy(session, Race, [_race(2, "予" * 256)], ["title"])
+
+    assert _titles() == []
+
+
+def test_upserts_in_unit_of_work_share_one_pipeline() -> None:
+    with unit_of_work() as session:
+        psycopg_pipeline_upsert_strategy(session, Race, [_race(1, "予選")], [])
+        pipeline = session.info[_PIPELINE_KEY]
+        psycopg_pipeline_upsert_strategy(session, Race, [_race(2, "予選")], [])
+
+        # note: 2回目の upsert の前に応答を待っていれば、パイプラインは閉じられている
+        assert session.info[_PIPELINE_KEY] is pipeline
+        driver_connection = session.connection().connection.driver_connection
+        assert driver_connection.pgconn.pipeline_status != 0  # type: ignore[union-attr]
+
+    assert driver_connection.pgconn.pipeline_status == 0  # type: ignore[union-attr]
+    assert _titles() == [(1, "予選"), (2, "予選")]
+
+
+def test_pending_error_is_discarded_when_rolling_back_for_another_error() -> None:
+    with pytest.raises(RuntimeError), unit_of_work() as session:
+        psycopg_pipeline_upsert_strategy(session, Race, [_race(1, "予" * 256)], ["title"])
+        driver_connection = session.connection().connection.driver_connection
+        raise RuntimeError
+
+    assert driver_connection.pgconn.pipeline_status == 0  # type: ignore[union-attr]
+    assert _PIPELINE_KEY not in session.info
+    assert _titles() == []
@@ -0,0 +1,134 @@
+import os
+from datetime import date
+from unittest.mock import patch
+
+import pytest
+import sqlalchemy.dialects.postgresql as postgresql
+from sqlalchemy import create_engine, delete, event
+from sqlalchemy.orm import Session
+
+from metaboatrace.orm.database import Base
+from metaboatrace.orm.models.race import Odds, Race
+from metaboatrace.orm.models.racer import Racer
+from metaboatrace.orm.strategies import upsert
+from metaboatrace.orm.strategies.upsert import (
+    _deduplicate_by_keys,
+    _get_primary_keys,
+    _get_upsert_statement,
+    _on_conflict,
+    create_upsert_strategy,
+)
+
+# note: Postgres が必要なテストは TEST_DATABASE_URL を指定したときだけ実行する (docker compose の db など)
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+RACE_DATE = date(1970, 1, 3)
+
+VALUES = [
+    {
+        "stadium_tel_code": 1,
+        "date": "2023-11-24",
+        "race_number": 1,
+        "betting_method": 1,
+        "betting_number": 123,
+        "ratio": 12.3,
+    }
+]
+
+
+def _compile(skip_unchanged: bool) -> str:
+    statement = _on_conflict(
+        postgresql.insert(Odds).values(VALUES),
+        Odds.__table__,
+        ["stadium_tel_code", "date", "race_number", "betting_method", "betting_number"],
+        ["ratio"],
+        skip_unchanged,
+    )
+    return str(statement.compile(dialect=postgresql.dialect()))  # type: ignore[attr-defined]
+
+
+def test_skip_unchanged_updates_only_distinct_rows() -> None:
+    sql = _compile(skip_unchanged=True)
+
+    assert "WHERE odds.ratio IS DISTINCT FROM excluded.ratio" in sql
+    assert "updated_at = excluded.updated_at" in sql
+    assert "RETURNING xmax = 0 AS inserted" in sql
+
+
+def test_without_skip_unchanged() -> None:
+    sql = _compile(skip_unchanged=False)
+
+    assert "DO UPDATE SET ratio = excluded.ratio" in sql
+    assert "IS DISTINCT FROM" not in sql
+    assert "RETURNING" not in sql
+
+
+def test_upsert_statement_is_built_once_per_model_and_columns() -> None:
+    statement = _get_upsert_statement(Odds, ["ratio"], [], "postgresql", True)
+
+    assert _get_upsert_statement(Odds, ["ratio"], [], "postgresql", True) is statement
+    assert _get_upsert_statement(Odds, ["ratio"], [], "postgresql", False) is not statement
+    assert _get_upsert_statement(Odds, ["ratio"], [], "mysql", False) is not statement
+
+
+def test_cached_statement_is_not_rebuilt(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(upsert, "_upsert_statements", {})
+
+    with patch.object(
+        upsert, "_build_upsert_statement", wraps=upsert._build_upsert_statement
+    ) as build:
+        statement = _get_upsert_statement(Odds, ["ratio"], [], "postgresql", True)
+        assert _get_upsert_statement(Odds, ["ratio"], [], "postgresql", True) is statement
+
+    build.assert_called_once()
+
+
+def test_fill_if_null_keeps_existing_value() -> None:
+    statement = _on_conflict(
+        postgresql.insert(Racer),
+        Racer.__table__,
+        ["registration_number"],
+        ["last_name", "status"],
+        True,
+        ["gender"],
+    )
+    sql = str(statement.compile(dialect=postgresql.dialect()))  # type: ignore[attr-defined]
+
+    assert "gender = coalesce(racers.gender, excluded.gender)" in sql
+    assert "racers.gender IS DISTINCT FROM coalesce(racers.gender, excluded.gender)" in sql
+
+
+def test_rows_with_the_same_key_keep_the_last_one() -> None:
+    rows = [
+        {**VALUES[0], "ratio": 1.0},
+        {**VALUES[0], "betting_number": 124},
+        {**VALUES[0], "ratio": 2.0},
+    ]
+
+    deduplicated = _deduplicate_by_keys(rows, _get_primary_keys(Odds))
+
+    assert deduplicated == [{**VALUES[0], "ratio": 2.0}, {**VALUES[0], "betting_number": 124}]
+
+
+@pytest.mark.skipif(TEST_DATABASE_URL is None, reason="TEST_DATABASE_URL is not set")
+def test_rows_are_sent_in_chunks(monkeypatch: pytest.MonkeyPatch) -> None:
+    assert TEST_DATABASE_URL is not None
+    monkeypatch.setenv("UPSERT_CHUNK_SIZE", "2")
+    engine = create_engine(TEST_DATABASE_URL)
+    Base.metadata.create_all(engine, tables=[Race.__table__])
+    statements: list[str] = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    rows = [
+        {"stadium_tel_code": 1, "date": RACE_DATE, "race_number": race_number, "title": "予選"}
+        for race_number in range(1, 6)
+    ]
+
+    session = Session(engine)
+    try:
+        create_upsert_strategy()(session, Race, rows, ["title"])
+        assert len([s for s in statements if s.startswith("INSERT")]) == 3
+    finally:
+        session.execute(delete(Race).where(Race.date == RACE_DATE))
+        session.commit()
+        session.close()
+        engine.dispose()
@@ -0,0 +1,105 @@
+import os
+import sqlite3
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+from sqlalchemy import exc, text
+
+from metaboatrace.orm import database
+from metaboatrace.orm.pool import InstrumentedQueuePool
+from metaboatrace.orm.unit_of_work import unit_of_work
+
+
+@pytest.fixture(autouse=True)
+def sqlite_engine(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv("DB_POOL_SIZE", "2")
+    database.reset_engine()
+    yield
+    database.reset_engine()
+
+
+def test_engine_is_created_lazily_once_per_process() -> None:
+    assert database.get_pool_stats() is None
+
+    engine = database.get_engine()
+
+    assert database.get_engine() is engine
+    assert database.engine is engine
+    assert engine.pool.size() == 2
+
+
+def test_engine_is_recreated_after_fork() -> None:
+    engine = database.get_engine()
+    read_fd, write_fd = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        recreated = database.get_engine() is not engine
+        os.write(write_fd, b"1" if recreated else b"0")
+        os._exit(0)
+
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 1) == b"1"
+    assert database.get_engine() is engine
+
+
+def test_pool_stats() -> None:
+    session = database.Session()
+    session.execute(text("SELECT 1"))
+
+    stats = database.get_pool_stats()
+
+    assert stats is not None
+    assert stats.checkouts == 1
+    assert stats.checked_out == 1
+    session.close()
+    stats = database.get_pool_stats()
+    assert stats is not None
+    assert stats.checked_out == 0
+
+
+def test_read_session_uses_primary_without_replica() -> None:
+    assert database.ReadSession() is database.Session()
+    assert database.get_read_engine() is database.get_engine()
+
+
+def test_read_session_is_routed_to_replica(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("DATABASE_REPLICA_URL", f"sqlite:///{tmp_path / 'replica.db'}")
+    for session, name in ((database.Session(), "primary"), (database.ReadSession(), "replica")):
+        session.execute(text("CREATE TABLE role (name TEXT)"))
+        session.execute(text("INSERT INTO role VALUES (:name)"), {"name": name})
+        session.commit()
+
+    assert database.ReadSession().execute(text("SELECT name FROM role")).scalar() == "replica"
+    with database.pin_to_primary():
+        assert database.ReadSession() is database.Session()
+        assert database.ReadSession().execute(text("SELECT name FROM role")).scalar() == "primary"
+    with unit_of_work() as session:
+        assert database.ReadSession() is session
+
+    assert database.get_replica_pool_stats() is not None
+    database.ReadSession.remove()
+    database.Session.remove()
+
+
+def test_only_pool_timeouts_are_counted() -> None:
+    def connect() -> sqlite3.Connection:
+        if failing:
+            raise sqlite3.OperationalError("unable to open database file")
+        return sqlite3.connect(":memory:")
+
+    pool = InstrumentedQueuePool(connect, pool_size=1, max_overflow=0, timeout=0.01)
+    failing = True
+    with pytest.raises(sqlite3.OperationalError):
+        pool.connect()
+    failing = False
+    connection = pool.connect()
+    with pytest.raises(exc.TimeoutError):
+        pool.connect()
+    connection.close()
+
+    assert pool.stats().timeouts == 1
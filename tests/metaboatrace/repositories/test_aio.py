@@ -0,0 +1,97 @@
+import asyncio
+import os
+from collections.abc import Iterator
+from datetime import date, datetime, time
+
+import pytest
+from sqlalchemy import create_engine, delete
+
+from metaboatrace.models.race import RaceInformation
+from metaboatrace.models.stadium import StadiumTelCode
+from metaboatrace.orm.async_database import async_unit_of_work, dispose_async_engine
+from metaboatrace.orm.database import Base
+from metaboatrace.orm.models.race import Race
+from metaboatrace.repositories.aio import AsyncRaceRepository
+
+# note: Postgres が必要なので TEST_DATABASE_URL を指定したときだけ実行する (docker compose の db など)
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(TEST_DATABASE_URL is None, reason="TEST_DATABASE_URL is not set")
+
+RACE_DATE = date(1970, 1, 1)
+
+
+@pytest.fixture(autouse=True)
+def database(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    assert TEST_DATABASE_URL is not None
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    monkeypatch.delenv("ASYNC_DATABASE_URL", raising=False)
+    monkeypatch.delenv("UPSERT_MODE", raising=False)
+
+    engine = create_engine(TEST_DATABASE_URL)
+    Base.metadata.create_all(engine, tables=[Race.__table__])
+    yield
+    with engine.begin() as connection:
+        connection.execute(delete(Race).where(Race.date == RACE_DATE))
+    engine.dispose()
+
+
+def _race(race_number: int, title: str) -> RaceInformation:
+    return RaceInformation(
+        race_holding_date=RACE_DATE,
+        stadium_tel_code=StadiumTelCode.KIRYU,
+        race_number=race_number,
+        title=title,
+        number_of_laps=3,
+        deadline_at=datetime.combine(RACE_DATE, time(15, 0)),
+        is_course_fixed=False,
+        use_stabilizer=False,
+    )
+
+
+def test_create_or_update_and_find() -> None:
+    async def run() -> list[RaceInformation]:
+        repository = AsyncRaceRepository()
+        await repository.create_or_update_many([_race(1, "予選"), _race(2, "予選")])
+        await repository.create_or_update(_race(1, "一般戦"))
+        await repository.cancel(StadiumTelCode.KIRYU.value, RACE_DATE, 2)
+        races = await repository.find_all_by_date(RACE_DATE)
+        await dispose_async_engine()
+        return races
+
+    races = sorted(asyncio.run(run()), key=lambda race: race.race_number)
+
+    assert [(race.race_number, race.title) for race in races] == [(1, "一般戦"), (2, "予選")]
+
+
+def test_unit_of_work_rolls_back_all_writes() -> None:
+    async def run() -> RaceInformation | None:
+        repository = AsyncRaceRepository()
+        with pytest.raises(RuntimeError):
+            async with async_unit_of_work():
+                await repository.create_or_update(_race(1, "予選"))
+                raise RuntimeError
+        race = await repository.find_by_key(StadiumTelCode.KIRYU.value, RACE_DATE, 1)
+        await dispose_async_engine()
+        return race
+
+    assert asyncio.run(run()) is None
+
+
+def test_concurrent_units_of_work_do_not_share_sessions() -> None:
+    async def write(race_number: int) -> int:
+        async with async_unit_of_work() as session:
+            await AsyncRaceRepository().create_or_update(_race(race_number, "予選"))
+            await asyncio.sleep(0)
+            return id(session)
+
+    async def run() -> tuple[list[int], list[RaceInformation]]:
+        session_ids = await asyncio.gather(*(write(race_number) for race_number in range(1, 13)))
+        races = await AsyncRaceRepository().find_all_by_date(RACE_DATE)
+        await dispose_async_engine()
+        return session_ids, races
+
+    session_ids, races = asyncio.run(run())
+
+    assert len(set(session_ids)) == 12
+    assert len(races) == 12
@@ -0,0 +1,59 @@
+from collections.abc import Iterator
+from datetime import date
+from pathlib import Path
+from typing import Any
+
+import pytest
+from sqlalchemy import event
+
+from metaboatrace.orm import database
+from metaboatrace.orm.database import Base
+from metaboatrace.orm.models.boat import BoatSetting
+from metaboatrace.repositories import BoatSettingRepository
+
+RACE_DATE = date(2024, 5, 1)
+
+
+def _boat_setting(pit_number: int, motor_number: int | None) -> dict[str, Any]:
+    return {
+        "stadium_tel_code": 1,
+        "date": RACE_DATE,
+        "race_number": 1,
+        "pit_number": pit_number,
+        "motor_number": motor_number,
+    }
+
+
+@pytest.fixture(autouse=True)
+def sqlite_engine(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    database.reset_engine()
+    engine = database.get_engine()
+    Base.metadata.create_all(engine, tables=[BoatSetting.__table__])
+    with engine.begin() as connection:
+        connection.execute(
+            BoatSetting.__table__.insert(),
+            [_boat_setting(1, 11), _boat_setting(2, 22), _boat_setting(3, None)],
+        )
+    yield
+    database.reset_engine()
+
+
+def test_get_motor_numbers_in_one_query() -> None:
+    statements: list[str] = []
+
+    def record(conn: Any, cursor: Any, statement: str, *_: Any) -> None:
+        statements.append(statement)
+
+    event.listen(database.get_engine(), "before_cursor_execute", record)
+    motor_numbers = BoatSettingRepository().get_motor_numbers(
+        [(1, RACE_DATE, 1, pit_number) for pit_number in (1, 2, 3, 4)]
+    )
+
+    # note: モーター番号が NULL の枠と、登録されていない枠は含まない
+    assert motor_numbers == {(1, RACE_DATE, 1, 1): 11, (1, RACE_DATE, 1, 2): 22}
+    assert len(statements) == 1
+
+
+def test_get_motor_numbers_without_keys() -> None:
+    assert BoatSettingRepository().get_motor_numbers([]) == {}
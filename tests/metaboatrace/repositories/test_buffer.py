@@ -0,0 +1,157 @@
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from metaboatrace.orm import database
+from metaboatrace.orm.models.race import Odds
+from metaboatrace.orm.unit_of_work import unit_of_work
+from metaboatrace.repositories import buffer
+from metaboatrace.repositories.buffer import (
+    WriteBehindBuffer,
+    create_write_behind_upsert_strategy,
+    flush_write_behind_buffer,
+    get_write_behind_buffer,
+    write_through,
+)
+
+KEY = (Odds, ("ratio",), ())
+
+
+def _odds(betting_number: int, ratio: float) -> dict[str, Any]:
+    return {
+        "stadium_tel_code": 1,
+        "date": "2024-01-01",
+        "race_number": 1,
+        "betting_method": 1,
+        "betting_number": betting_number,
+        "ratio": ratio,
+    }
+
+
+class RecordingStrategy:
+    def __init__(self, error: Exception | None = None) -> None:
+        self.calls: list[tuple[Any, list[dict[str, Any]], list[str]]] = []
+        self.error = error
+
+    def __call__(
+        self,
+        session: Any,
+        model: Any,
+        values: list[dict[str, Any]],
+        on_duplicate_key_update: list[str],
+        fill_if_null: list[str] | None = None,
+    ) -> bool:
+        if self.error is not None:
+            raise self.error
+        self.calls.append((model, values, on_duplicate_key_update))
+        return True
+
+
+@pytest.fixture
+def strategy(monkeypatch: pytest.MonkeyPatch) -> RecordingStrategy:
+    recording = RecordingStrategy()
+    monkeypatch.setattr(buffer, "create_upsert_strategy", lambda skip_unchanged: recording)
+    return recording
+
+
+@pytest.fixture(autouse=True)
+def sqlite_engine(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv("WRITE_BEHIND_ENABLED", "true")
+    monkeypatch.setenv("WRITE_BEHIND_FLUSH_INTERVAL", "3600")
+    database.reset_engine()
+    yield
+    flush_write_behind_buffer()
+    database.reset_engine()
+
+
+def test_flush_coalesces_rows_with_the_same_key(strategy: RecordingStrategy) -> None:
+    write_behind_buffer = WriteBehindBuffer(flush_interval=3600, max_rows=100)
+    write_behind_buffer.add(KEY, [_odds(123, 1.0), _odds(124, 1.0)])
+    write_behind_buffer.add(KEY, [_odds(123, 2.0)])
+
+    assert write_behind_buffer.pending_rows() == 2
+    assert write_behind_buffer.flush() == 2
+    assert strategy.calls == [(Odds, [_odds(123, 2.0), _odds(124, 1.0)], ["ratio"])]
+    assert write_behind_buffer.pending_rows() == 0
+
+
+def test_failed_flush_keeps_rows_without_overwriting_newer_values(
+    strategy: RecordingStrategy,
+) -> None:
+    write_behind_buffer = WriteBehindBuffer(flush_interval=3600, max_rows=100)
+    write_behind_buffer.add(KEY, [_odds(123, 1.0), _odds(124, 1.0)])
+    strategy.error = RuntimeError("database is down")
+
+    with pytest.raises(RuntimeError):
+        write_behind_buffer.flush()
+    write_behind_buffer.add(KEY, [_odds(123, 3.0)])
+    strategy.error = None
+    write_behind_buffer.flush()
+
+    assert strategy.calls == [(Odds, [_odds(123, 3.0), _odds(124, 1.0)], ["ratio"])]
+
+
+def test_writes_in_unit_of_work_are_buffered_only_after_commit(
+    strategy: RecordingStrategy,
+) -> None:
+    upsert = create_write_behind_upsert_strategy()
+
+    with pytest.raises(RuntimeError), unit_of_work() as session:
+        upsert(session, Odds, [_odds(123, 1.0)], ["ratio"])
+        raise RuntimeError
+    with unit_of_work() as session:
+        upsert(session, Odds, [_odds(124, 1.0)], ["ratio"])
+        assert get_write_behind_buffer().pending_rows() == 0
+
+    assert get_write_behind_buffer().pending_rows() == 1
+    flush_write_behind_buffer()
+    assert strategy.calls == [(Odds, [_odds(124, 1.0)], ["ratio"])]
+
+
+def test_write_through_skips_the_buffer(strategy: RecordingStrategy) -> None:
+    upsert = create_write_behind_upsert_strategy()
+
+    with write_through():
+        upsert(database.Session(), Odds, [_odds(123, 1.0)], ["ratio"])
+
+    assert strategy.calls == [(Odds, [_odds(123, 1.0)], ["ratio"])]
+    assert get_write_behind_buffer().pending_rows() == 0
+
+
+def test_rows_that_keep_failing_are_spooled_without_blocking_other_rows(
+    strategy: RecordingStrategy, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    bad_key = (Odds, (), ())
+    spooled: list[tuple[Any, list[dict[str, Any]]]] = []
+
+    class SpoolWriter:
+        def append(self, key: Any, values: list[dict[str, Any]]) -> None:
+            spooled.append((key, values))
+
+    def upsert(
+        session: Any, model: Any, values: Any, on_duplicate_key_update: Any, *_: Any
+    ) -> bool:
+        if not on_duplicate_key_update:
+            raise RuntimeError("invalid row")
+        strategy.calls.append((model, values, on_duplicate_key_update))
+        return True
+
+    monkeypatch.setattr(buffer, "create_upsert_strategy", lambda skip_unchanged: upsert)
+    monkeypatch.setattr(buffer, "get_spool_writer", SpoolWriter)
+    write_behind_buffer = WriteBehindBuffer(flush_interval=3600, max_rows=100, max_retries=2)
+    write_behind_buffer.add(bad_key, [_odds(999, 1.0)])
+
+    for ratio in (1.0, 2.0):
+        write_behind_buffer.add(KEY, [_odds(123, ratio)])
+        with pytest.raises(RuntimeError):
+            write_behind_buffer.flush()
+
+    assert strategy.calls == [
+        (Odds, [_odds(123, 1.0)], ["ratio"]),
+        (Odds, [_odds(123, 2.0)], ["ratio"]),
+    ]
+    assert spooled == [(bad_key, [_odds(999, 1.0)])]
+    assert write_behind_buffer.pending_rows() == 0